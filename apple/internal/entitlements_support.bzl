@@ -311,6 +311,7 @@ def _process_entitlements(
         )
 
     control = struct(
+        canonical = resource_actions.plisttool_canonical_output(platform_prerequisites),
         plists = [f.path for f in plists],
         forced_plists = forced_plists,
         entitlements_options = struct(**entitlements_options),
@@ -251,6 +251,13 @@ def _bundle_partial_outputs_files(
         that will be bundled inside the final archive.
       platform_prerequisites: Struct containing information on the platform being targeted.
       rule_descriptor: A rule descriptor for platform and product types from the rule context.
+
+    Passing `--define=apple.experimental.incremental_bundling=true` makes bundletool keep the
+    archive it wrote, and an index of its entries, in a directory next to `output_file`. The next
+    run copies the entries whose sources didn't change from that archive instead of writing them
+    again; its output is the same as that of a full run. That directory isn't a declared output,
+    so these actions then run unsandboxed and locally. This only applies when not building tree
+    artifacts.
     """
 
     # Autotrim locales here only if the rule supports it and there weren't requested locales.
@@ -362,13 +369,23 @@ def _bundle_partial_outputs_files(
     if post_processor:
         post_processor_path = post_processor.path
 
-    control = struct(
-        bundle_merge_files = control_files,
-        bundle_merge_zips = control_zips,
-        output = output_file.path,
-        code_signing_commands = codesigning_command or "",
-        post_processor = post_processor_path,
+    control_args = {
+        "bundle_merge_files": control_files,
+        "bundle_merge_zips": control_zips,
+        "output": output_file.path,
+        "code_signing_commands": codesigning_command or "",
+        "post_processor": post_processor_path,
+    }
+
+    incremental_bundling = not tree_artifact_is_enabled and defines.bool_value(
+        config_vars = config_vars,
+        default = False,
+        define_name = "apple.experimental.incremental_bundling",
     )
+    if incremental_bundling:
+        control_args["incremental_state"] = output_file.path + ".incremental_state"
+
+    control = struct(**control_args)
 
     if embedding:
         control_file_name = "embedding_bundletool_control.json"
@@ -433,8 +450,17 @@ def _bundle_partial_outputs_files(
         )
     else:
         resolved_bundletool = apple_xplat_toolchain_info.resolved_bundletool
+        execution_requirements = {}
+        if incremental_bundling:
+            execution_requirements = {
+                # The incremental state has to stay on this machine for the next run.
+                "no-remote-exec": "1",
+                # bundletool writes the incremental state outside of its declared outputs.
+                "no-sandbox": "1",
+            }
         actions.run(
             executable = resolved_bundletool.executable,
+            execution_requirements = execution_requirements,
             inputs = depset(bundletool_inputs, transitive = [resolved_bundletool.inputs]),
             input_manifests = resolved_bundletool.input_manifests,
             mnemonic = "BundleApp",
@@ -41,6 +41,7 @@ load(
     _merge_resource_infoplists = "merge_resource_infoplists",
     _merge_root_infoplists = "merge_root_infoplists",
     _plisttool_action = "plisttool_action",
+    _plisttool_canonical_output = "plisttool_canonical_output",
 )
 load(
     "@build_bazel_rules_apple//apple/internal/resource_actions:png.bzl",
@@ -67,4 +68,5 @@ resource_actions = struct(
     merge_resource_infoplists = _merge_resource_infoplists,
     merge_root_infoplists = _merge_root_infoplists,
     plisttool_action = _plisttool_action,
+    plisttool_canonical_output = _plisttool_canonical_output,
 )
@@ -26,6 +26,10 @@ load(
     "@build_bazel_rules_apple//apple/internal:platform_support.bzl",
     "platform_support",
 )
+load(
+    "@build_bazel_rules_apple//apple/internal/utils:defines.bzl",
+    "defines",
+)
 load(
     "@build_bazel_rules_apple//apple:providers.bzl",
     "AppleBundleVersionInfo",
@@ -54,6 +58,9 @@ def plisttool_action(
     It is intended to be called by other functions that register actions for more specific
     resources, like Info.plist files or entitlements.
 
+    Passing `--define=apple.experimental.plisttool_worker=true` runs these actions in a
+    persistent (multiplexed) plisttool worker, avoiding a Python interpreter startup per action.
+
     Args:
       actions: The actions provider from `ctx.actions`.
       control_file: The `File` containing the control struct to be passed to plisttool.
@@ -63,11 +70,35 @@ def plisttool_action(
       platform_prerequisites: Struct containing information on the platform being targeted.
       resolved_plisttool: A struct referencing the resolved plist tool.
     """
+    use_worker = defines.bool_value(
+        config_vars = platform_prerequisites.config_vars,
+        define_name = "apple.experimental.plisttool_worker",
+        default = False,
+    )
+
+    execution_requirements = {}
+    if use_worker:
+        # Workers get their arguments through a params file; plisttool expands it itself when
+        # the action ends up not running in a worker.
+        args = actions.args()
+        args.add(control_file)
+        args.use_param_file("@%s", use_always = True)
+        args.set_param_file_format("multiline")
+        arguments = [args]
+        execution_requirements = {
+            "requires-worker-protocol": "json",
+            "supports-multiplex-workers": "1",
+            "supports-workers": "1",
+        }
+    else:
+        arguments = [control_file.path]
+
     apple_support.run(
         actions = actions,
         apple_fragment = platform_prerequisites.apple_fragment,
-        arguments = [control_file.path],
+        arguments = arguments,
         executable = resolved_plisttool.executable,
+        execution_requirements = execution_requirements,
         inputs = depset(inputs + [control_file], transitive = [resolved_plisttool.inputs]),
         input_manifests = resolved_plisttool.input_manifests,
         mnemonic = mnemonic,
@@ -75,6 +106,25 @@ def plisttool_action(
         xcode_config = platform_prerequisites.xcode_version_config,
     )
 
+def plisttool_canonical_output(platform_prerequisites):
+    """Returns whether plisttool should write its canonical output format.
+
+    Passing `--define=apple.plisttool_canonical_output=true` makes plisttool normalize dates and
+    reals and write both XML and binary plists itself, so the bytes only depend on the data and
+    not on the host or Python version, which keeps downstream actions cacheable.
+
+    Args:
+      platform_prerequisites: Struct containing information on the platform being targeted.
+
+    Returns:
+      The value for the `canonical` key of a plisttool control struct.
+    """
+    return defines.bool_value(
+        config_vars = platform_prerequisites.config_vars,
+        define_name = "apple.plisttool_canonical_output",
+        default = False,
+    )
+
 def compile_plist(*, actions, input_file, output_file, platform_prerequisites):
     """Creates an action that compiles plist and strings files.
 
@@ -145,6 +195,7 @@ def merge_resource_infoplists(
 
     control = struct(
         binary = True,
+        canonical = plisttool_canonical_output(platform_prerequisites),
         output = output_plist.path,
         plists = [p.path for p in input_files],
         target = target,
@@ -344,6 +395,7 @@ def merge_root_infoplists(
 
     control = struct(
         binary = rule_descriptor.binary_infoplist,
+        canonical = plisttool_canonical_output(platform_prerequisites),
         forced_plists = forced_plists,
         info_plist_options = struct(**info_plist_options),
         output = output_plist.path,
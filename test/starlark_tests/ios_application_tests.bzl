@@ -28,6 +28,7 @@ load(
 )
 load(
     "//test/starlark_tests/rules:analysis_target_actions_test.bzl",
+    "analysis_target_actions_incremental_bundling_test",
     "analysis_target_actions_tree_artifacts_outputs_test",
 )
 load(
@@ -103,6 +104,14 @@ def ios_application_test_suite(name):
         tags = [name],
     )
 
+    analysis_target_actions_incremental_bundling_test(
+        name = "{}_bundle_control_has_incremental_state_test".format(name),
+        target_under_test = "//test/starlark_tests/targets_under_test/ios:app_minimal",
+        target_mnemonic = "FileWrite",
+        expected_content = ["app_minimal.ipa.incremental_state\""],
+        tags = [name],
+    )
+
     apple_verification_test(
         name = "{}_ext_and_fmwk_provisioned_codesign_test".format(name),
         build_type = "simulator",
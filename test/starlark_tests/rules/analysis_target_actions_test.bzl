@@ -38,6 +38,12 @@ Expected action env: {expected_env}
 Actual action env: {actual_env}
 """
 
+_TARGET_CONTAINS_ACTION_WITH_CONTENT_FAIL_MSG = """
+Expected content could not be found in the content of any action for target mnemonic '{target_mnemonic}'.
+Target: {target}
+Expected action content: {expected_content}
+"""
+
 _TARGET_CONTAINS_NOT_EXPECTED_MNEMONIC = """
 Expected target to not contain an action with mnemonic '{target_mnemonic}', but it did.
 Target: {target}
@@ -109,6 +115,23 @@ def _analysis_target_actions_test_impl(ctx):
             )
             return analysistest.end(env)
 
+    for expected_content in ctx.attr.expected_content:
+        target_mnemonic_actions_content = [
+            a.content
+            for a in target_mnemonic_actions
+            if a.content != None
+        ]
+        if not [c for c in target_mnemonic_actions_content if expected_content in c]:
+            unittest.fail(
+                env,
+                _TARGET_CONTAINS_ACTION_WITH_CONTENT_FAIL_MSG.format(
+                    target_mnemonic = target_mnemonic,
+                    target = target_under_test,
+                    expected_content = expected_content,
+                ),
+            )
+            return analysistest.end(env)
+
     for not_expected_mnemonic in ctx.attr.not_expected_mnemonic:
         actual_mnemonics = {
             action.mnemonic: action
@@ -155,6 +178,11 @@ This will also assert at least one action exists with the given mnemonic.
 A list of strings representing substrings expected to appear in the action
 command line, after concatenating all command line arguments into a single
 space-delimited string.""",
+            ),
+            "expected_content": attr.string_list(
+                doc = """
+A list of strings expected to appear in the content of an action with the given
+mnemonic, for actions writing a file with known content (such as `FileWrite`).""",
             ),
             "expected_env": attr.string_dict(
                 doc = """
@@ -183,3 +211,8 @@ analysis_target_actions_tree_artifacts_outputs_test = make_analysis_target_actio
         build_settings_labels.use_tree_artifacts_outputs: True,
     },
 )
+analysis_target_actions_incremental_bundling_test = make_analysis_target_actions_test(
+    config_settings = {
+        "//command_line_option:define": ["apple.experimental.incremental_bundling=true"],
+    },
+)
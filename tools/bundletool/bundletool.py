@@ -50,20 +50,398 @@ following keys:
       the ZIPs contents should be placed. This is used for support files, such
       as Swift libraries and watchOS stub executables, that must be shipped to
       Apple at the root of the archive as well as within the bundle itself.
+  reproducible: If True, the files of directories in `bundle_merge_files` are
+      added in sorted order, rather than the order the file system lists them
+      in, so the output only depends on the inputs and not on the machine
+      bundling them. If omitted, False is used.
+  sort_central_directory: If True, the central directory of the archive lists
+      the entries sorted by path, rather than in the order they were added. If
+      omitted, False is used.
+  incremental_state: If present, the path of a directory in which the tool
+      keeps a hard link to (or copy of) the output and an index of its entries
+      (where each is in the archive, and the size and modification time of its
+      source file or ZIP) for the next run. That run copies the entries whose
+      source didn't change straight from the previous archive, in bulk where
+      they are contiguous, rather than reading and writing them again. The
+      output is always the same as that of a full run. The directory must
+      outlive the output (which Bazel deletes before rerunning an action). The
+      rules only set it with --define=apple.experimental.incremental_bundling,
+      and then run the action unsandboxed and locally, since the directory
+      isn't a declared output.
 """
 
+import collections
+from concurrent import futures
+import contextlib
+import functools
 import hashlib
+import io
 import json
 import os
+import shutil
 import stat
+import struct
 import sys
-from typing import Optional, Union
+from typing import BinaryIO, Callable, Optional
 import zipfile
+import zlib
 
 BUNDLE_CONFLICT_MSG_TEMPLATE = (
     'Cannot place two files at the same location %r in the archive')
 
 
+# The local file header of a ZIP entry, followed by the file name and extra
+# field (see section 4.3.7 of the ZIP file format specification).
+_LOCAL_FILE_HEADER = struct.Struct('<4s2B4HL2L2H')
+_LOCAL_FILE_HEADER_SIGNATURE = b'PK\003\004'
+_LOCAL_FILE_HEADER_NAME_LENGTH = 10
+_LOCAL_FILE_HEADER_EXTRA_LENGTH = 11
+
+# Flag bits of a ZIP entry: encrypted, and sizes and CRC in a data descriptor.
+_FLAG_ENCRYPTED = 0x1
+_FLAG_DATA_DESCRIPTOR = 0x8
+_DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+
+# How much of an entry is copied at a time.
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+# How many threads read (and hash) entries ahead of the one writing them.
+_MAX_READERS = 8
+
+# The timestamp of every entry, the earliest a ZIP file can hold, so archives
+# don't depend on when (or from what) they were made.
+_ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+# The ZipInfo.create_system value meaning that the external attributes hold
+# Unix permissions.
+_CREATE_SYSTEM_UNIX = 3
+
+# Change whenever what incremental state index files hold (or mean) changes.
+_INCREMENTAL_STATE_VERSION = 1
+
+# The files kept in the incremental_state directory.
+_INCREMENTAL_STATE_ARCHIVE = 'bundle.zip'
+_INCREMENTAL_STATE_INDEX = 'index.json'
+
+# Larger entries aren't read ahead, but copied in chunks by the writing thread,
+# so at most 2 * _MAX_READERS * _PREFETCH_MAX_SIZE bytes are read ahead.
+_PREFETCH_MAX_SIZE = 1024 * 1024
+
+
+def _stored_payload_offset(src_fd, zipinfo):
+  """Returns where the payload of an entry of a ZIP file starts.
+
+  Args:
+    src_fd: The file descriptor of the ZIP file.
+    zipinfo: The `ZipInfo` of the entry.
+  Returns:
+    The offset of the payload in the file, after the entry's local file header.
+  Raises:
+    zipfile.BadZipFile: If the entry's local file header is malformed.
+  """
+  header = os.pread(src_fd, _LOCAL_FILE_HEADER.size, zipinfo.header_offset)
+  if len(header) != _LOCAL_FILE_HEADER.size:
+    raise zipfile.BadZipFile('Truncated file header for %r' % zipinfo.filename)
+  fields = _LOCAL_FILE_HEADER.unpack(header)
+  if fields[0] != _LOCAL_FILE_HEADER_SIGNATURE:
+    raise zipfile.BadZipFile('Bad magic number for file header of %r' %
+                             zipinfo.filename)
+  return (zipinfo.header_offset + _LOCAL_FILE_HEADER.size +
+          fields[_LOCAL_FILE_HEADER_NAME_LENGTH] +
+          fields[_LOCAL_FILE_HEADER_EXTRA_LENGTH])
+
+
+def _read_stored_payload(src_fd, zipinfo):
+  """Yields the payload of an uncompressed entry of a ZIP file, in chunks.
+
+  The payload is read straight from the file, rather than through
+  `ZipFile.open`, so it isn't checked against the entry's CRC again. It is read
+  with `os.pread`, so several threads can read entries of the same file at
+  once.
+
+  Args:
+    src_fd: The file descriptor of the ZIP file.
+    zipinfo: The `ZipInfo` of an uncompressed, unencrypted entry of the file.
+  Yields:
+    The bytes of the entry.
+  Raises:
+    zipfile.BadZipFile: If the entry's local file header is malformed.
+  """
+  offset = _stored_payload_offset(src_fd, zipinfo)
+  remaining = zipinfo.compress_size
+  while remaining:
+    chunk = os.pread(src_fd, min(remaining, _COPY_CHUNK_SIZE), offset)
+    if not chunk:
+      raise zipfile.BadZipFile('Truncated data for %r' % zipinfo.filename)
+    offset += len(chunk)
+    remaining -= len(chunk)
+    yield chunk
+
+
+def _fill_stored_zipinfo(out_zip, zipinfo, crc, size):
+  """Fills in a `ZipInfo` as `ZipFile.writestr` would for uncompressed data.
+
+  Args:
+    out_zip: The `ZipFile` into which the entry will be added.
+    zipinfo: The `ZipInfo` of the entry.
+    crc: The CRC-32 of the data.
+    size: The size of the data.
+  Returns:
+    Whether the entry's local file header needs ZIP64 extensions.
+  """
+  # pylint: disable=protected-access
+  zipinfo.compress_type = zipfile.ZIP_STORED
+  zipinfo.flag_bits = 0
+  if not out_zip._seekable:
+    zipinfo.flag_bits |= _FLAG_DATA_DESCRIPTOR
+  zipinfo.CRC = crc
+  zipinfo.compress_size = size
+  zipinfo.file_size = size
+  return size * 1.05 > zipfile.ZIP64_LIMIT
+
+
+def _write_stored_entry(out_zip, zipinfo, crc, size, chunks):
+  """Writes an uncompressed entry whose CRC and size are already known.
+
+  This writes exactly the bytes `ZipFile.writestr` would for the same entry,
+  but without computing the CRC of the data again (and without needing all of
+  it in memory at once).
+
+  Args:
+    out_zip: The `ZipFile` into which the entry should be added.
+    zipinfo: The `ZipInfo` of the entry; its size and CRC are filled in.
+    crc: The CRC-32 of the data.
+    size: The size of the data.
+    chunks: The data, as an iterable of bytes.
+  Raises:
+    ValueError: If the data isn't of the given size.
+  """
+  # pylint: disable=protected-access
+  zip64 = _fill_stored_zipinfo(out_zip, zipinfo, crc, size)
+
+  with out_zip._lock:
+    if out_zip._writing:
+      raise ValueError("Can't write to the ZIP file while there is another "
+                       'write handle open on it.')
+    fp = out_zip.fp
+    if out_zip._seekable:
+      fp.seek(out_zip.start_dir)
+    zipinfo.header_offset = fp.tell()
+    out_zip._writecheck(zipinfo)
+    out_zip._didModify = True
+
+    fp.write(zipinfo.FileHeader(zip64))
+    written = 0
+    for chunk in chunks:
+      fp.write(chunk)
+      written += len(chunk)
+    if written != size:
+      raise ValueError('Expected %d bytes for %r, got %d' % (
+          size, zipinfo.filename, written))
+    if zipinfo.flag_bits & _FLAG_DATA_DESCRIPTOR:
+      fmt = '<LLQQ' if zip64 else '<LLLL'
+      fp.write(struct.pack(fmt, _DATA_DESCRIPTOR_SIGNATURE, crc, size, size))
+
+    out_zip.start_dir = fp.tell()
+    out_zip.filelist.append(zipinfo)
+    out_zip.NameToInfo[zipinfo.filename] = zipinfo
+
+
+def _copy_range(src_fd, offset, length, out):
+  """Copies a range of bytes of a file to a binary file object.
+
+  The copy is done by the kernel (and might share the data on file systems
+  that support it) when both are regular files, and in chunks otherwise.
+
+  Args:
+    src_fd: The file descriptor of the file to copy from.
+    offset: Where the range starts in the file.
+    length: The length of the range.
+    out: The binary file object to write the range to, at its position.
+  Raises:
+    OSError: If the file is shorter than expected.
+  """
+  try:
+    out_fd = out.fileno() if out.seekable() else None
+  except (AttributeError, io.UnsupportedOperation):
+    out_fd = None
+  if out_fd is not None and hasattr(os, 'copy_file_range'):
+    out.flush()
+    out_offset = out.tell()
+    copied = 0
+    try:
+      while copied < length:
+        count = os.copy_file_range(src_fd, out_fd, length - copied,
+                                   offset + copied, out_offset + copied)
+        if not count:
+          break
+        copied += count
+    except OSError:
+      pass  # E.g. a pipe, or an older kernel; copy the rest in chunks.
+    out.seek(out_offset + copied)
+    offset += copied
+    length -= copied
+
+  while length:
+    chunk = os.pread(src_fd, min(length, _COPY_CHUNK_SIZE), offset)
+    if not chunk:
+      raise OSError('Unexpected end of file at offset %d' % offset)
+    out.write(chunk)
+    offset += len(chunk)
+    length -= len(chunk)
+
+
+def _file_signature(st):
+  """Returns what identifies a version of a file, without reading it.
+
+  As with make, a file is taken to be unchanged if its size, modification time
+  and inode are; its status change time is included too, since it can't be set
+  back to what it was.
+
+  Args:
+    st: The `os.stat_result` of the file.
+  Returns:
+    The signature, as a list (to compare with one loaded from JSON).
+  """
+  return [st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino]
+
+
+def _is_executable(st):
+  """Returns whether a file has at least one executable bit set.
+
+  Args:
+    st: The `os.stat_result` of the file.
+  Returns:
+    True if the file is executable.
+  """
+  return st.st_mode & 0o111 != 0
+
+
+def _walk_files(top, sort=False):
+  """Yields the files of a directory tree, directory by directory.
+
+  The directories are visited in the same order as with `os.walk` (top-down,
+  without following symbolic links to directories), but the files come as the
+  `os.DirEntry`s `os.scandir` returns. Their `stat()` is cached, and usually
+  their type is already known from the directory listing, so each file takes
+  one system call at most, however many times its status is needed.
+
+  Args:
+    top: The path to the directory.
+    sort: Whether to visit the files and subdirectories of each directory in
+        sorted order, rather than the order the file system lists them in.
+  Yields:
+    Tuples of the path to each directory and a list of the `os.DirEntry`s of
+    its files (including symbolic links to anything but directories).
+  """
+  stack = [top]
+  while stack:
+    root = stack.pop()
+    try:
+      with os.scandir(root) as it:
+        entries = list(it)
+    except OSError:
+      continue  # As os.walk does.
+    if sort:
+      entries.sort(key=lambda entry: entry.name)
+
+    dirs = []
+    files = []
+    for entry in entries:
+      try:
+        is_dir = entry.is_dir()
+      except OSError:
+        is_dir = False
+      if not is_dir:
+        files.append(entry)
+      elif not entry.is_symlink():
+        dirs.append(entry.path)
+    yield root, files
+    # Popped (and so visited) in order.
+    stack.extend(reversed(dirs))
+
+
+# An entry of the previous archive of an incremental run, which can be copied
+# as is: where its local file header starts, the length of its whole record
+# (header, data and data descriptor) and the CRC-32 and size of its data.
+_PreviousEntry = collections.namedtuple(
+    '_PreviousEntry', ['offset', 'length', 'crc', 'size'])
+
+
+@contextlib.contextmanager
+def _open_zip_entry(src, zipinfo):
+  """Opens an entry of a ZIP file for reading.
+
+  Args:
+    src: The path to the ZIP file.
+    zipinfo: The `ZipInfo` of the entry.
+  Yields:
+    A binary file object reading the (uncompressed) data of the entry.
+  """
+  with zipfile.ZipFile(src, 'r') as src_zip, src_zip.open(zipinfo) as data:
+    yield data
+
+
+def _crc32(source):
+  """Returns the CRC-32 of the data read from a source.
+
+  Args:
+    source: A function opening a binary file object to read the data from.
+  Returns:
+    The CRC-32 of the data.
+  """
+  crc = 0
+  with source() as data:
+    for chunk in iter(lambda: data.read(_COPY_CHUNK_SIZE), b''):
+      crc = zlib.crc32(chunk, crc)
+  return crc
+
+
+def _digest(source):
+  """Returns a cryptographic digest of the data read from a source.
+
+  Args:
+    source: A function opening a binary file object to read the data from.
+  Returns:
+    The BLAKE2b digest of the data.
+  """
+  digest = hashlib.blake2b()
+  with source() as data:
+    for chunk in iter(lambda: data.read(_COPY_CHUNK_SIZE), b''):
+      digest.update(chunk)
+  return digest.digest()
+
+
+class _EntryDigest(object):
+  """Identifies the data of an entry of the bundle, to detect conflicts.
+
+  The size and CRC-32 of the data are known once it is written. A
+  cryptographic digest of it is only computed if another entry with the same
+  size and CRC-32 is written at the same location, by reading it again from its
+  source.
+  """
+
+  def __init__(self, size, crc, source):
+    """Initializes the digest of an entry.
+
+    Args:
+      size: The size of the data.
+      crc: The CRC-32 of the data.
+      source: A function opening a binary file object to read the data from.
+    """
+    self.size = size
+    self.crc = crc
+    self._source = source
+    self._digest = None
+
+  def digest(self):
+    """Returns a cryptographic digest of the data, computing it once."""
+    if self._digest is None:
+      self._digest = _digest(self._source)
+      self._source = None
+    return self._digest
+
+
 class BundleConflictError(ValueError):
   """Raised when two different files would be bundled in the same location.
 
@@ -91,9 +469,24 @@ class Bundler(object):
     """
     self._control = control
 
-    # Keep track of hashes of each entry; this will be faster than pulling the
-    # data back out of the archive as it's written.
-    self._entry_hashes = {}
+    # Keep track of the size and CRC-32 of each entry to detect conflicts; this
+    # will be faster than pulling the data back out of the archive as it's
+    # written, and for entries copied from other ZIPs, both are already known.
+    # Most locations are only written once, so anything more expensive is only
+    # computed when two entries there have the same size and CRC-32.
+    self._entry_digests = {}
+
+    # The thread pool reading entries ahead while the bundle is written.
+    self._readers = None
+
+    # For incremental runs, the previous archive, its entries (see
+    # _previous_entry), and the entries copied from it but not written yet.
+    self._previous_fd = None
+    self._previous_seekable = None
+    self._previous_entries = {}
+    self._pending_copies = []
+    # For incremental runs, the entries of this archive, for the next run.
+    self._index = None
 
   def run(self):
     """Performs the operations requested by the control struct."""
@@ -106,18 +499,140 @@ class Bundler(object):
     bundle_merge_zips = self._control.get('bundle_merge_zips', [])
     root_merge_zips = self._control.get('root_merge_zips', [])
 
-    with zipfile.ZipFile(output_path, 'w') as out_zip:
-      for z in bundle_merge_zips:
-        dest = os.path.normpath(os.path.join(bundle_path, z['dest']))
-        self._add_zip_contents(z['src'], dest, out_zip)
+    state_dir = self._control.get('incremental_state')
+    if state_dir:
+      self._load_incremental_state(state_dir, output_path)
+      self._index = {}
+
+    try:
+      with zipfile.ZipFile(output_path, 'w') as out_zip, \
+          futures.ThreadPoolExecutor(max_workers=_MAX_READERS) as readers:
+        self._readers = readers
+        # pylint: disable=protected-access
+        seekable = out_zip._seekable
+        if self._previous_seekable != seekable:
+          # The entries would need to have data descriptors, or not to.
+          self._previous_entries = {}
+
+        for z in bundle_merge_zips:
+          dest = os.path.normpath(os.path.join(bundle_path, z['dest']))
+          self._add_zip_contents(z['src'], dest, out_zip)
+
+        for f in bundle_merge_files:
+          dest = os.path.join(bundle_path, f['dest'])
+          self._add_files(f['src'], dest, f.get('executable', False),
+                          f.get('contents_only', False), out_zip)
+
+        for z in root_merge_zips:
+          self._add_zip_contents(z['src'], z['dest'], out_zip)
+
+        self._flush_copies(out_zip)
+        if self._control.get('sort_central_directory', False):
+          out_zip.filelist.sort(key=lambda zipinfo: zipinfo.filename)
+    finally:
+      if self._previous_fd is not None:
+        os.close(self._previous_fd)
+        self._previous_fd = None
+
+    if state_dir:
+      self._save_incremental_state(state_dir, output_path, seekable)
+
+  def _load_incremental_state(self, state_dir, output_path):
+    """Opens the previous archive of an incremental run, if it can be used.
+
+    Anything unexpected (no or an unreadable index, an archive that isn't the
+    one indexed) just means a full run.
+
+    Args:
+      state_dir: The incremental_state directory.
+      output_path: The path to the output.
+    """
+    try:
+      with open(os.path.join(state_dir, _INCREMENTAL_STATE_INDEX), 'rb') as f:
+        index = json.load(f)
+      fd = os.open(os.path.join(state_dir, _INCREMENTAL_STATE_ARCHIVE),
+                   os.O_RDONLY)
+    except (OSError, ValueError):
+      return
+    st = os.fstat(fd)
+    if (not isinstance(index, dict) or
+        index.get('version') != _INCREMENTAL_STATE_VERSION or
+        index.get('archive') != [st.st_size, st.st_mtime_ns, st.st_ino] or
+        not isinstance(index.get('entries'), dict)):
+      os.close(fd)
+      return
 
-      for f in bundle_merge_files:
-        dest = os.path.join(bundle_path, f['dest'])
-        self._add_files(f['src'], dest, f.get('executable', False),
-                        f.get('contents_only', False), out_zip)
+    try:
+      if os.path.samestat(st, os.stat(output_path)):
+        # Writing the output would truncate the previous archive, if it was
+        # left in place (Bazel deletes outputs first, not everything does).
+        os.unlink(output_path)
+    except OSError:
+      pass
+    self._previous_fd = fd
+    self._previous_seekable = index.get('seekable')
+    self._previous_entries = index['entries']
 
-      for z in root_merge_zips:
-        self._add_zip_contents(z['src'], z['dest'], out_zip)
+  def _save_incremental_state(self, state_dir, output_path, seekable):
+    """Keeps the output and the index of its entries for the next run.
+
+    Args:
+      state_dir: The incremental_state directory.
+      output_path: The path to the output.
+      seekable: Whether the output was written to a seekable file.
+    """
+    archive_path = os.path.join(state_dir, _INCREMENTAL_STATE_ARCHIVE)
+    index_path = os.path.join(state_dir, _INCREMENTAL_STATE_INDEX)
+    temp_suffix = '.%d.tmp' % os.getpid()
+    try:
+      os.makedirs(state_dir, exist_ok=True)
+      try:
+        try:
+          os.link(output_path, archive_path + temp_suffix)
+        except OSError:
+          shutil.copyfile(output_path, archive_path + temp_suffix)
+        os.replace(archive_path + temp_suffix, archive_path)
+        st = os.stat(archive_path)
+        with open(index_path + temp_suffix, 'w') as f:
+          # json.dumps is much faster than json.dump for large objects.
+          f.write(json.dumps({
+              'version': _INCREMENTAL_STATE_VERSION,
+              'archive': [st.st_size, st.st_mtime_ns, st.st_ino],
+              'seekable': seekable,
+              'entries': self._index,
+          }))
+        os.replace(index_path + temp_suffix, index_path)
+      except BaseException:
+        for path in (archive_path + temp_suffix, index_path + temp_suffix):
+          try:
+            os.unlink(path)
+          except OSError:
+            pass
+        raise
+    except OSError:
+      pass  # Just means a full run next time.
+
+  def _previous_entry(self, dest, signature):
+    """Returns the entry of the previous archive that can be copied, if any.
+
+    The index of the previous archive maps each location to the signature of
+    the source of its entry (see `_file_signature`; for an entry of a ZIP, that
+    of the ZIP file followed by the name of the entry), then the fields of a
+    `_PreviousEntry`. An entry can be copied if its source didn't change.
+
+    Args:
+      dest: The path inside the archive where the entry should be stored.
+      signature: The signature of the source of the entry, or None if this
+          isn't an incremental run.
+    Returns:
+      The `_PreviousEntry`, or None if the entry must be written.
+    """
+    previous = self._previous_entries.get(dest)
+    if (signature is None or not isinstance(previous, list) or
+        len(previous) != 1 + len(_PreviousEntry._fields) or
+        previous[0] != signature):
+      return None
+    return _PreviousEntry(*previous[1:])
 
   def _add_files(self, src, dest, executable, contents_only, out_zip):
     """Adds a file or a directory of files to the ZIP archive.
@@ -137,23 +652,85 @@ class Bundler(object):
           directory).
       out_zip: The `ZipFile` into which the files should be added.
     """
-    if os.path.isdir(src):
-      for root, _, files in os.walk(src):
+    self._write_entries(
+        self._file_entries(src, dest, executable, contents_only), out_zip)
+
+  def _file_entries(self, src, dest, executable, contents_only):
+    """Yields the entries for a file or a directory of files.
+
+    Args:
+      src: See `_add_files`.
+      dest: See `_add_files`.
+      executable: See `_add_files`.
+      contents_only: See `_add_files`.
+    Yields:
+      The entries, as for `_write_entries`.
+    """
+    try:
+      st = os.stat(src)
+    except OSError:
+      return  # Neither a file nor a directory.
+
+    if stat.S_ISDIR(st.st_mode):
+      sort = self._control.get('reproducible', False)
+      for root, files in _walk_files(src, sort=sort):
         relpath = os.path.relpath(root, src)
         if contents_only:
           relpath = os.path.dirname(relpath)
-        for filename in files:
-          fsrc = os.path.join(root, filename)
-          fdest = os.path.normpath(os.path.join(dest, relpath, filename))
-          fexec = executable or os.access(fsrc, os.X_OK)
-          with open(fsrc, 'rb') as f:
-            self._write_entry(
-                dest=fdest, data=f.read(), is_executable=fexec, out_zip=out_zip)
-    elif os.path.isfile(src):
-      fexec = executable or os.access(src, os.X_OK)
+        for entry in files:
+          fdest = os.path.normpath(os.path.join(dest, relpath, entry.name))
+          fst = entry.stat()
+          fexec = executable or _is_executable(fst)
+          yield self._file_entry(entry.path, fdest, fexec, fst)
+    elif stat.S_ISREG(st.st_mode):
+      fexec = executable or _is_executable(st)
+      yield self._file_entry(src, dest, fexec, st)
+
+  def _file_entry(self, src, dest, executable, st):
+    """Returns the entry for a single file.
+
+    Args:
+      src: The path to the file that should be added.
+      dest: The path inside the archive where the file should be stored.
+      executable: A Boolean value indicating whether or not the file should
+          be made executable.
+      st: The `os.stat_result` of the file.
+    Returns:
+      The entry, as for `_write_entries`.
+    """
+    source = functools.partial(open, src, 'rb')
+    signature = _file_signature(st) if self._index is not None else None
+    previous = self._previous_entry(dest, signature)
+    if previous:
+
+      def copy(out_zip, unused_prefetched):
+        self._copy_previous_entry(
+            previous, signature=signature, source=source, dest=dest,
+            is_executable=executable, out_zip=out_zip)
+
+      return None, copy
+
+    def prefetch():
+      if st.st_size > _PREFETCH_MAX_SIZE:
+        return None
       with open(src, 'rb') as f:
-        self._write_entry(
-            dest=dest, data=f.read(), is_executable=fexec, out_zip=out_zip)
+        data = f.read()
+      return data, zlib.crc32(data)
+
+    def write(out_zip, prefetched):
+      self._flush_copies(out_zip)
+      if prefetched:
+        data, crc = prefetched
+        self._write_data(data=data, crc=crc, source=source, dest=dest,
+                         is_executable=executable, out_zip=out_zip)
+      else:
+        with open(src, 'rb') as f:
+          self._write_entry(
+              data=f, size=os.fstat(f.fileno()).st_size, source=source,
+              dest=dest, is_executable=executable, out_zip=out_zip)
+      self._index_written_entry(out_zip, dest, signature)
+
+    return prefetch, write
 
   def _add_zip_contents(self, src, dest, out_zip):
     """Adds the contents of another ZIP file to the output ZIP archive.
@@ -165,49 +742,231 @@ class Bundler(object):
           underneath this path.
       out_zip: The `ZipFile` into which the files should be added.
     """
-    with zipfile.ZipFile(src, 'r') as src_zip:
-      for src_zipinfo in src_zip.infolist():
-        # Normalize the destination path to remove any extraneous internal
-        # slashes or "." segments, but retain the final slash for directory
-        # entries.
-        file_dest = os.path.normpath(os.path.join(dest, src_zipinfo.filename))
-        if src_zipinfo.filename.endswith('/'):
-          file_dest += '/'
-
-        # Check POSIX permissions instead of passing-through the file
-        # zipinfo.external_attr to standardize on a preferred set of permissions
-        # because permission bits from incoming archives might not be set as
-        # Apple expects these to be set on a bundle executable/file.
-        #
-        # Example: imported (e.g. library/framework) executables permissions can
-        #          be set to: 'r-xr-xr-x' as opposed to the expected 'rwxr-xr-x'
-        #
-        unix_permissions = src_zipinfo.external_attr >> 16
-
-        # Mark file as executable if at least one executable bit is set.
-        is_executable = unix_permissions & 0o111 != 0
-
-        is_symlink = stat.S_ISLNK(unix_permissions)
-
-        self._write_entry(
-            dest=file_dest,
-            data=src_zip.read(src_zipinfo),
-            is_executable=is_executable,
-            is_symlink=is_symlink,
+    with open(src, 'rb') as src_file, \
+        zipfile.ZipFile(src_file, 'r') as src_zip:
+      signature = None
+      if self._index is not None:
+        signature = _file_signature(os.fstat(src_file.fileno()))
+      self._write_entries(
+          self._zip_entries(src, src_file.fileno(), src_zip, dest, signature),
+          out_zip)
+
+  def _zip_entries(self, src, src_fd, src_zip, dest, signature):
+    """Yields the entries for the contents of another ZIP file.
+
+    Args:
+      src: The path to the ZIP file.
+      src_fd: The file descriptor of the ZIP file.
+      src_zip: The `ZipFile` reading the ZIP file.
+      dest: See `_add_zip_contents`.
+      signature: The signature of the ZIP file, or None if this isn't an
+          incremental run.
+    Yields:
+      The entries, as for `_write_entries`.
+    """
+    for src_zipinfo in src_zip.infolist():
+      # Normalize the destination path to remove any extraneous internal
+      # slashes or "." segments, but retain the final slash for directory
+      # entries.
+      file_dest = os.path.normpath(os.path.join(dest, src_zipinfo.filename))
+      if src_zipinfo.filename.endswith('/'):
+        file_dest += '/'
+
+      # Check POSIX permissions instead of passing-through the file
+      # zipinfo.external_attr to standardize on a preferred set of permissions
+      # because permission bits from incoming archives might not be set as
+      # Apple expects these to be set on a bundle executable/file.
+      #
+      # Example: imported (e.g. library/framework) executables permissions can
+      #          be set to: 'r-xr-xr-x' as opposed to the expected 'rwxr-xr-x'
+      #
+      unix_permissions = src_zipinfo.external_attr >> 16
+
+      # Mark file as executable if at least one executable bit is set.
+      is_executable = unix_permissions & 0o111 != 0
+
+      is_symlink = stat.S_ISLNK(unix_permissions)
+
+      entry_signature = None
+      if signature is not None:
+        entry_signature = signature + [src_zipinfo.filename]
+      yield self._zip_entry(src, src_fd, src_zip, src_zipinfo, file_dest,
+                            is_executable, is_symlink, entry_signature)
+
+  def _zip_entry(self, src, src_fd, src_zip, src_zipinfo, dest, is_executable,
+                 is_symlink, signature):
+    """Returns the entry for an entry of another ZIP file.
+
+    Args:
+      src: The path to the ZIP file.
+      src_fd: The file descriptor of the ZIP file.
+      src_zip: The `ZipFile` reading the ZIP file.
+      src_zipinfo: The `ZipInfo` of the entry in the ZIP file.
+      dest: The path inside the archive where the entry should be stored.
+      is_executable: A Boolean value indicating whether or not the entry should
+          be made executable.
+      is_symlink: A Boolean value indicating whether or not the entry should
+          be made a symbolic link.
+      signature: The signature of the source of the entry, or None if this
+          isn't an incremental run.
+    Returns:
+      The entry, as for `_write_entries`.
+    """
+    # Uncompressed entries are copied as is, with the CRC and size from the
+    # source. Compressed entries are stored uncompressed, like everything else.
+    is_stored = (src_zipinfo.compress_type == zipfile.ZIP_STORED and
+                 not src_zipinfo.flag_bits & _FLAG_ENCRYPTED)
+    # The ZIP file is closed by then, if the entry is ever read again.
+    source = functools.partial(_open_zip_entry, src, src_zipinfo)
+    previous = self._previous_entry(dest, signature)
+    if previous:
+
+      def copy(out_zip, unused_prefetched):
+        self._copy_previous_entry(
+            previous, signature=signature, source=source, dest=dest,
+            is_executable=is_executable, is_symlink=is_symlink,
             out_zip=out_zip)
 
+      return None, copy
+
+    def prefetch():
+      if src_zipinfo.file_size > _PREFETCH_MAX_SIZE:
+        return None
+      if is_stored:
+        return b''.join(_read_stored_payload(src_fd, src_zipinfo))
+      return src_zip.read(src_zipinfo)
+
+    def write(out_zip, prefetched):
+      self._flush_copies(out_zip)
+      if prefetched is not None:
+        self._write_data(
+            data=prefetched, crc=src_zipinfo.CRC, source=source, dest=dest,
+            is_executable=is_executable, is_symlink=is_symlink,
+            out_zip=out_zip)
+      elif is_stored:
+        if not self._is_duplicate(dest, src_zipinfo.file_size,
+                                  src_zipinfo.CRC, source):
+          _write_stored_entry(
+              out_zip,
+              self._zipinfo(dest, is_executable, is_symlink),
+              src_zipinfo.CRC,
+              src_zipinfo.file_size,
+              _read_stored_payload(src_fd, src_zipinfo))
+          self._entry_digests[dest] = _EntryDigest(
+              src_zipinfo.file_size, src_zipinfo.CRC, source)
+      else:
+        with src_zip.open(src_zipinfo) as data:
+          self._write_entry(
+              data=data,
+              size=src_zipinfo.file_size,
+              crc=src_zipinfo.CRC,
+              source=source,
+              dest=dest,
+              is_executable=is_executable,
+              is_symlink=is_symlink,
+              out_zip=out_zip)
+      self._index_written_entry(out_zip, dest, signature)
+
+    return prefetch, write
+
+  def _write_entries(self, entries, out_zip):
+    """Writes entries to the output ZIP archive, in order.
+
+    Each entry is a pair of functions. `prefetch()` runs on the thread pool,
+    ahead of the writing; it reads the entry's data (and computes its CRC-32)
+    if it is small enough to keep in memory until it is written, returning
+    None otherwise. It is None itself for entries with nothing to read ahead
+    (e.g. those copied from a previous archive), for which the pool isn't used
+    at all. `write(out_zip, prefetched)` then runs on the calling
+    thread, one entry at a time and in order, so the archive is the same as
+    when the entries are read and written one after another. A failed read only
+    raises its error when the entry's turn comes.
+
+    Args:
+      entries: An iterable of the entries.
+      out_zip: The `ZipFile` into which the entries should be added.
+    """
+    # Only read a few entries ahead, to bound the memory used.
+    window = 2 * _MAX_READERS
+    pending = collections.deque()
+    try:
+      for prefetch, write in entries:
+        pending.append(
+            (write, self._readers.submit(prefetch) if prefetch else None))
+        if len(pending) >= window:
+          write, future = pending.popleft()
+          write(out_zip, future.result() if future else None)
+      while pending:
+        write, future = pending.popleft()
+        write(out_zip, future.result() if future else None)
+    finally:
+      # Don't bother reading the rest when writing failed.
+      for _, future in pending:
+        if future:
+          future.cancel()
+
   def _write_entry(
       self,
       *,
-      data: Union[str, bytes],
+      data: BinaryIO,
+      size: int,
+      crc: Optional[int] = None,
+      source: Callable[[], BinaryIO],
       dest: str,
       is_executable: Optional[bool] = False,
       is_symlink: Optional[bool] = False,
       out_zip: zipfile.ZipFile):
-    """Writes the given data as a file in the output ZIP archive.
+    """Writes the data read from a file object as a file in the output archive.
+
+    The data is copied in chunks, so however large it is, only a chunk of it is
+    in memory at a time.
+
+    Args:
+      data: The binary file object to read the data to be written from.
+      size: The size of the data.
+      crc: The CRC-32 of the data, if known. Otherwise it is only computed (by
+          reading the data an extra time) when something of the same size was
+          already written at the same location.
+      source: A function opening a binary file object to read the data from
+          again, should it be needed to detect a conflict later.
+      dest: The path inside the archive where the data should be written.
+      is_executable: A Boolean value indicating whether or not the file should
+          be made executable.
+      is_symlink: A Boolean value indicating whether or not the file should
+          be made a symbolic link.
+      out_zip: The `ZipFile` into which the files should be added.
+    Raises:
+      BundleConflictError: If two files with different content would be placed
+          at the same location in the ZIP file.
+    """
+    if self._is_duplicate(dest, size, crc, source):
+      return
+
+    zipinfo = self._zipinfo(dest, is_executable, is_symlink)
+    # Set before opening the entry, to use ZIP64 extensions if it needs them.
+    zipinfo.file_size = size
+    with out_zip.open(zipinfo, 'w') as out:
+      shutil.copyfileobj(data, out, _COPY_CHUNK_SIZE)
+    self._entry_digests[dest] = _EntryDigest(
+        zipinfo.file_size, zipinfo.CRC, source)
+
+  def _write_data(
+      self,
+      *,
+      data: bytes,
+      crc: int,
+      source: Callable[[], BinaryIO],
+      dest: str,
+      is_executable: Optional[bool] = False,
+      is_symlink: Optional[bool] = False,
+      out_zip: zipfile.ZipFile):
+    """Writes data that was already read as a file in the output archive.
 
     Args:
       data: The data to be written in the archive.
+      crc: The CRC-32 of the data.
+      source: A function opening a binary file object to read the data from
+          again, should it be needed to detect a conflict later.
       dest: The path inside the archive where the data should be written.
       is_executable: A Boolean value indicating whether or not the file should
           be made executable.
@@ -218,17 +977,160 @@ class Bundler(object):
       BundleConflictError: If two files with different content would be placed
           at the same location in the ZIP file.
     """
-    new_hash = hashlib.md5(data).digest()
-    existing_hash = self._entry_hashes.get(dest)
-    if existing_hash:
-      if existing_hash == new_hash:
-        return
-      raise BundleConflictError(BUNDLE_CONFLICT_MSG_TEMPLATE % dest)
+    if self._is_duplicate(dest, len(data), crc, source):
+      return
+    _write_stored_entry(out_zip, self._zipinfo(dest, is_executable, is_symlink),
+                        crc, len(data), [data])
+    self._entry_digests[dest] = _EntryDigest(len(data), crc, source)
+
+  def _copy_previous_entry(
+      self,
+      previous: _PreviousEntry,
+      *,
+      signature: list,
+      source: Callable[[], BinaryIO],
+      dest: str,
+      is_executable: Optional[bool] = False,
+      is_symlink: Optional[bool] = False,
+      out_zip: zipfile.ZipFile):
+    """Copies an entry of the previous archive of an incremental run.
+
+    The record of an entry (its local file header, data and data descriptor)
+    doesn't depend on where it is in the archive, so it is the same as if the
+    entry was written again. The copy is deferred, so that entries that follow
+    each other in the previous archive are copied at once, by
+    `_flush_copies`.
+
+    Args:
+      previous: The `_PreviousEntry`.
+      signature: The signature of the source of the entry.
+      source: A function opening a binary file object to read the data from
+          again, should it be needed to detect a conflict later.
+      dest: The path inside the archive where the entry should be stored.
+      is_executable: A Boolean value indicating whether or not the file should
+          be made executable.
+      is_symlink: A Boolean value indicating whether or not the file should
+          be made a symbolic link.
+      out_zip: The `ZipFile` into which the entry should be added.
+    Raises:
+      BundleConflictError: If two files with different content would be placed
+          at the same location in the ZIP file.
+    """
+    if self._is_duplicate(dest, previous.size, previous.crc, source):
+      return
+    self._entry_digests[dest] = _EntryDigest(
+        previous.size, previous.crc, source)
+
+    if self._pending_copies:
+      last = self._pending_copies[-1][1]
+      if last.offset + last.length != previous.offset:
+        self._flush_copies(out_zip)
+    zipinfo = self._zipinfo(dest, is_executable, is_symlink)
+    zip64 = _fill_stored_zipinfo(out_zip, zipinfo, previous.crc, previous.size)
+    # For its side effects on the ZipInfo, as when the entry is written.
+    zipinfo.FileHeader(zip64)
+    self._pending_copies.append((zipinfo, previous, signature, dest))
+
+  def _flush_copies(self, out_zip):
+    """Copies the pending entries of the previous archive, in one go.
+
+    Args:
+      out_zip: The `ZipFile` into which the entries should be added.
+    """
+    pending = self._pending_copies
+    if not pending:
+      return
+    self._pending_copies = []
+    start = pending[0][1].offset
+    last = pending[-1][1]
+
+    # pylint: disable=protected-access
+    with out_zip._lock:
+      if out_zip._writing:
+        raise ValueError("Can't write to the ZIP file while there is another "
+                         'write handle open on it.')
+      fp = out_zip.fp
+      if out_zip._seekable:
+        fp.seek(out_zip.start_dir)
+      base = fp.tell()
+      for zipinfo, previous, _, _ in pending:
+        zipinfo.header_offset = base + previous.offset - start
+        out_zip._writecheck(zipinfo)
+      out_zip._didModify = True
+
+      _copy_range(self._previous_fd, start,
+                  last.offset + last.length - start, fp)
+
+      out_zip.start_dir = fp.tell()
+      for zipinfo, previous, signature, dest in pending:
+        out_zip.filelist.append(zipinfo)
+        out_zip.NameToInfo[zipinfo.filename] = zipinfo
+        self._index[dest] = [signature, zipinfo.header_offset, previous.length,
+                             previous.crc, previous.size]
 
-    self._entry_hashes[dest] = new_hash
+  def _index_written_entry(self, out_zip, dest, signature):
+    """Records an entry that was just written, for the next incremental run.
 
-    zipinfo = zipfile.ZipInfo(dest)
+    Args:
+      out_zip: The `ZipFile` the entry was written to.
+      dest: The path inside the archive where the entry was stored.
+      signature: The signature of the source of the entry, or None if this
+          isn't an incremental run.
+    """
+    if signature is None or dest in self._index:
+      return  # Not incremental, or a duplicate.
+    zipinfo = out_zip.NameToInfo[dest]
+    self._index[dest] = [signature, zipinfo.header_offset,
+                         out_zip.start_dir - zipinfo.header_offset,
+                         zipinfo.CRC, zipinfo.file_size]
+
+  def _is_duplicate(self, dest, size, crc, source):
+    """Checks whether an entry was already written at the given location.
+
+    The cheapest checks come first: the sizes, then the CRC-32s, and only if
+    both match, cryptographic digests of the data, read again from the sources
+    of both entries.
+
+    Args:
+      dest: The path inside the archive where the entry would be written.
+      size: The size of the entry's data.
+      crc: The CRC-32 of the entry's data, or None if it isn't known yet.
+      source: A function opening a binary file object to read the entry's data
+          from.
+    Returns:
+      True if the same data was already written there, False if nothing was.
+    Raises:
+      BundleConflictError: If different data was already written there.
+    """
+    existing_digest = self._entry_digests.get(dest)
+    if not existing_digest:
+      return False
+
+    if existing_digest.size == size:
+      if crc is None:
+        crc = _crc32(source)
+      if (existing_digest.crc == crc and
+          existing_digest.digest() == _digest(source)):
+        return True
+    raise BundleConflictError(BUNDLE_CONFLICT_MSG_TEMPLATE % dest)
+
+  @staticmethod
+  def _zipinfo(dest, is_executable, is_symlink):
+    """Returns the `ZipInfo` for an entry of the output ZIP archive.
+
+    Args:
+      dest: The path inside the archive where the data should be written.
+      is_executable: A Boolean value indicating whether or not the file should
+          be made executable.
+      is_symlink: A Boolean value indicating whether or not the file should
+          be made a symbolic link.
+    Returns:
+      The `ZipInfo`, with the permissions bundles are expected to have.
+    """
+    zipinfo = zipfile.ZipInfo(dest, date_time=_ZIP_EPOCH)
     zipinfo.compress_type = zipfile.ZIP_STORED
+    # As on any Unix, even when bundling elsewhere.
+    zipinfo.create_system = _CREATE_SYSTEM_UNIX
 
     if dest.endswith('/'):
       # Unix rwxr-xr-x permissions and S_IFDIR (directory) on the left side of
@@ -244,7 +1146,7 @@ class Bundler(object):
     if is_symlink:
       zipinfo.external_attr |= stat.S_IFLNK << 16
 
-    out_zip.writestr(zipinfo, data)
+    return zipinfo
 
 
 def _main(control_path):
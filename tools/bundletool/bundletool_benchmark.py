@@ -0,0 +1,407 @@
+# Copyright 2023 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for bundletool.
+
+files: Times bundling a directory with one large file (--large_file_mb, a
+    stand-in for a big binary or ML model) and many small resources, and
+    measures the peak memory allocated while doing it. It is compared with
+    reading each file into memory and hashing it before writing it, as
+    bundletool used to do.
+zips: Times merging a ZIP of stored (uncompressed) entries into a bundle,
+    compared with reading each entry through ZipFile.read and hashing it before
+    writing it, as bundletool used to do.
+read_ahead: Times bundling many small files and ZIP entries with entries read
+    ahead on a thread pool, compared with reading each one on the writing
+    thread just before writing it.
+walk: Times bundling a tree of --walk_files small files and counts the file
+    system calls made to find them and their status, compared with walking it
+    with os.walk and checking each file with os.access, as bundletool used to
+    do.
+incremental: Times rebundling 5000 files of 16 KB after one of them changed,
+    incrementally (see incremental_state) and from scratch.
+
+Usage: bundletool_benchmark [--iterations N] [--large_file_mb N]
+    [--walk_files N] [benchmark ...]
+"""
+
+import argparse
+import collections
+import contextlib
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import timeit
+import tracemalloc
+import zipfile
+
+from build_bazel_rules_apple.tools.bundletool import bundletool
+
+
+class _InMemoryBundler(bundletool.Bundler):
+  """Bundler that handles entries the way it used to, for comparison.
+
+  Every file and ZIP entry is read into memory and MD5-hashed before being
+  written with ZipFile.writestr.
+  """
+
+  def _file_entry(self, src, dest, executable, unused_st):
+
+    def write(out_zip, unused_prefetched):
+      with open(src, 'rb') as f:
+        self._write_bytes(f.read(), dest, executable, False, out_zip)
+
+    return lambda: None, write
+
+  def _add_zip_contents(self, src, dest, out_zip):
+    with zipfile.ZipFile(src, 'r') as src_zip:
+      for src_zipinfo in src_zip.infolist():
+        file_dest = os.path.normpath(os.path.join(dest, src_zipinfo.filename))
+        if src_zipinfo.filename.endswith('/'):
+          file_dest += '/'
+        self._write_bytes(src_zip.read(src_zipinfo), file_dest,
+                          src_zipinfo.external_attr >> 16 & 0o111 != 0, False,
+                          out_zip)
+
+  def _write_bytes(self, data, dest, is_executable, is_symlink, out_zip):
+    new_hash = hashlib.md5(data).digest()
+    existing_hash = self._entry_digests.get(dest)
+    if existing_hash:
+      if existing_hash == new_hash:
+        return
+      raise bundletool.BundleConflictError(
+          bundletool.BUNDLE_CONFLICT_MSG_TEMPLATE % dest)
+    self._entry_digests[dest] = new_hash
+    out_zip.writestr(self._zipinfo(dest, is_executable, is_symlink), data)
+
+
+class _OsWalkBundler(bundletool.Bundler):
+  """Bundler that walks directories the way it used to, for comparison.
+
+  Directories are walked with os.walk and each file is checked with os.access
+  to see if it is executable. Each file is then stat'ed once more, as it used
+  to be (with os.fstat, once opened) to get its size.
+  """
+
+  def _file_entries(self, src, dest, executable, contents_only):
+    if os.path.isdir(src):
+      for root, _, files in os.walk(src):
+        relpath = os.path.relpath(root, src)
+        if contents_only:
+          relpath = os.path.dirname(relpath)
+        for filename in files:
+          fsrc = os.path.join(root, filename)
+          fdest = os.path.normpath(os.path.join(dest, relpath, filename))
+          fexec = executable or os.access(fsrc, os.X_OK)
+          yield self._file_entry(fsrc, fdest, fexec, os.stat(fsrc))
+    elif os.path.isfile(src):
+      fexec = executable or os.access(src, os.X_OK)
+      yield self._file_entry(src, dest, fexec, os.stat(src))
+
+
+# The functions of the os module whose calls _SyscallCounter counts.
+_COUNTED_OS_FUNCTIONS = ('access', 'fstat', 'lstat', 'scandir', 'stat')
+
+
+class _CountingDirEntry(object):
+  """Wraps an os.DirEntry, counting the stat() calls that make a system call.
+
+  is_dir() and the like are taken to be free, as they are on file systems
+  that report file types in directory listings.
+  """
+
+  def __init__(self, entry, counter):
+    self._entry = entry
+    self._counter = counter
+    self._stats = {}
+
+  def __getattr__(self, name):
+    return getattr(self._entry, name)
+
+  def stat(self, *, follow_symlinks=True):
+    if follow_symlinks not in self._stats:
+      self._counter.count('DirEntry.stat')
+      self._stats[follow_symlinks] = self._entry.stat(
+          follow_symlinks=follow_symlinks)
+    return self._stats[follow_symlinks]
+
+
+class _CountingScandir(object):
+  """Wraps an os.scandir iterator, wrapping the entries it returns."""
+
+  def __init__(self, it, counter):
+    self._it = it
+    self._counter = counter
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    self._it.close()
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    return _CountingDirEntry(next(self._it), self._counter)
+
+  def close(self):
+    self._it.close()
+
+
+class _SyscallCounter(object):
+  """Counts the file system status calls made through the os module.
+
+  strace would count every system call, but isn't available everywhere; the
+  calls counted here are the ones walking directories and getting the status
+  of files make, which is where the bundlers being compared differ.
+  """
+
+  def __init__(self):
+    self.counts = collections.Counter()
+    self._lock = threading.Lock()
+
+  def count(self, name):
+    with self._lock:
+      self.counts[name] += 1
+
+  @contextlib.contextmanager
+  def patch(self):
+    """Counts the calls made while in the context."""
+    originals = {name: getattr(os, name) for name in _COUNTED_OS_FUNCTIONS}
+
+    def counting(name, func):
+      def wrapper(*args, **kwargs):
+        self.count(name)
+        result = func(*args, **kwargs)
+        if name == 'scandir':
+          return _CountingScandir(result, self)
+        return result
+      return wrapper
+
+    for name, func in originals.items():
+      setattr(os, name, counting(name, func))
+    try:
+      yield
+    finally:
+      for name, func in originals.items():
+        setattr(os, name, func)
+
+
+_BUNDLERS = {
+    'bundletool': bundletool.Bundler,
+    'in memory (previous)': _InMemoryBundler,
+}
+
+
+def _write_file(path, size):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, 'wb') as f:
+    # Random data in 1 MB blocks, repeated, to keep creating it cheap.
+    block = os.urandom(min(size, 1024 * 1024))
+    while size > 0:
+      f.write(block[:size])
+      size -= len(block)
+
+
+def _resources(directory, count, size=16 * 1024):
+  """Writes count small files in a tree of directories under directory."""
+  for i in range(count):
+    _write_file(os.path.join(
+        directory, 'group%d' % (i % 20), 'resource%d.png' % i), size)
+
+
+def _peak_memory(func):
+  tracemalloc.start()
+  try:
+    func()
+    return tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+
+def _compare_bundlers(control, number):
+  """Prints time and peak memory of running each bundler on the control."""
+  print('%-24s %14s %14s' % ('bundler', 'time', 'peak memory'))
+  for name, bundler in sorted(_BUNDLERS.items()):
+    def run():
+      bundler(dict(control)).run()  # pylint: disable=cell-var-from-loop
+    elapsed = min(timeit.repeat(run, number=number, repeat=3)) / number
+    peak = _peak_memory(run)
+    print('%-24s %11.1f ms %11.1f MB' % (name, elapsed * 1e3, peak / 1e6))
+
+
+def _benchmark_files(args):
+  temp_dir = tempfile.mkdtemp()
+  try:
+    src = os.path.join(temp_dir, 'src')
+    _write_file(os.path.join(src, 'Model.mlmodelc', 'model.espresso.weights'),
+                args.large_file_mb * 1024 * 1024)
+    _resources(src, 1000)
+    print('1 file of %d MB and 1000 of 16 KB' % args.large_file_mb)
+    _compare_bundlers({
+        'bundle_path': 'Payload/Benchmark.app',
+        'bundle_merge_files': [{'src': src, 'dest': '.'}],
+        'output': os.path.join(temp_dir, 'out.zip'),
+    }, max(1, args.iterations // 100))
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+def _benchmark_zips(args):
+  temp_dir = tempfile.mkdtemp()
+  try:
+    src = os.path.join(temp_dir, 'src')
+    _resources(src, 2000, size=64 * 1024)
+    src_zip = os.path.join(temp_dir, 'resources.zip')
+    with zipfile.ZipFile(src_zip, 'w') as z:
+      for root, _, files in os.walk(src):
+        for filename in files:
+          path = os.path.join(root, filename)
+          z.write(path, os.path.relpath(path, src))
+    print('ZIP of 2000 entries of 64 KB')
+    _compare_bundlers({
+        'bundle_path': 'Payload/Benchmark.app',
+        'bundle_merge_zips': [{'src': src_zip, 'dest': '.'}],
+        'output': os.path.join(temp_dir, 'out.zip'),
+    }, max(1, args.iterations // 100))
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+def _benchmark_read_ahead(args):
+  temp_dir = tempfile.mkdtemp()
+  try:
+    src = os.path.join(temp_dir, 'src')
+    _resources(src, 5000, size=4 * 1024)
+    src_zip = os.path.join(temp_dir, 'resources.zip')
+    shutil.make_archive(src_zip[:-len('.zip')], 'zip', src)
+    control = {
+        'bundle_path': 'Payload/Benchmark.app',
+        'bundle_merge_files': [{'src': src, 'dest': 'files'}],
+        'bundle_merge_zips': [{'src': src_zip, 'dest': 'zip'}],
+        'output': os.path.join(temp_dir, 'out.zip'),
+    }
+    number = max(1, args.iterations // 100)
+    print('5000 files and ZIP entries of 4 KB, %d readers' %
+          bundletool._MAX_READERS)
+    print('%-24s %14s' % ('reads', 'time'))
+    for name, prefetch_max_size in (
+        ('read ahead', bundletool._PREFETCH_MAX_SIZE),
+        ('on the writing thread', -1)):
+      original = bundletool._PREFETCH_MAX_SIZE
+      bundletool._PREFETCH_MAX_SIZE = prefetch_max_size
+      try:
+        elapsed = min(timeit.repeat(
+            lambda: bundletool.Bundler(dict(control)).run(),
+            number=number, repeat=3)) / number
+      finally:
+        bundletool._PREFETCH_MAX_SIZE = original
+      print('%-24s %11.1f ms' % (name, elapsed * 1e3))
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+def _benchmark_incremental(args):
+  temp_dir = tempfile.mkdtemp()
+  try:
+    src = os.path.join(temp_dir, 'src')
+    _resources(src, 5000)
+    control = {
+        'bundle_path': 'Payload/Benchmark.app',
+        'bundle_merge_files': [{'src': src, 'dest': '.'}],
+        'output': os.path.join(temp_dir, 'out.zip'),
+    }
+    changed = os.path.join(src, 'group7', 'resource2507.png')
+    number = max(1, args.iterations // 100)
+    print('5000 files of 16 KB, one of which changed')
+    print('%-24s %14s' % ('run', 'time'))
+    for name, incremental in (('full', False), ('incremental', True)):
+      run_control = dict(control)
+      if incremental:
+        run_control['incremental_state'] = os.path.join(temp_dir, 'state')
+        bundletool.Bundler(dict(run_control)).run()
+
+      def run(run_control=run_control):
+        _write_file(changed, 16 * 1024)
+        bundletool.Bundler(dict(run_control)).run()
+      elapsed = min(timeit.repeat(run, number=number, repeat=3)) / number
+      print('%-24s %11.1f ms' % (name, elapsed * 1e3))
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+def _benchmark_walk(args):
+  temp_dir = tempfile.mkdtemp()
+  try:
+    src = os.path.join(temp_dir, 'src')
+    _resources(src, args.walk_files, size=64)
+    control = {
+        'bundle_path': 'Payload/Benchmark.app',
+        'bundle_merge_files': [{'src': src, 'dest': '.'}],
+        'output': os.path.join(temp_dir, 'out.zip'),
+    }
+    print('%d files of 64 B' % args.walk_files)
+    print('%-24s %14s %10s  %s' % ('bundler', 'time', 'calls', 'by function'))
+    for name, bundler in (('bundletool', bundletool.Bundler),
+                          ('os.walk (previous)', _OsWalkBundler)):
+      def run(bundler=bundler):
+        bundler(dict(control)).run()
+      elapsed = min(timeit.repeat(run, number=1, repeat=3))
+      counter = _SyscallCounter()
+      with counter.patch():
+        run()
+      print('%-24s %11.1f ms %10d  %s' % (
+          name, elapsed * 1e3, sum(counter.counts.values()),
+          ', '.join('%s %d' % item for item in sorted(counter.counts.items()))))
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+_BENCHMARKS = {
+    'files': _benchmark_files,
+    'incremental': _benchmark_incremental,
+    'read_ahead': _benchmark_read_ahead,
+    'walk': _benchmark_walk,
+    'zips': _benchmark_zips,
+}
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument(
+      '--iterations', type=int, default=200,
+      help='Scales the number of runs per timing sample.')
+  parser.add_argument(
+      '--large_file_mb', type=int, default=256,
+      help='Size of the large file bundled by the "files" benchmark.')
+  parser.add_argument(
+      '--walk_files', type=int, default=50000,
+      help='Number of files bundled by the "walk" benchmark.')
+  parser.add_argument(
+      'benchmarks', nargs='*', choices=sorted(_BENCHMARKS) + [[]],
+      help='The benchmarks to run, defaults to all of them.')
+  args = parser.parse_args()
+
+  for name in args.benchmarks or sorted(_BENCHMARKS):
+    print('== %s ==' % name)
+    _BENCHMARKS[name](args)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
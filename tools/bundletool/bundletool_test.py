@@ -14,6 +14,7 @@
 
 """Tests for Bundler."""
 
+import contextlib
 import io
 import os
 import re
@@ -21,6 +22,7 @@ import shutil
 import stat
 import tempfile
 import unittest
+from unittest import mock
 import zipfile
 
 from build_bazel_rules_apple.tools.bundletool import bundletool
@@ -306,5 +308,307 @@ class BundlerTest(unittest.TestCase):
           ]
       })
 
+  def test_stored_zip_entries_are_copied_without_reading_them(self):
+    foo_zip = self._scratch_zip(
+        'foo.zip', 'foo.bundle/', 'foo.bundle/strings.txt:some strings',
+        '*foo.bundle/some.exe:binary')
+    with mock.patch.object(zipfile.ZipFile, 'read') as read:
+      out_zip = _run_bundler({
+          'bundle_path': 'Payload/foo.app',
+          'bundle_merge_zips': [{'src': foo_zip, 'dest': '.'}],
+      })
+    read.assert_not_called()
+    with zipfile.ZipFile(out_zip, 'r') as z:
+      self.assertIsNone(z.testzip())
+      self.assertIn('Payload/foo.app/foo.bundle/', z.namelist())
+      self._assert_zip_contains(z, 'Payload/foo.app/foo.bundle/some.exe', True)
+      self.assertEqual(
+          z.read('Payload/foo.app/foo.bundle/strings.txt'), b'some strings')
+
+  def test_compressed_zip_entries_are_stored_uncompressed(self):
+    foo_zip = os.path.join(self._scratch_dir, 'foo.zip')
+    with zipfile.ZipFile(foo_zip, 'w', zipfile.ZIP_DEFLATED) as z:
+      z.writestr('foo.bundle/strings.txt', 'some strings' * 100)
+    out_zip = _run_bundler({
+        'bundle_path': 'Payload/foo.app',
+        'bundle_merge_zips': [{'src': foo_zip, 'dest': '.'}],
+    })
+    with zipfile.ZipFile(out_zip, 'r') as z:
+      zipinfo = z.getinfo('Payload/foo.app/foo.bundle/strings.txt')
+      self.assertEqual(zipinfo.compress_type, zipfile.ZIP_STORED)
+      self.assertEqual(z.read(zipinfo), b'some strings' * 100)
+
+  def test_zip_entry_and_file_with_same_content_are_allowed(self):
+    one_zip = self._scratch_zip('one.zip', 'some.dylib:foo')
+    foo_txt = self._scratch_file('foo.txt', 'foo')
+    out_zip = _run_bundler({
+        'bundle_path': 'Payload/foo.app',
+        'bundle_merge_zips': [{'src': one_zip, 'dest': '.'}],
+        'bundle_merge_files': [{'src': foo_txt, 'dest': 'some.dylib'}],
+    })
+    with zipfile.ZipFile(out_zip, 'r') as z:
+      self.assertEqual(z.namelist(), ['Payload/foo.app/some.dylib'])
+
+  def test_zip_entry_and_file_with_different_content_raise_error(self):
+    one_zip = self._scratch_zip('one.zip', 'some.dylib:foo')
+    bar_txt = self._scratch_file('bar.txt', 'bar')
+    with self.assertRaisesRegex(
+        bundletool.BundleConflictError,
+        re.escape(bundletool.BUNDLE_CONFLICT_MSG_TEMPLATE %
+                  'Payload/foo.app/some.dylib')):
+      _run_bundler({
+          'bundle_path': 'Payload/foo.app',
+          'bundle_merge_zips': [{'src': one_zip, 'dest': '.'}],
+          'bundle_merge_files': [{'src': bar_txt, 'dest': 'some.dylib'}],
+      })
+
+  def test_entries_with_same_size_and_crc_but_different_content_raise_error(
+      self):
+    # Both have a CRC-32 of 0x3e5b2bb7.
+    one_zip = self._scratch_zip('one.zip', 'some.dylib:fee94f1b8fcd0fa2')
+    foo_txt = self._scratch_file('foo.txt', '854828d1483bb8a7')
+    with self.assertRaisesRegex(
+        bundletool.BundleConflictError,
+        re.escape(bundletool.BUNDLE_CONFLICT_MSG_TEMPLATE %
+                  'Payload/foo.app/some.dylib')):
+      _run_bundler({
+          'bundle_path': 'Payload/foo.app',
+          'bundle_merge_zips': [{'src': one_zip, 'dest': '.'}],
+          'bundle_merge_files': [{'src': foo_txt, 'dest': 'some.dylib'}],
+      })
+
+  def test_entries_are_only_hashed_when_size_and_crc_match(self):
+    foo_txt = self._scratch_file('foo.txt', 'foo')
+    bar_txt = self._scratch_file('bar.txt', 'bar')
+    long_txt = self._scratch_file('long.txt', 'foobar')
+    one_zip = self._scratch_zip('one.zip', 'some.dylib:foo')
+    with mock.patch.object(
+        bundletool, '_digest', wraps=bundletool._digest) as digest:
+      _run_bundler({
+          'bundle_path': 'Payload/foo.app',
+          'bundle_merge_zips': [{'src': one_zip, 'dest': '.'}],
+          'bundle_merge_files': [
+              {'src': foo_txt, 'dest': 'foo.txt'},
+              {'src': bar_txt, 'dest': 'bar.txt'},
+          ],
+      })
+      digest.assert_not_called()
+
+      for other_txt in (bar_txt, long_txt):
+        with self.assertRaises(bundletool.BundleConflictError):
+          _run_bundler({
+              'bundle_path': 'Payload/foo.app',
+              'bundle_merge_files': [
+                  {'src': foo_txt, 'dest': 'foo.txt'},
+                  {'src': other_txt, 'dest': 'foo.txt'},
+              ],
+          })
+      digest.assert_not_called()
+
+      _run_bundler({
+          'bundle_path': 'Payload/foo.app',
+          'bundle_merge_zips': [{'src': one_zip, 'dest': '.'}],
+          'bundle_merge_files': [
+              {'src': foo_txt, 'dest': 'some.dylib'},
+              {'src': foo_txt, 'dest': 'some.dylib'},
+          ],
+      })
+      # Once for each entry, the first one's digest is kept.
+      self.assertEqual(digest.call_count, 3)
+
+  def test_files_are_copied_in_chunks(self):
+    foo_txt = self._scratch_file('foo.txt', 'some content')
+    bar_txt = self._scratch_file('bar.txt', 'some content')
+    baz_txt = self._scratch_file('baz.txt', 'other content')
+    with mock.patch.object(bundletool, '_COPY_CHUNK_SIZE', 5), \
+        mock.patch.object(bundletool, '_PREFETCH_MAX_SIZE', 0):
+      out_zip = _run_bundler({
+          'bundle_path': 'Payload/foo.app',
+          'bundle_merge_files': [
+              {'src': foo_txt, 'dest': 'foo.txt'},
+              {'src': bar_txt, 'dest': 'foo.txt'},
+          ]
+      })
+      with self.assertRaisesRegex(
+          bundletool.BundleConflictError,
+          re.escape(bundletool.BUNDLE_CONFLICT_MSG_TEMPLATE %
+                    'Payload/foo.app/foo.txt')):
+        _run_bundler({
+            'bundle_path': 'Payload/foo.app',
+            'bundle_merge_files': [
+                {'src': foo_txt, 'dest': 'foo.txt'},
+                {'src': baz_txt, 'dest': 'foo.txt'},
+            ]
+        })
+    with zipfile.ZipFile(out_zip, 'r') as z:
+      self.assertIsNone(z.testzip())
+      self.assertEqual(z.read('Payload/foo.app/foo.txt'), b'some content')
+
+  def test_entries_read_ahead_are_written_in_order(self):
+    for i in range(100):
+      self._scratch_file('dir/%d/file.txt' % (i % 7), 'x' * i)
+    self._scratch_file('dir/executable', executable=True)
+    entries = ['%d.txt:%s' % (i, 'y' * i) for i in range(100)]
+    stored_zip = self._scratch_zip('stored.zip', *entries)
+    compressed_zip = os.path.join(self._scratch_dir, 'compressed.zip')
+    with zipfile.ZipFile(compressed_zip, 'w', zipfile.ZIP_DEFLATED) as z:
+      for i in range(100):
+        z.writestr('%d.txt' % i, 'z' * i)
+
+    def bundle():
+      return _run_bundler({
+          'bundle_path': 'Payload/foo.app',
+          'bundle_merge_files': [
+              {'src': os.path.join(self._scratch_dir, 'dir'), 'dest': 'dir'},
+          ],
+          'bundle_merge_zips': [
+              {'src': stored_zip, 'dest': 'stored'},
+              {'src': compressed_zip, 'dest': 'compressed'},
+          ],
+      }).getvalue()
+
+    # Entries of up to 50 bytes are read ahead, larger ones aren't.
+    with mock.patch.object(bundletool, '_PREFETCH_MAX_SIZE', 50):
+      read_ahead = bundle()
+    with mock.patch.object(bundletool, '_PREFETCH_MAX_SIZE', -1):
+      self.assertEqual(read_ahead, bundle())
+
+  def test_files_are_walked_in_os_walk_order(self):
+    for i in range(30):
+      self._scratch_file('dir/%d/%d/file%d.txt' % (i % 3, i % 5, i))
+    top = os.path.join(self._scratch_dir, 'dir')
+    os.symlink(os.path.join(top, '1'), os.path.join(top, 'link_to_dir'))
+    os.symlink(os.path.join(top, '1', '1', 'file1.txt'),
+               os.path.join(top, 'link_to_file'))
+    os.symlink(os.path.join(top, 'missing'), os.path.join(top, 'broken_link'))
+
+    walked = [(root, [entry.name for entry in files])
+              for root, files in bundletool._walk_files(top)]
+    self.assertEqual(walked,
+                     [(root, files) for root, _, files in os.walk(top)])
+    self.assertEqual(
+        [(root, [entry.name for entry in files])
+         for root, files in bundletool._walk_files(top, sort=True)],
+        sorted((root, sorted(files)) for root, files in walked))
+
+  def test_reproducible_output_does_not_depend_on_listing_order(self):
+    for name in ('b/2.txt', 'b/1.txt', 'a/3.txt', 'c/4.txt', '5.txt'):
+      self._scratch_file('dir/' + name, name)
+    scandir = os.scandir
+
+    @contextlib.contextmanager
+    def reversed_scandir(path):
+      with scandir(path) as entries:
+        yield reversed(list(entries))
+
+    def bundle(reverse_listing, **options):
+      control = dict(
+          options,
+          bundle_path='Payload/foo.app',
+          bundle_merge_files=[
+              {'src': os.path.join(self._scratch_dir, 'dir'), 'dest': '.'},
+          ])
+      if not reverse_listing:
+        return _run_bundler(control).getvalue()
+      with mock.patch.object(os, 'scandir', reversed_scandir):
+        return _run_bundler(control).getvalue()
+
+    self.assertNotEqual(bundle(False), bundle(True))
+    reproducible = bundle(False, reproducible=True)
+    self.assertEqual(reproducible, bundle(True, reproducible=True))
+    with zipfile.ZipFile(io.BytesIO(reproducible), 'r') as z:
+      self.assertEqual(z.namelist(), [
+          'Payload/foo.app/5.txt',
+          'Payload/foo.app/a/3.txt',
+          'Payload/foo.app/b/1.txt',
+          'Payload/foo.app/b/2.txt',
+          'Payload/foo.app/c/4.txt',
+      ])
+
+  def test_sort_central_directory(self):
+    foo_txt = self._scratch_file('foo.txt', 'foo')
+    one_zip = self._scratch_zip('one.zip', 'z.txt:z', 'b.txt:b')
+    out_zip = _run_bundler({
+        'bundle_path': 'Payload/foo.app',
+        'bundle_merge_files': [{'src': foo_txt, 'dest': 'a.txt'}],
+        'bundle_merge_zips': [{'src': one_zip, 'dest': '.'}],
+        'sort_central_directory': True,
+    })
+    with zipfile.ZipFile(out_zip, 'r') as z:
+      self.assertIsNone(z.testzip())
+      self.assertEqual(z.namelist(), [
+          'Payload/foo.app/a.txt',
+          'Payload/foo.app/b.txt',
+          'Payload/foo.app/z.txt',
+      ])
+      # The entries themselves are still in the order they were added.
+      self.assertEqual(
+          [i.filename for i in sorted(z.infolist(),
+                                      key=lambda i: i.header_offset)],
+          ['Payload/foo.app/z.txt',
+           'Payload/foo.app/b.txt',
+           'Payload/foo.app/a.txt'])
+
+  def test_incremental_runs_match_full_runs(self):
+    for i in range(20):
+      self._scratch_file('dir/%d.txt' % i, 'x' * i)
+    self._scratch_file('dir/large.bin', 'l' * 100)
+    stored_zip = self._scratch_zip('stored.zip', 'a.txt:a', '*b:b')
+    compressed_zip = os.path.join(self._scratch_dir, 'compressed.zip')
+    with zipfile.ZipFile(compressed_zip, 'w', zipfile.ZIP_DEFLATED) as z:
+      z.writestr('c.txt', 'c' * 100)
+    control = {
+        'bundle_path': 'Payload/foo.app',
+        'bundle_merge_files': [
+            {'src': os.path.join(self._scratch_dir, 'dir'), 'dest': 'dir'},
+        ],
+        'bundle_merge_zips': [
+            {'src': stored_zip, 'dest': 'stored'},
+            {'src': compressed_zip, 'dest': '.'},
+        ],
+        'root_merge_zips': [{'src': stored_zip, 'dest': 'root'}],
+    }
+    state_dir = os.path.join(self._scratch_dir, 'state')
+
+    def bundle(incremental):
+      output = os.path.join(
+          self._scratch_dir, 'incremental.zip' if incremental else 'full.zip')
+      run_control = dict(control, output=output)
+      if incremental:
+        run_control['incremental_state'] = state_dir
+      bundletool.Bundler(run_control).run()
+      with open(output, 'rb') as f:
+        return f.read()
+
+    copy_range = mock.patch.object(
+        bundletool, '_copy_range', wraps=bundletool._copy_range)
+    # Files of more than 50 bytes are copied in chunks when written.
+    with mock.patch.object(bundletool, '_PREFETCH_MAX_SIZE', 50):
+      with copy_range as copied:
+        self.assertEqual(bundle(incremental=True), bundle(incremental=False))
+        copied.assert_not_called()
+
+      # Nothing changed, so the whole archive is copied at once.
+      with copy_range as copied:
+        self.assertEqual(bundle(incremental=True), bundle(incremental=False))
+        copied.assert_called_once()
+
+      self._scratch_file('dir/3.txt', 'changed')
+      self._scratch_file('dir/new.txt', 'new')
+      os.remove(os.path.join(self._scratch_dir, 'dir/7.txt'))
+      os.chmod(os.path.join(self._scratch_dir, 'dir/large.bin'), 0o755)
+      self._scratch_zip('stored.zip', 'a.txt:changed', '*b:b')
+      with copy_range as copied:
+        self.assertEqual(bundle(incremental=True), bundle(incremental=False))
+        copied.assert_called()
+
+      # A missing (or stale) state just means a full run.
+      os.remove(os.path.join(state_dir, 'index.json'))
+      self._scratch_file('dir/3.txt', 'changed again')
+      with copy_range as copied:
+        self.assertEqual(bundle(incremental=True), bundle(incremental=False))
+        copied.assert_not_called()
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,155 @@
+# Copyright 2023 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares two ZIP archives structurally.
+
+Where a plain byte comparison of two bundles only says that they differ, this
+says how: which entries only one of them has, whether the entries are in a
+different order (in the archive or in its central directory), and which fields
+of the entries that both have differ (timestamps, permissions, sizes, CRC-32s
+and so on). That is what is needed to find why a bundle isn't reproducible.
+
+Usage: zipdiff ARCHIVE1 ARCHIVE2
+
+Prints the differences, one per line, and exits with status 1 if there are
+any, 0 otherwise.
+"""
+
+import sys
+import zipfile
+
+# How much of an entry is compared at a time.
+_CHUNK_SIZE = 1024 * 1024
+
+# The fields of an entry that are compared, as ZipInfo attributes.
+_ENTRY_FIELDS = (
+    'date_time',
+    'compress_type',
+    'comment',
+    'extra',
+    'create_system',
+    'create_version',
+    'extract_version',
+    'flag_bits',
+    'volume',
+    'internal_attr',
+    'external_attr',
+    'CRC',
+    'compress_size',
+    'file_size',
+)
+
+
+def _format_field(field, value):
+  """Returns how a field of an entry is shown."""
+  if field == 'external_attr':
+    # The Unix mode and file type are in the high 16 bits.
+    return '0o%o (0x%x)' % (value >> 16, value & 0xffff)
+  if field == 'CRC':
+    return '0x%08x' % value
+  return repr(value)
+
+
+def _order_difference(kind, names1, names2):
+  """Describes where two orderings of the same entries first differ, if so."""
+  common = set(names1) & set(names2)
+  order1 = [name for name in names1 if name in common]
+  order2 = [name for name in names2 if name in common]
+  for i, (name1, name2) in enumerate(zip(order1, order2)):
+    if name1 != name2:
+      return '%s order differs at position %d: %r vs %r' % (
+          kind, i, name1, name2)
+  return None
+
+
+def _same_contents(zip1, info1, zip2, info2):
+  """Returns whether two entries have the same contents, compared in chunks."""
+  with zip1.open(info1) as data1, zip2.open(info2) as data2:
+    while True:
+      chunk1 = data1.read(_CHUNK_SIZE)
+      if chunk1 != data2.read(_CHUNK_SIZE):
+        return False
+      if not chunk1:
+        return True
+
+
+def diff_archives(path1, path2):
+  """Returns the structural differences between two ZIP archives.
+
+  Args:
+    path1: The path to (or binary file object of) the first archive.
+    path2: The path to (or binary file object of) the second archive.
+  Returns:
+    A list of descriptions of the differences, empty if the archives have the
+    same entries, in the same order, with the same metadata and contents.
+  """
+  differences = []
+  with zipfile.ZipFile(path1, 'r') as zip1, \
+      zipfile.ZipFile(path2, 'r') as zip2:
+    infos1 = zip1.infolist()
+    infos2 = zip2.infolist()
+    names1 = [info.filename for info in infos1]
+    names2 = [info.filename for info in infos2]
+
+    for name in names1:
+      if name not in zip2.NameToInfo:
+        differences.append('Only in the first archive: %r' % name)
+    for name in names2:
+      if name not in zip1.NameToInfo:
+        differences.append('Only in the second archive: %r' % name)
+
+    central_order = _order_difference('Central directory', names1, names2)
+    if central_order:
+      differences.append(central_order)
+    # The order of the entries themselves, by where they are in the archive.
+    archive_order = _order_difference(
+        'Archive',
+        [i.filename for i in sorted(infos1, key=lambda i: i.header_offset)],
+        [i.filename for i in sorted(infos2, key=lambda i: i.header_offset)])
+    if archive_order:
+      differences.append(archive_order)
+
+    for info1 in infos1:
+      info2 = zip2.NameToInfo.get(info1.filename)
+      if not info2:
+        continue
+      for field in _ENTRY_FIELDS:
+        value1 = getattr(info1, field)
+        value2 = getattr(info2, field)
+        if value1 != value2:
+          differences.append('%s of %r differs: %s vs %s' % (
+              field, info1.filename, _format_field(field, value1),
+              _format_field(field, value2)))
+      if (info1.CRC == info2.CRC and info1.file_size == info2.file_size and
+          not _same_contents(zip1, info1, zip2, info2)):
+        differences.append('Contents of %r differ' % info1.filename)
+
+    if zip1.comment != zip2.comment:
+      differences.append('Archive comment differs: %r vs %r' % (
+          zip1.comment, zip2.comment))
+  return differences
+
+
+def main(argv):
+  if len(argv) != 3:
+    sys.stderr.write('Usage: %s ARCHIVE1 ARCHIVE2\n' % argv[0])
+    return 2
+  differences = diff_archives(argv[1], argv[2])
+  for difference in differences:
+    print(difference)
+  return 1 if differences else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
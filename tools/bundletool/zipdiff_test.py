@@ -0,0 +1,100 @@
+# Copyright 2023 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for zipdiff."""
+
+import io
+import unittest
+import zipfile
+
+from build_bazel_rules_apple.tools.bundletool import zipdiff
+
+
+def _archive(*entries, sort_central_directory=False):
+  """Returns a BytesIO with a ZIP archive of the given entries.
+
+  Args:
+    *entries: Tuples of the path, contents and (optionally) a dictionary of
+        ZipInfo attributes of each entry.
+    sort_central_directory: Whether to sort the central directory by path.
+  Returns:
+    The BytesIO.
+  """
+  archive = io.BytesIO()
+  with zipfile.ZipFile(archive, 'w') as z:
+    for name, contents, *attributes in entries:
+      zipinfo = zipfile.ZipInfo(name)
+      zipinfo.external_attr = 0o100644 << 16
+      for attribute, value in (attributes[0] if attributes else {}).items():
+        setattr(zipinfo, attribute, value)
+      z.writestr(zipinfo, contents)
+    if sort_central_directory:
+      z.filelist.sort(key=lambda zipinfo: zipinfo.filename)
+  archive.seek(0)
+  return archive
+
+
+class ZipDiffTest(unittest.TestCase):
+
+  def test_same_archives(self):
+    entries = [('a.txt', 'a'), ('b/c.txt', 'c')]
+    self.assertEqual(
+        zipdiff.diff_archives(_archive(*entries), _archive(*entries)), [])
+
+  def test_different_entries(self):
+    self.assertEqual(
+        zipdiff.diff_archives(
+            _archive(('a.txt', 'a'), ('b.txt', 'b')),
+            _archive(('a.txt', 'a'), ('c.txt', 'c'))),
+        ["Only in the first archive: 'b.txt'",
+         "Only in the second archive: 'c.txt'"])
+
+  def test_different_order(self):
+    self.assertEqual(
+        zipdiff.diff_archives(
+            _archive(('a.txt', 'a'), ('b.txt', 'b')),
+            _archive(('b.txt', 'b'), ('a.txt', 'a'))),
+        ["Central directory order differs at position 0: 'a.txt' vs 'b.txt'",
+         "Archive order differs at position 0: 'a.txt' vs 'b.txt'"])
+    self.assertEqual(
+        zipdiff.diff_archives(
+            _archive(('b.txt', 'b'), ('a.txt', 'a')),
+            _archive(('b.txt', 'b'), ('a.txt', 'a'),
+                     sort_central_directory=True)),
+        ["Central directory order differs at position 0: 'b.txt' vs 'a.txt'"])
+
+  def test_different_metadata(self):
+    self.assertEqual(
+        zipdiff.diff_archives(
+            _archive(('a', 'a', {'date_time': (2000, 1, 1, 0, 0, 0)})),
+            _archive(('a', 'a', {'external_attr': 0o100755 << 16}))),
+        ["date_time of 'a' differs: (2000, 1, 1, 0, 0, 0) vs "
+         "(1980, 1, 1, 0, 0, 0)",
+         "external_attr of 'a' differs: 0o100644 (0x0) vs 0o100755 (0x0)"])
+
+  def test_different_contents(self):
+    self.assertEqual(
+        zipdiff.diff_archives(
+            _archive(('a.txt', 'a')), _archive(('a.txt', 'b'))),
+        ["CRC of 'a.txt' differs: 0xe8b7be43 vs 0x71beeff9"])
+    # Both have a CRC-32 of 0x3e5b2bb7.
+    self.assertEqual(
+        zipdiff.diff_archives(
+            _archive(('a.txt', 'fee94f1b8fcd0fa2')),
+            _archive(('a.txt', '854828d1483bb8a7'))),
+        ["Contents of 'a.txt' differ"])
+
+
+if __name__ == '__main__':
+  unittest.main()
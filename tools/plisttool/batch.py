@@ -0,0 +1,162 @@
+# Copyright 2023 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Runs the controls of a plisttool batch, sharing the files they read.
+
+plisttool only imports this module for batch manifests and in worker mode.
+"""
+
+import collections
+from concurrent import futures
+import os
+import threading
+
+
+class PlistCache(object):
+  """A thread-safe memo of decoded plist and JSON files, keyed by path.
+
+  When one process handles many controls (see the batch manifest in the
+  plisttool moduledoc), inputs referenced by several of them, such as
+  provisioning profile metadata, version files and child plists, are only read
+  and parsed once. The cached values are shared by all callers, so they must
+  be treated as read-only (which merging and validation already do).
+
+  Keys are tuples whose second item is the path the value was derived from.
+  A cache that outlives a build (see worker.PersistentWorker) must be created
+  with check_files, so values are only reused while the file is unchanged,
+  and with max_entries, so it doesn't keep every file it ever saw.
+  """
+
+  def __init__(self, check_files=False, max_entries=None):
+    """Initializes the cache.
+
+    Args:
+      check_files: Whether to reload values whose file has changed (by size,
+          modification time or inode) since they were loaded.
+      max_entries: If set, the least recently used values are dropped to keep
+          at most this many.
+    """
+    self._lock = threading.Lock()
+    self._futures = collections.OrderedDict()
+    self._check_files = check_files
+    self._max_entries = max_entries
+    self._signatures = {}
+
+  def get(self, key, load):
+    """Returns the cached value for key, calling load() to create it.
+
+    If several threads ask for the same key at once, one loads it and the
+    others wait for its result. Failures aren't cached (error messages include
+    the requesting target), so a waiter whose loader failed loads the value
+    itself to raise its own error.
+
+    Args:
+      key: The (hashable) cache key.
+      load: Function returning the value when it isn't cached yet.
+    Returns:
+      The value.
+    """
+    signature = None
+    if self._check_files and isinstance(key[1], str):
+      try:
+        st = os.stat(key[1])
+      except OSError:
+        # Not cached; the loader reports the error.
+        return load()
+      signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    with self._lock:
+      future = self._futures.get(key)
+      owner = future is None or self._signatures.get(key) != signature
+      if owner:
+        future = futures.Future()
+        self._futures[key] = future
+        self._signatures[key] = signature
+      self._futures.move_to_end(key)
+      if self._max_entries is not None:
+        while len(self._futures) > self._max_entries:
+          old_key, _ = self._futures.popitem(last=False)
+          del self._signatures[old_key]
+
+    if not owner:
+      try:
+        return future.result()
+      except Exception:  # pylint: disable=broad-except
+        return load()
+
+    try:
+      value = load()
+    except BaseException as e:
+      with self._lock:
+        if self._futures.get(key) is future:
+          del self._futures[key]
+          del self._signatures[key]
+      future.set_exception(e)
+      raise
+    future.set_result(value)
+    return value
+
+
+# For each process of a batch using a process pool, the function running a
+# control and the process's PlistCache.
+_process_run_control = None
+_process_plist_cache = None
+
+
+def _init_process(run_control):
+  """Initializer for the processes of a batch's process pool."""
+  global _process_run_control, _process_plist_cache
+  _process_run_control = run_control
+  _process_plist_cache = PlistCache()
+
+
+def _run_in_process(control):
+  """Runs one control of a batch in a process pool process."""
+  return _process_run_control(control, _process_plist_cache)
+
+
+def run_batch(controls, run_control, jobs=1, pool='threads', plist_cache=None):
+  """Runs every control of a batch.
+
+  All controls share a PlistCache, so files used by several of them are only
+  parsed once (per process when a process pool is used). Every control runs
+  even if others fail.
+
+  Args:
+    controls: The controls of the batch (dictionaries or control file paths).
+    run_control: Function taking a control and a PlistCache, returning the
+        error message if the control failed, otherwise None. It has to be a
+        module-level function when pool is 'processes', so it can be pickled.
+    jobs: The most controls to run at once.
+    pool: 'threads' or 'processes', the kind of pool used when jobs > 1.
+    plist_cache: An optional PlistCache to use instead of a new one (not used
+        with a process pool).
+  Returns:
+    A list with, for each control in order, its error message or None.
+  """
+  if plist_cache is None:
+    plist_cache = PlistCache()
+
+  if jobs <= 1 or len(controls) <= 1:
+    return [run_control(c, plist_cache) for c in controls]
+
+  if pool == 'processes':
+    with futures.ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_process,
+        initargs=(run_control,)) as executor:
+      return list(executor.map(_run_in_process, controls))
+
+  with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    return list(executor.map(lambda c: run_control(c, plist_cache), controls))
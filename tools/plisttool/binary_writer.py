@@ -0,0 +1,190 @@
+# Copyright 2023 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Deterministic writer for binary (bplist00) plists.
+
+plisttool only imports this module when the control asks for binary output.
+"""
+
+import datetime
+import struct
+
+# The struct formats of unsigned ints in binary plists, by size in bytes.
+UINT_FORMATS = {1: 'B', 2: 'H', 4: 'L', 8: 'Q'}
+
+# The reference date of dates in binary plists.
+EPOCH = datetime.datetime(2001, 1, 1)
+
+
+def _binary_plist_int_size(value):
+  """Returns the number of bytes needed for an unsigned offset or reference."""
+  if value < 1 << 8:
+    return 1
+  if value < 1 << 16:
+    return 2
+  if value < 1 << 32:
+    return 4
+  return 8
+
+
+class _BinaryPlistWriter(object):
+  """Serializes a plist into the binary (bplist00) format in one pass.
+
+  The object table only depends on the values in the plist: dictionary keys
+  are visited in sorted order, objects are numbered in pre-order (for a
+  dictionary, all keys then all values, like CoreFoundation and plistlib) and
+  equal scalars are written once. Unlike plistlib, containers are never
+  shared based on object identity, so whether two equal subtrees happen to be
+  the same Python object doesn't change the output. The result is byte for
+  byte the same across machines and Python versions.
+  """
+
+  def __init__(self):
+    # Encoded scalars (bytes) or, for containers, (token, [child refs]).
+    self._objects = []
+    # Maps scalar keys (see _scalar_key) to their reference number.
+    self._scalar_refs = {}
+
+  @staticmethod
+  def _scalar_key(value):
+    if isinstance(value, float):
+      # Keeps 0.0/-0.0 apart, and makes NaN match itself.
+      return (float, struct.pack('>d', value))
+    return (type(value), value)
+
+  @staticmethod
+  def _encode_size(token, size):
+    if size < 15:
+      return struct.pack('>B', token | size)
+    if size < 1 << 8:
+      return struct.pack('>BBB', token | 0xF, 0x10, size)
+    if size < 1 << 16:
+      return struct.pack('>BBH', token | 0xF, 0x11, size)
+    if size < 1 << 32:
+      return struct.pack('>BBL', token | 0xF, 0x12, size)
+    return struct.pack('>BBQ', token | 0xF, 0x13, size)
+
+  @classmethod
+  def _encode_scalar(cls, value):
+    if value is None:
+      return b'\x00'
+    if value is False:
+      return b'\x08'
+    if value is True:
+      return b'\x09'
+    if isinstance(value, int):
+      if value < 0:
+        try:
+          return struct.pack('>Bq', 0x13, value)
+        except struct.error:
+          raise OverflowError(value)
+      if value < 1 << 8:
+        return struct.pack('>BB', 0x10, value)
+      if value < 1 << 16:
+        return struct.pack('>BH', 0x11, value)
+      if value < 1 << 32:
+        return struct.pack('>BL', 0x12, value)
+      if value < 1 << 63:
+        return struct.pack('>BQ', 0x13, value)
+      if value < 1 << 64:
+        return b'\x14' + value.to_bytes(16, 'big', signed=True)
+      raise OverflowError(value)
+    if isinstance(value, float):
+      return struct.pack('>Bd', 0x23, value)
+    if isinstance(value, datetime.datetime):
+      if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+      return struct.pack(
+          '>Bd', 0x33, (value - EPOCH).total_seconds())
+    if isinstance(value, (bytes, bytearray)):
+      return cls._encode_size(0x40, len(value)) + bytes(value)
+    if isinstance(value, str):
+      try:
+        encoded = value.encode('ascii')
+        return cls._encode_size(0x50, len(encoded)) + encoded
+      except UnicodeEncodeError:
+        encoded = value.encode('utf-16be')
+        return cls._encode_size(0x60, len(encoded) // 2) + encoded
+    raise TypeError('unsupported type: %s' % type(value))
+
+  def _flatten(self, value):
+    """Adds value (and its children) to the object table.
+
+    Args:
+      value: The value to add.
+    Returns:
+      The reference number of the value.
+    """
+    if isinstance(value, dict):
+      ref = len(self._objects)
+      self._objects.append(None)
+      items = sorted(value.items())
+      for k, _ in items:
+        if not isinstance(k, str):
+          raise TypeError('keys must be strings')
+      refs = [self._flatten(k) for k, _ in items]
+      refs.extend(self._flatten(v) for _, v in items)
+      self._objects[ref] = (0xD0, len(items), refs)
+      return ref
+
+    if isinstance(value, (list, tuple)):
+      ref = len(self._objects)
+      self._objects.append(None)
+      refs = [self._flatten(v) for v in value]
+      self._objects[ref] = (0xA0, len(refs), refs)
+      return ref
+
+    key = self._scalar_key(value)
+    ref = self._scalar_refs.get(key)
+    if ref is None:
+      ref = len(self._objects)
+      self._objects.append(self._encode_scalar(value))
+      self._scalar_refs[key] = ref
+    return ref
+
+  def serialize(self, value):
+    """Returns the binary plist bytes for the given value."""
+    top_object = self._flatten(value)
+
+    num_objects = len(self._objects)
+    ref_size = _binary_plist_int_size(num_objects)
+    ref_format = UINT_FORMATS[ref_size]
+
+    chunks = [b'bplist00']
+    offsets = []
+    offset = len(chunks[0])
+    for obj in self._objects:
+      if isinstance(obj, tuple):
+        token, count, refs = obj
+        obj = self._encode_size(token, count) + struct.pack(
+            '>%d%s' % (len(refs), ref_format), *refs)
+      offsets.append(offset)
+      offset += len(obj)
+      chunks.append(obj)
+
+    offset_table_offset = offset
+    offset_size = _binary_plist_int_size(offset_table_offset)
+    chunks.append(struct.pack(
+        '>%d%s' % (num_objects, UINT_FORMATS[offset_size]),
+        *offsets))
+    chunks.append(struct.pack(
+        '>5xBBBQQQ', 0, offset_size, ref_size, num_objects, top_object,
+        offset_table_offset))
+    return b''.join(chunks)
+
+
+def serialize(plist):
+  """Returns the deterministic binary (bplist00) encoding of the plist."""
+  return _BinaryPlistWriter().serialize(plist)
@@ -0,0 +1,164 @@
+# Copyright 2023 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""An on-disk cache of decoded plists, shared across invocations.
+
+plisttool only imports this module when PLISTTOOL_CACHE_DIR is set.
+"""
+
+import datetime
+import hashlib
+import os
+import pickle
+import tempfile
+
+# The size limit of a cache when PLISTTOOL_CACHE_MAX_MB isn't set.
+_DEFAULT_MAX_MB = 256
+
+# Mixed into the DiskPlistCache keys; change it whenever decoding changes so
+# stale entries are no longer used.
+_KEY_PREFIX = b'plisttool-disk-cache-1\0'
+
+# Prefix of the temporary files entries are written to before being renamed.
+_TEMP_PREFIX = '.tmp-'
+
+# How many times, on average, the directory is scanned for entries to evict
+# while entries adding up to the size limit are written. Each write scans it
+# with a probability proportional to the size of its entry, so the cache
+# overshoots its limit by about 1/_EVICT_SCANS_PER_LIMIT of it between scans.
+_EVICT_SCANS_PER_LIMIT = 16
+
+
+class _PlistUnpickler(pickle.Unpickler):
+  """An Unpickler that only creates plist values.
+
+  Decoded plists only need the builtin containers and datetime, so nothing
+  else is allowed, to keep a tampered cache entry from running code.
+  """
+
+  def find_class(self, module, name):
+    if (module, name) == ('datetime', 'datetime'):
+      return datetime.datetime
+    raise pickle.UnpicklingError(
+        '%s.%s is not a plist type' % (module, name))
+
+
+class DiskPlistCache(object):
+  """An on-disk cache of decoded plists, keyed by a digest of their contents.
+
+  Entries are pickles written to a temporary file and renamed into place, so
+  concurrent readers and writers (parallel actions) only ever see complete
+  entries; two processes decoding the same contents at once just both write
+  the same entry. Hits update the entry's modification time. Now and then
+  after a write (see _EVICT_SCANS_PER_LIMIT), the least recently used entries
+  are removed until the cache fits in its size limit; scanning the directory
+  on every write would cost more than most decodes it saves. Any problem with
+  the cache directory or an entry makes the cache act as if the entry was
+  missing; it never causes a failure.
+  """
+
+  def __init__(self, directory, max_bytes=_DEFAULT_MAX_MB << 20):
+    """Initializes the cache.
+
+    Args:
+      directory: The directory holding the entries; created when needed.
+      max_bytes: The total size of the entries to stay under.
+    """
+    self._directory = directory
+    self._max_bytes = max_bytes
+
+  def get(self, contents, load):
+    """Returns the decoded plist for contents, calling load() on a miss.
+
+    Args:
+      contents: The bytes of the plist file.
+      load: Function decoding contents, when they aren't in the cache yet.
+          Errors it raises are passed on (and nothing is cached).
+    Returns:
+      The decoded plist.
+    """
+    digest = hashlib.sha256(_KEY_PREFIX + contents).hexdigest()
+    path = os.path.join(self._directory, digest)
+    try:
+      with open(path, 'rb') as entry:
+        value = _PlistUnpickler(entry).load()
+    except FileNotFoundError:
+      pass
+    except Exception:  # pylint: disable=broad-except
+      # Corrupted (or unreadable), so try to replace it.
+      pass
+    else:
+      try:
+        os.utime(path)
+      except OSError:
+        pass
+      return value
+
+    value = load()
+    self._store(path, value)
+    return value
+
+  def _store(self, path, value):
+    """Atomically writes an entry, then sometimes evicts old entries."""
+    try:
+      os.makedirs(self._directory, exist_ok=True)
+      fd, temp_path = tempfile.mkstemp(
+          dir=self._directory, prefix=_TEMP_PREFIX)
+      try:
+        with os.fdopen(fd, 'wb') as entry:
+          pickle.dump(value, entry, protocol=pickle.HIGHEST_PROTOCOL)
+          size = entry.tell()
+        os.replace(temp_path, path)
+      except BaseException:
+        try:
+          os.unlink(temp_path)
+        except OSError:
+          pass
+        raise
+      if self._should_evict(size):
+        self._evict()
+    except OSError:
+      pass
+
+  def _should_evict(self, size):
+    """Decides whether writing an entry of size bytes scans for evictions."""
+    chance = size * _EVICT_SCANS_PER_LIMIT / self._max_bytes
+    return int.from_bytes(os.urandom(4), 'little') < chance * (1 << 32)
+
+  def _evict(self):
+    """Removes the least recently used entries until under the size limit."""
+    entries = []
+    total = 0
+    with os.scandir(self._directory) as it:
+      for dir_entry in it:
+        try:
+          stat = dir_entry.stat(follow_symlinks=False)
+        except OSError:
+          continue  # Removed by another process.
+        entries.append((stat.st_mtime, dir_entry.path, stat.st_size))
+        total += stat.st_size
+    if total <= self._max_bytes:
+      return
+    # Another process's in-flight temporary file is among the newest, so it
+    # is only removed if the limit is tiny; its rename then simply fails.
+    entries.sort()
+    for _, path, size in entries:
+      try:
+        os.unlink(path)
+      except OSError:
+        pass
+      total -= size
+      if total <= self._max_bytes:
+        break
@@ -0,0 +1,244 @@
+# Copyright 2023 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process parser for OpenStep ("old-style ASCII") plists and .strings.
+
+plisttool only imports this module when a file is neither an XML nor a binary
+plist.
+"""
+
+import re
+
+# Characters allowed in an unquoted OpenStep string, matching CoreFoundation's
+# isValidUnquotedStringCharacter().
+_UNQUOTED_RE = re.compile(r'[A-Za-z0-9_$/:.-]+')
+# Whitespace and comments between OpenStep tokens. Only the ASCII whitespace
+# (plus the Unicode line/paragraph separators) that CoreFoundation skips is
+# matched; anything more exotic is left for plutil to deal with.
+_SKIP_RE = re.compile(
+    r'(?:[ \t\n\v\f\r\u2028\u2029]+|//[^\n\r]*|/\*.*?\*/)*', re.S)
+_QUOTED_RUN_RE = {
+    '"': re.compile(r'[^"\\]*'),
+    "'": re.compile(r"[^'\\]*"),
+}
+_HEX_RE = re.compile(r'[0-9A-Fa-f]{1,4}')
+_OCTAL_RE = re.compile(r'[0-7]{1,3}')
+_DATA_RE = re.compile(r'([0-9A-Fa-f \t\n\v\f\r]*)>')
+_SIMPLE_ESCAPES = {
+    'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+    'v': '\v',
+}
+
+
+class ParseError(ValueError):
+  """Raised when content can't be handled by PlistParser.
+
+  This is never surfaced to users; it just means the content is handed over to
+  plutil, which produces the real error (or handles a format this parser does
+  not know about).
+  """
+
+
+class PlistParser(object):
+  """In-process parser for OpenStep ("old-style ASCII") plists and .strings.
+
+  The grammar follows CoreFoundation's CFOldStylePList.c: dictionaries are
+  `{ key = value; ... }`, arrays are `( value, ... )`, data is `<hex>` and
+  everything else is a quoted or unquoted string. A top-level string followed
+  by more content means the file is a strings file, i.e. the body of a
+  dictionary without the braces. `"key";` is shorthand for `"key" = "key";`.
+  """
+
+  def __init__(self, text):
+    self._text = text
+    self._pos = 0
+
+  @classmethod
+  def parse_bytes(cls, byte_content):
+    """Decodes and parses the given bytes.
+
+    Args:
+      byte_content: The raw content of the file.
+    Returns:
+      The root object of the plist.
+    Raises:
+      ParseError: If the content isn't something this parser handles.
+    """
+    if byte_content.startswith((b'\xff\xfe', b'\xfe\xff')):
+      encoding = 'utf-16'
+    elif b'\x00' in byte_content:
+      # Most likely UTF-16 without a BOM; let plutil sniff it.
+      raise ParseError('Unknown text encoding.')
+    else:
+      encoding = 'utf-8-sig'
+    try:
+      text = byte_content.decode(encoding)
+    except UnicodeDecodeError as e:
+      raise ParseError(str(e))
+    return cls(text).parse()
+
+  def parse(self):
+    """Parses the whole text and returns the root object."""
+    self._skip()
+    if self._pos == len(self._text):
+      # Whitespace/comments only, an empty strings file.
+      return {}
+    result = self._parse_object()
+    self._skip()
+    if self._pos != len(self._text):
+      if not isinstance(result, str):
+        raise self._error('Junk after plist')
+      # A strings file; parse again as dictionary content.
+      self._pos = 0
+      result = self._parse_dict_content()
+      self._skip()
+      if self._pos != len(self._text):
+        raise self._error('Junk after strings file')
+    return result
+
+  def _error(self, msg):
+    return ParseError('%s at offset %d.' % (msg, self._pos))
+
+  def _skip(self):
+    self._pos = _SKIP_RE.match(self._text, self._pos).end()
+
+  def _peek(self):
+    return self._text[self._pos:self._pos + 1]
+
+  def _parse_object(self, require_object=True):
+    self._skip()
+    ch = self._peek()
+    if ch == '{':
+      self._pos += 1
+      result = self._parse_dict_content()
+      self._expect('}')
+      return result
+    if ch == '(':
+      self._pos += 1
+      return self._parse_array()
+    if ch == '<':
+      self._pos += 1
+      return self._parse_data()
+    value = self._parse_string()
+    if value is None and require_object:
+      raise self._error('Expected an object')
+    return value
+
+  def _expect(self, ch):
+    self._skip()
+    if self._peek() != ch:
+      raise self._error('Expected "%s"' % ch)
+    self._pos += 1
+
+  def _parse_dict_content(self):
+    result = {}
+    key = self._parse_string()
+    while key is not None:
+      self._skip()
+      ch = self._peek()
+      if ch == ';':
+        value = key
+      elif ch == '=':
+        self._pos += 1
+        value = self._parse_object()
+      else:
+        raise self._error('Expected "=" or ";" after key')
+      result[key] = value
+      self._expect(';')
+      key = self._parse_string()
+    return result
+
+  def _parse_array(self):
+    result = []
+    value = self._parse_object(require_object=False)
+    while value is not None:
+      result.append(value)
+      self._skip()
+      if self._peek() != ',':
+        break
+      self._pos += 1
+      value = self._parse_object(require_object=False)
+    self._expect(')')
+    return result
+
+  def _parse_data(self):
+    m = _DATA_RE.match(self._text, self._pos)
+    if not m:
+      raise self._error('Malformed data')
+    hex_digits = ''.join(m.group(1).split())
+    if len(hex_digits) % 2:
+      raise self._error('Odd number of hex digits in data')
+    self._pos = m.end()
+    return bytes.fromhex(hex_digits)
+
+  def _parse_string(self):
+    """Parses a quoted or unquoted string, or returns None if there isn't one."""
+    self._skip()
+    ch = self._peek()
+    if ch in ('"', "'"):
+      self._pos += 1
+      return self._parse_quoted_string(ch)
+    m = _UNQUOTED_RE.match(self._text, self._pos)
+    if m:
+      self._pos = m.end()
+      return m.group(0)
+    return None
+
+  def _parse_quoted_string(self, quote):
+    text = self._text
+    run_re = _QUOTED_RUN_RE[quote]
+    pieces = []
+    has_surrogates = False
+    while True:
+      m = run_re.match(text, self._pos)
+      pieces.append(m.group(0))
+      self._pos = m.end()
+      if self._pos >= len(text):
+        raise self._error('Unterminated quoted string')
+      if text[self._pos] == quote:
+        self._pos += 1
+        break
+      # Backslash escape.
+      self._pos += 1
+      if self._pos >= len(text):
+        raise self._error('Unterminated quoted string')
+      ch = text[self._pos]
+      self._pos += 1
+      if ch in 'Uu':
+        m = _HEX_RE.match(text, self._pos)
+        code = 0
+        if m:
+          code = int(m.group(0), 16)
+          self._pos = m.end()
+        has_surrogates = has_surrogates or 0xD800 <= code <= 0xDFFF
+        pieces.append(chr(code))
+      elif '0' <= ch <= '7':
+        m = _OCTAL_RE.match(text, self._pos - 1)
+        code = int(m.group(0), 8)
+        if code >= 0o200:
+          # These are NeXTSTEP encoded characters, leave those to plutil.
+          raise self._error('Unsupported octal escape')
+        self._pos = m.end()
+        pieces.append(chr(code))
+      else:
+        pieces.append(_SIMPLE_ESCAPES.get(ch, ch))
+    result = ''.join(pieces)
+    if has_surrogates:
+      # \U escapes are UTF-16 code units, so pairs need to be combined.
+      try:
+        result = result.encode('utf-16-le', 'surrogatepass').decode(
+            'utf-16-le')
+      except UnicodeDecodeError as e:
+        raise ParseError(str(e))
+    return result
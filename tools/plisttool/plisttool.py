@@ -39,6 +39,10 @@ the following keys:
   binary: If true, the output plist file will be written in binary format;
       otherwise, it will be written in XML format. This property is ignored if
       |output| is not a path.
+  canonical: If true, the output is written in a canonical form: dates are
+      in whole seconds (and UTC), line endings, -0.0 and NaNs are normalized,
+      and keys are sorted, so the output only depends on the data, not on the
+      Python version or host writing it.
   entitlements_options: A dictionary containing options specific to
       entitlements plist files. Omit this key if you are merging or converting
       other plists (such as Info.plists or other files). See below for more
@@ -111,44 +115,74 @@ satisfied, an error will be raised:
     errors are used where the build result is known not to work (iOS
     devices).
 
+Instead of a single control structure, the file may contain a batch manifest,
+to process many independent controls in one invocation. Files read by several
+of the controls (provisioning profile metadata, version files, child plists,
+shared input plists) are only parsed once. The manifest is a dictionary with
+the following keys:
+
+  controls: A list of control structures (as described above, each with its
+      own output) or paths to control files.
+  jobs: The number of controls to process concurrently. Defaults to 1.
+  pool: "threads" (the default) or "processes", the kind of pool to use when
+      jobs is greater than 1. With processes, parsed files are only shared
+      between the controls handled by the same process.
+
+If any control fails, the errors of all failing controls are reported and the
+tool exits with a non-zero status.
+
+The path to the control file may also be given via a "@flagfile". When run
+with --persistent_worker, the tool instead serves requests using Bazel's JSON
+persistent worker protocol (multiplexed requests are supported); the arguments
+of each request are the path to a control file.
+
+Decoded plist files can also be cached on disk, across invocations and
+parallel actions, by setting the PLISTTOOL_CACHE_DIR environment variable to a
+directory (e.g. with --action_env, and --sandbox_writable_path when
+sandboxed). Entries are keyed by a digest of the file contents, and the least
+recently used ones are removed once the cache exceeds PLISTTOOL_CACHE_MAX_MB
+megabytes (default 256). That is only checked now and then, so the cache can
+go over the limit by a few percent.
+
+To find out where a slow action spends its time, set PLISTTOOL_STATS_FILE to
+the path of a file (like PLISTTOOL_CACHE_DIR, with --action_env and
+--sandbox_writable_path) and every run appends its stats to it: the wall and
+CPU time of its phases (setup, read, plutil, merge, update, validate, write),
+the bytes read and written and the number of plutil subprocesses. The file is
+locked while appending, so all the actions of a build can share it. By default
+each run is one line of JSON; with PLISTTOOL_STATS_FORMAT=chrome, the file is
+instead a trace that chrome://tracing or Perfetto can open.
+
 """
 
 # NOTE: Ideally the final plist will always be byte for byte the same, not
 # just contain the same data. Xcode, which is built on Foundation's
 # non-order-preserving NSDictionary, is harmful to caching because it merges
-# keys in arbitrary order. Python dictionaries make no guarantee about an
-# iteration order, but appear to have repeatable behavior for the same inputs,
-# for the same version of python.
-#
-# tl;dr; - Rely on Python's dictionary iteration behavior until it becomes
-# a problem.
-#
-# What was considered...
+# keys in arbitrary order.
 #
 # Inputs come in via plist files and json files. Since the inputs can come
 # from anything a developer what (i.e. - they could have a genrule and
 # failed to have worried about stable outs), the best approach is to ensure
-# stabilization during output. One could use python dictionaries until the
-# the very end; then iterator over its keys in sorted order, recursively
-# copying into an OrderedDict. It has to be recursive to ensure sub
-# dictionaries are also stable.
-#
-# But, plistlib.writePlist doesn't make any promises about how it works, so
-# passing it an OrderedDict might or might not work, and could be subject to
-# versions of the module.  But this output approach is likely the best to
-# getting stable outputs.
+# stabilization during output:
 #
-# However... when a binary file is the desired result, plutil is invoked to
-# convert the file to binary, and that again makes no promises. So even if
-# feed a stable input, the output might not be deterministic when run on
-# different machines and/or different macOS versions.
-
-import copy
+# - XML output is written by _XmlPlistWriter, which sorts dictionary keys
+#   (recursively) and otherwise formats it exactly as plistlib does.
+# - Binary output is written by binary_writer, which also sorts keys and
+#   builds its object table purely from the values, so it no longer depends on
+#   plutil (and the macOS version it came with) to be deterministic.
+# - With "canonical" in the control, values are normalized first (see
+#   canonical_plist_value), so the bytes only depend on the data; the golden
+#   files in testdata/canonical pin them.
+
+import binascii
+import collections
 import datetime
+import io
 import json
+import math
+import os
 import plistlib
 import re
-import subprocess
 import sys
 
 
@@ -165,6 +199,11 @@ CHILD_BUNDLE_VERSION_MISMATCH_MSG = (
     'the same as its parent\'s version string "%s", but found "%s".'
 )
 
+CHILD_BUNDLE_INVALID_VERSION_MSG = (
+    'While processing target "%s"; the %s of the child target "%s" is not a '
+    'valid version string: "%s".'
+)
+
 REQUIRED_CHILD_MISSING_MSG = (
     'While processing target "%s"; "child_plist_required_values" wanted to '
     'check "%s", but it wasn\'t in the the "child_plists".'
@@ -209,6 +248,23 @@ UNKNOWN_CONTROL_KEYS_MSG = (
     'Target "%s" used a control structure has unknown key(s): %s'
 )
 
+UNKNOWN_BATCH_MANIFEST_KEYS_MSG = (
+    'The batch manifest has unknown key(s): %s'
+)
+
+INVALID_BATCH_POOL_MSG = (
+    'The batch manifest has an unknown "pool": "%s"; expected "threads" or '
+    '"processes".'
+)
+
+UNKNOWN_STATS_FORMAT_MSG = (
+    'Unknown stats format "%s" in %s; expected one of: %s'
+)
+
+INVALID_CACHE_MAX_MB_MSG = (
+    'Invalid value "%s" for %s; expected a positive number of megabytes'
+)
+
 UNKNOWN_TASK_OPTIONS_KEYS_MSG = (
     'Target "%s" used %s that included unknown key(s): %s'
 )
@@ -292,18 +348,6 @@ ENTITLEMENTS_VALUE_NOT_IN_LIST = (
     'is not in the provisioning profiles potential values ("%s").'
 )
 
-_ENTITLEMENTS_TO_VALIDATE_WITH_PROFILE = (
-    'aps-environment',
-    'com.apple.developer.networking.wifi-info',
-    'com.apple.developer.passkit.pass-presentation-suppression',
-    'com.apple.developer.payment-pass-provisioning',
-    'com.apple.developer.siri',
-    'com.apple.developer.usernotifications.time-sensitive',
-    # Keys which have a list of potential values in the profile, but only one in
-    # the entitlements that must be in the profile's list of values
-    'com.apple.developer.devicecheck.appattest-environment',
-)
-
 ENTITLEMENTS_BETA_REPORTS_ACTIVE_MISMATCH = (
     'In target "%s"; the entitlements "beta-reports-active" ("%s") did not '
     'match the value in the provisioning profile ("%s").'
@@ -324,13 +368,40 @@ ENTITLEMENTS_VALUE_HAS_WILDCARD = (
     'expected.'
 )
 
+_ENTITLEMENTS_TO_VALIDATE_WITH_PROFILE = (
+    'aps-environment',
+    'com.apple.developer.networking.wifi-info',
+    'com.apple.developer.passkit.pass-presentation-suppression',
+    'com.apple.developer.payment-pass-provisioning',
+    'com.apple.developer.siri',
+    'com.apple.developer.usernotifications.time-sensitive',
+    # Keys which have a list of potential values in the profile, but only one in
+    # the entitlements that must be in the profile's list of values
+    'com.apple.developer.devicecheck.appattest-environment',
+)
+
 # All valid keys in the a control structure.
 _CONTROL_KEYS = frozenset([
-    'binary', 'forced_plists', 'entitlements_options', 'info_plist_options',
-    'output', 'plists', 'raw_substitutions', 'target',
-    'variable_substitutions',
+    'binary', 'canonical', 'forced_plists', 'entitlements_options',
+    'info_plist_options', 'output', 'plists',
+    'raw_substitutions', 'target', 'variable_substitutions',
 ])
 
+# All valid keys in a batch manifest.
+_BATCH_MANIFEST_KEYS = frozenset([
+    'controls', 'jobs', 'pool',
+])
+
+# The keys of child plists that are always checked against the parent.
+_CHILD_PLIST_KEYS = frozenset([
+    'CFBundleIdentifier',
+    'CFBundleShortVersionString',
+    'CFBundleVersion',
+])
+
+# The most plists (inputs of PlistTool, or child plists) loaded at once.
+_MAX_PLIST_LOADERS = 8
+
 # All valid keys in the info_plist_options control structure.
 _INFO_PLIST_OPTIONS_KEYS = frozenset([
     'child_plists', 'child_plist_required_values', 'pkginfo', 'version_file',
@@ -413,6 +484,7 @@ CF_BUNDLE_SHORT_VERSION_RE = re.compile(
 )
 
 
+
 def plist_from_bytes(byte_content):
   try:
     return plistlib.loads(byte_content)
@@ -420,6 +492,40 @@ def plist_from_bytes(byte_content):
     return plistlib.readPlistFromString(byte_content)
 
 
+def _normalize_binary_plist_value(value, seen=None):
+  """Makes a plistlib-decoded binary plist match plutil's XML conversion.
+
+  plutil's XML output only has second granularity for dates and spells
+  NSKeyedArchiver UIDs as `{"CF$UID": n}` dictionaries, so the same is done
+  here to keep the results identical to the old plutil round trip. Containers
+  are updated in place (plistlib always hands back fresh ones).
+
+  Args:
+    value: The decoded value.
+    seen: Set of container ids already visited; binary plists can reference
+        the same object more than once.
+  Returns:
+    The normalized value.
+  """
+  if isinstance(value, datetime.datetime):
+    return value.replace(microsecond=0)
+  if isinstance(value, plistlib.UID):
+    return {'CF$UID': value.data}
+  if isinstance(value, (dict, list)):
+    if seen is None:
+      seen = set()
+    if id(value) in seen:
+      return value
+    seen.add(id(value))
+    if isinstance(value, dict):
+      for k, v in value.items():
+        value[k] = _normalize_binary_plist_value(v, seen)
+    else:
+      for i, v in enumerate(value):
+        value[i] = _normalize_binary_plist_value(v, seen)
+  return value
+
+
 def extract_variable_from_match(re_match_obj):
   """Takes a match from VARIABLE_REFERENCE_RE and extracts the variable.
 
@@ -439,31 +545,104 @@ def extract_variable_from_match(re_match_obj):
   return None
 
 
-def is_valid_version_string(s):
-  """Checks if the given string is a valid CFBundleVersion.
+class VersionString(collections.namedtuple(
+    'VersionString', ['string', 'valid', 'segments', 'suffix', 'track_num'])):
+  """The result of checking a CFBundleVersion or CFBundleShortVersionString.
 
-  Args:
-    s: The string to check.
-  Returns:
-    True/False based on if the string meets Apple's rules.
+  Attributes:
+    string: The value that was checked.
+    valid: True/False based on if the value meets Apple's rules.
+    segments: For valid values, the numbers of the dotted segments as a tuple
+        of ints (so leading zeros are dropped), otherwise None.
+    suffix: For a valid CFBundleVersion of a development build, the letters
+        of its suffix (e.g. "b" for "1.2b3"), otherwise None.
+    track_num: The number following the suffix as an int, otherwise None.
   """
-  if len(s) > BUNDLE_VERSION_VALUE_MAX_LENGTH:
-    return False
+  __slots__ = ()
+
+
+# The results of check_version_strings(), for CFBundleVersion (False) and
+# CFBundleShortVersionString (True) values.
+_version_string_checks = {False: {}, True: {}}
+
+# The most results kept for each key; a long running worker sees many versions
+# over time, but only the recent ones are likely to come up again.
+_VERSION_STRING_CHECKS_MAX = 4096
+
+
+def _check_version_string(s, short):
+  """Checks a single version string, see check_version_strings()."""
+  invalid = VersionString(s, False, None, None, None)
+  if not isinstance(s, str) or len(s) > BUNDLE_VERSION_VALUE_MAX_LENGTH:
+    return invalid
+  if short:
+    m = CF_BUNDLE_SHORT_VERSION_RE.match(s)
+    if not m:
+      return invalid
+    return VersionString(
+        s, True, tuple(int(x) for x in s.split('.')), None, None)
+
   m = CF_BUNDLE_VERSION_RE.match(s)
   if not m:
     # Didn't match, must be invalid.
-    return False
+    return invalid
   # The RE doesn't validate the "development, alpha, beta, and final candidate"
   # bits, so that is done manually.
+  numbers = s
+  suffix = None
   track_num = m.group('track_num')
   if track_num:
     # Can't start with a zero.
     if track_num.startswith('0'):
-      return False
+      return invalid
     # Must be <= 255.
     if int(track_num) > 255:
-      return False
-  return True
+      return invalid
+    numbers = s[:m.start(2)]
+    suffix = m.group(2)[:-len(track_num)]
+    track_num = int(track_num)
+  return VersionString(
+      s, True, tuple(int(x) for x in numbers.split('.')), suffix,
+      track_num or None)
+
+
+def check_version_strings(strings, short=False):
+  """Checks many CFBundleVersion or CFBundleShortVersionString values at once.
+
+  The results are cached by value, so the versions shared by all the bundles
+  of an app (or all the controls of a batch, or the requests of a worker) are
+  only parsed once.
+
+  Args:
+    strings: The values to check (anything that isn't a string is invalid).
+    short: True to check CFBundleShortVersionString values, False for
+        CFBundleVersion values.
+  Returns:
+    A list with a VersionString for each of the values, in order.
+  """
+  checks = _version_string_checks[short]
+  results = []
+  for s in strings:
+    result = checks.get(s) if isinstance(s, str) else None
+    if result is None:
+      result = _check_version_string(s, short)
+      if isinstance(s, str):
+        if len(checks) >= _VERSION_STRING_CHECKS_MAX:
+          checks.clear()
+        checks[s] = result
+    results.append(result)
+  return results
+
+
+def is_valid_version_string(s):
+  """Checks if the given string is a valid CFBundleVersion.
+
+  Args:
+    s: The string to check.
+  Returns:
+    True/False based on if the string meets Apple's rules.
+  """
+  return check_version_strings([s])[0].valid
 
 
 def is_valid_short_version_string(s):
@@ -474,10 +653,7 @@ def is_valid_short_version_string(s):
   Returns:
     True/False based on if the string meets Apple's rules.
   """
-  if len(s) > BUNDLE_VERSION_VALUE_MAX_LENGTH:
-    return False
-  m = CF_BUNDLE_SHORT_VERSION_RE.match(s)
-  return m is not None
+  return check_version_strings([s], short=True)[0].valid
 
 
 def get_with_key_path(a_dict, key_path):
@@ -518,18 +694,25 @@ def _convert_to_rfc1034(string):
   return _RFC1034_RE.sub('-', string)
 
 
-def _load_json(string_or_file):
+def _load_json(string_or_file, cache=None):
   """Helper to load json from a path for file like object.
 
   Args:
     string_or_file: If a string, load the JSON from the path. Otherwise assume
         it is a file like object and load from it.
+    cache: An optional PlistCache to share the result of loading a path with.
   Returns:
     The object graph loaded.
   """
   if isinstance(string_or_file, str):
-    with open(string_or_file) as f:
-      return json.load(f)
+    if cache is not None:
+      return cache.get(('json', string_or_file),
+                       lambda: _load_json(string_or_file))
+    # Read as bytes so json detects the encoding (UTF-8, -16 or -32) itself.
+    with open(string_or_file, 'rb') as f:
+      contents = f.read()
+    _count_io(bytes_read=len(contents))
+    return json.loads(contents)
   return json.load(string_or_file)
 
 
@@ -550,6 +733,126 @@ class PlistToolError(ValueError):
     ValueError.__init__(self, msg)
 
 
+class _SubstringMatcher(object):
+  """Aho-Corasick automaton reporting which of a set of strings occur in text.
+
+  Finds every needle occurring in a text with one pass over the text, instead
+  of testing each needle with `in`.
+  """
+
+  def __init__(self, needles):
+    """Builds the automaton.
+
+    Args:
+      needles: The strings to search for.
+    """
+    self._goto = [{}]
+    self._outputs = [set()]
+    for needle in needles:
+      state = 0
+      for ch in needle:
+        next_state = self._goto[state].get(ch)
+        if next_state is None:
+          next_state = len(self._goto)
+          self._goto.append({})
+          self._outputs.append(set())
+          self._goto[state][ch] = next_state
+        state = next_state
+      self._outputs[state].add(needle)
+
+    # Breadth first, so the failure state of a state is always done first.
+    self._fail = [0] * len(self._goto)
+    queue = list(self._goto[0].values())
+    for state in queue:
+      for ch, next_state in self._goto[state].items():
+        queue.append(next_state)
+        fail = self._fail[state]
+        while fail and ch not in self._goto[fail]:
+          fail = self._fail[fail]
+        fail = self._goto[fail].get(ch, 0)
+        self._fail[next_state] = fail if fail != next_state else 0
+        self._outputs[next_state] |= self._outputs[self._fail[next_state]]
+
+  def find_all(self, text):
+    """Returns the set of needles occurring in text."""
+    found = set(self._outputs[0])
+    goto = self._goto
+    fail = self._fail
+    state = 0
+    for ch in text:
+      while state and ch not in goto[state]:
+        state = fail[state]
+      state = goto[state].get(ch, 0)
+      if self._outputs[state]:
+        found |= self._outputs[state]
+    return found
+
+
+# Above this many (needle, text) pairs, _find_substrings() builds an automaton
+# rather than testing every pair with `in`.
+_SUBSTRING_PAIRS_FOR_AUTOMATON = 50000
+
+
+def _find_substrings(needles, texts):
+  """Returns, for each text, the set of needles occurring in it.
+
+  For a handful of needles testing each pair with `in` is cheapest, but that
+  is quadratic, so larger inputs go through a _SubstringMatcher instead.
+
+  Args:
+    needles: The strings to search for.
+    texts: The strings to search in.
+  Returns:
+    A list of sets, parallel to texts.
+  """
+  if len(needles) * len(texts) <= _SUBSTRING_PAIRS_FOR_AUTOMATON:
+    return [set(n for n in needles if n in text) for text in texts]
+  matcher = _SubstringMatcher(needles)
+  return [matcher.find_all(text) for text in texts]
+
+
+def _trie_pattern(keys):
+  """Returns a regex pattern matching any of the keys, factored as a trie.
+
+  Keys sharing a prefix share the regex for it, so the regex engine does one
+  walk down the trie at each position rather than trying every key in turn.
+
+  Args:
+    keys: The literal strings to match.
+  Returns:
+    The pattern string.
+  """
+  trie = {}
+  for key in keys:
+    node = trie
+    for ch in key:
+      node = node.setdefault(ch, {})
+    # '' never is a character, so it marks the end of a key.
+    node[''] = {}
+
+  def to_pattern(node):
+    alternatives = []
+    for ch in sorted(k for k in node if k):
+      child = node[ch]
+      literal = ch
+      # Collapse chains of single children into one literal.
+      while len(child) == 1 and '' not in child:
+        (next_ch, child), = child.items()
+        literal += next_ch
+      alternatives.append(re.escape(literal) + to_pattern(child))
+    if not alternatives:
+      return ''
+    if len(alternatives) == 1:
+      pattern = alternatives[0]
+    else:
+      pattern = '(?:%s)' % '|'.join(alternatives)
+    if '' in node:
+      pattern = '(?:%s)?' % pattern
+    return pattern
+
+  return to_pattern(trie)
+
+
 class SubstitutionEngine(object):
   """Helper that can apply substitutions while copying values."""
 
@@ -571,6 +874,7 @@ class SubstitutionEngine(object):
     """
     self._substitutions = {}
     self._substitutions_re = None
+    self._first_chars = ()
 
     subs = variable_substitutions or {}
     for key, value in subs.items():
@@ -587,27 +891,65 @@ class SubstitutionEngine(object):
         self._substitutions[fmt % (key + ':rfc1034identifier')] = value_rfc
 
     raw_subs = raw_substitutions or {}
+    if raw_subs:
+      self._check_raw_substitutions(target, raw_subs)
+
+    if self._substitutions:
+      # No key can be a prefix of another (variable references end with the
+      # closing delimiter, and raw keys can't overlap anything), so at most one
+      # key matches at any position and the shape of the pattern can't change
+      # which one is picked.
+      alternatives = []
+      if subs:
+        name = '(?:%s)(?::rfc1034identifier)?' % _trie_pattern(subs)
+        alternatives.append(r'\$(?:\{%s\}|\(%s\))' % (name, name))
+      if raw_subs:
+        alternatives.append(_trie_pattern(raw_subs))
+      self._substitutions_re = re.compile('|'.join(alternatives))
+      self._first_chars = tuple(sorted(
+          set(k[0] for k in self._substitutions if k)))
+
+  def _check_raw_substitutions(self, target, raw_subs):
+    """Validates and adds the raw substitutions.
+
+    Raw keys can't overlap (be a substring of, or contain) any other key, or
+    appear in any value. When there are several problems, the one reported is
+    the same as checking every raw key (in order) against the sorted existing
+    keys, and then every raw key (sorted) against the values (sorted by key).
+
+    Args:
+      target: Name of the target being built, used in messages/errors.
+      raw_subs: The dictionary of raw substitutions.
+    Raises:
+      PlistToolError: if there are any errors with the raw subtitutions.
+    """
+    all_keys = list(self._substitutions) + [
+        k for k in raw_subs if k not in self._substitutions]
+    raw_keys = list(raw_subs)
+    # raw key -> the keys it contains, and raw key -> the keys containing it.
+    contained = dict(zip(raw_keys, _find_substrings(all_keys, raw_keys)))
+    containing = {k: set() for k in raw_keys}
+    for key, found in zip(all_keys, _find_substrings(raw_keys, all_keys)):
+      for raw_key in found:
+        containing[raw_key].add(key)
+
+    existing = set(self._substitutions)
     for key, value in raw_subs.items():
-      # Raw keys can't overlap any other key (var or raw).
-      for existing_key in sorted(self._substitutions):
-        if (key in existing_key) or (existing_key in key):
-          ordered = sorted([key, existing_key])
-          raise PlistToolError(
-              OVERLAP_IN_SUBSTITUTION_KEYS % (target, ordered[0], ordered[1]))
+      overlapping = (contained[key] | containing[key]) & existing
+      if overlapping:
+        ordered = sorted([key, min(overlapping)])
+        raise PlistToolError(
+            OVERLAP_IN_SUBSTITUTION_KEYS % (target, ordered[0], ordered[1]))
       self._substitutions[key] = value
+      existing.add(key)
 
     # A raw key can't overlap any value.
-    raw_keys = sorted(raw_subs.keys())
-    for k, v in sorted(self._substitutions.items()):
-      for raw_key in raw_keys:
-        if raw_key in v:
-          raise PlistToolError(
-              RAW_SUBSTITUTION_KEY_IN_VALUE % (target, raw_key, v, k))
-
-    # Make _substitutions_re.
-    if self._substitutions:
-      escaped_keys = [re.escape(x) for x in self._substitutions.keys()]
-      self._substitutions_re = re.compile('(%s)' % '|'.join(escaped_keys))
+    items = sorted(self._substitutions.items())
+    for (k, v), found in zip(
+        items, _find_substrings(raw_keys, [v for _, v in items])):
+      if found:
+        raise PlistToolError(
+            RAW_SUBSTITUTION_KEY_IN_VALUE % (target, min(found), v, k))
 
   def apply_substitutions(self, value):
     """Applies variable substitutions to the given value.
@@ -617,6 +959,10 @@ class SubstitutionEngine(object):
     be recursively applied to its members. Otherwise (for booleans or
     numbers), the value will remain untouched.
 
+    Values (including containers) without anything to substitute are returned
+    as is rather than copied, so the result may share structure with the
+    input.
+
     Args:
       value: The value with possible variable references to substitute.
     Returns:
@@ -627,19 +973,38 @@ class SubstitutionEngine(object):
       return value
     return self._internal_apply_subs(value)
 
+  def _sub_helper(self, match_obj):
+    return self._substitutions[match_obj.group(0)]
+
   def _internal_apply_subs(self, value):
     """Recursive substitutions for string, dictionaries and lists."""
     if isinstance(value, str):
-
-      def sub_helper(match_obj):
-        return self._substitutions[match_obj.group(0)]
-      return self._substitutions_re.sub(sub_helper, value)
+      # Every key starts with one of a handful of characters ('$' for
+      # variables), so most strings can be skipped without running the regex.
+      for ch in self._first_chars:
+        if ch in value:
+          return self._substitutions_re.sub(self._sub_helper, value)
+      return value
 
     if isinstance(value, dict):
-      return {k: self._internal_apply_subs(v) for k, v in value.items()}
+      result = None
+      for k, v in value.items():
+        new_v = self._internal_apply_subs(v)
+        if new_v is not v and result is None:
+          result = dict(value)
+        if result is not None:
+          result[k] = new_v
+      return value if result is None else result
 
     if isinstance(value, list):
-      return [self._internal_apply_subs(v) for v in value]
+      result = None
+      for i, v in enumerate(value):
+        new_v = self._internal_apply_subs(v)
+        if new_v is not v:
+          if result is None:
+            result = list(value)
+          result[i] = new_v
+      return value if result is None else result
 
     return value
 
@@ -704,6 +1069,294 @@ class SubstitutionEngine(object):
     _helper(key_name, value)
 
 
+def plist_to_binary_bytes(plist):
+  """Returns the deterministic binary (bplist00) encoding of the plist."""
+  # pylint: disable=g-import-not-at-top
+  from build_bazel_rules_apple.tools.plisttool import binary_writer
+  return binary_writer.serialize(plist)
+
+
+_XML_PLIST_HEADER = (
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" '
+    b'"http://www.apple.com/DTDs/PropertyList-1.0.dtd">\n'
+)
+
+# Characters XML 1.0 can't represent, even escaped.
+_XML_CONTROL_CHARS_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Characters _xml_escape() has to do something about.
+_XML_SPECIAL_CHARS_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\r&<>]')
+
+
+def _xml_escape(text):
+  """Escapes text for an XML plist element, like plistlib does."""
+  if not _XML_SPECIAL_CHARS_RE.search(text):
+    return text
+  if _XML_CONTROL_CHARS_RE.search(text):
+    raise ValueError(
+        "strings can't contain control characters; use bytes instead")
+  text = text.replace('\r\n', '\n').replace('\r', '\n')
+  return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+# How much XML _XmlPlistWriter collects before writing it to its file.
+_XML_WRITE_BUFFER_SIZE = 1 << 16
+
+
+class _XmlPlistWriter(object):
+  """Writes plists as XML, in the same format as plistlib.
+
+  Keys are sorted, nesting is indented with tabs and data is base64 encoded in
+  lines narrowing with the indentation, all as plistlib writes it. Having the
+  format here rather than relying on plistlib keeps the output byte for byte
+  the same whichever Python version writes it.
+
+  The XML is written to the file as it is generated, in chunks of about
+  _XML_WRITE_BUFFER_SIZE bytes (data is encoded line by line too), so beyond
+  the plist itself memory use doesn't grow with the size of the output.
+  """
+
+  def __init__(self, fp):
+    """Initializes the writer.
+
+    Args:
+      fp: The binary file-like object to write to.
+    """
+    self._fp = fp
+    self._chunks = []
+    self._buffered = 0
+
+  def write(self, plist):
+    """Writes the XML encoding of the plist to the file."""
+    self._emit(_XML_PLIST_HEADER + b'<plist version="1.0">\n')
+    self._write_value(plist, 0)
+    self._emit(b'</plist>\n')
+    self._flush()
+
+  def _emit(self, chunk):
+    self._chunks.append(chunk)
+    self._buffered += len(chunk)
+    if self._buffered >= _XML_WRITE_BUFFER_SIZE:
+      self._flush()
+
+  def _flush(self):
+    if self._chunks:
+      self._fp.write(b''.join(self._chunks))
+      self._chunks = []
+      self._buffered = 0
+
+  def _write_element(self, element, text, level):
+    self._emit(b'%s<%s>%s</%s>\n' % (
+        b'\t' * level, element, _xml_escape(text).encode('utf-8'), element))
+
+  def _write_dict(self, value, level):
+    indent = b'\t' * level
+    child_indent = indent + b'\t'
+    emit = self._emit
+    emit(indent + b'<dict>\n')
+    # Sorting just the keys avoids a list of (key, value) pairs.
+    for key in sorted(value):
+      if not isinstance(key, str):
+        raise TypeError('keys must be strings')
+      child = value[key]
+      if isinstance(child, str):
+        # The most common case, so the key and the value go out together.
+        emit(b'%s<key>%s</key>\n%s<string>%s</string>\n' % (
+            child_indent, _xml_escape(key).encode('utf-8'),
+            child_indent, _xml_escape(child).encode('utf-8')))
+      else:
+        emit(b'%s<key>%s</key>\n' % (
+            child_indent, _xml_escape(key).encode('utf-8')))
+        self._write_value(child, level + 1)
+    emit(indent + b'</dict>\n')
+
+  def _write_value(self, value, level):
+    indent = b'\t' * level
+    if isinstance(value, str):
+      self._write_element(b'string', value, level)
+    elif value is True:
+      self._emit(indent + b'<true/>\n')
+    elif value is False:
+      self._emit(indent + b'<false/>\n')
+    elif isinstance(value, int):
+      if not -1 << 63 <= value < 1 << 64:
+        raise OverflowError(value)
+      self._write_element(b'integer', '%d' % value, level)
+    elif isinstance(value, float):
+      self._write_element(b'real', repr(value), level)
+    elif isinstance(value, dict):
+      if value:
+        self._write_dict(value, level)
+      else:
+        self._emit(indent + b'<dict/>\n')
+    elif isinstance(value, (bytes, bytearray)):
+      self._emit(indent + b'<data>\n')
+      line_length = max(16, 76 - 8 * level)
+      chunk_size = (line_length // 4) * 3
+      data = memoryview(value)
+      for i in range(0, len(value), chunk_size):
+        self._emit(indent + binascii.b2a_base64(data[i:i + chunk_size]))
+      self._emit(indent + b'</data>\n')
+    elif isinstance(value, datetime.datetime):
+      self._write_element(b'date', '%04d-%02d-%02dT%02d:%02d:%02dZ' % (
+          value.year, value.month, value.day,
+          value.hour, value.minute, value.second), level)
+    elif isinstance(value, (tuple, list)):
+      if not value:
+        self._emit(indent + b'<array/>\n')
+        return
+      self._emit(indent + b'<array>\n')
+      for child in value:
+        self._write_value(child, level + 1)
+      self._emit(indent + b'</array>\n')
+    else:
+      raise TypeError('unsupported type: %s' % type(value))
+
+
+def write_xml_plist(plist, fp):
+  """Writes the XML encoding of the plist to fp, formatted like plistlib's."""
+  _XmlPlistWriter(fp).write(plist)
+
+
+def plist_to_xml_bytes(plist):
+  """Returns the XML encoding of the plist, formatted like plistlib's."""
+  fp = io.BytesIO()
+  write_xml_plist(plist, fp)
+  return fp.getvalue()
+
+
+# The one NaN canonical plists use, whatever the sign or payload bits of the
+# NaN that was given.
+_CANONICAL_NAN = float('nan')
+
+
+def canonical_plist_value(value):
+  """Returns the canonical form of a plist value.
+
+  In the canonical form:
+
+  * Dates are naive UTC datetimes, in whole seconds (the precision of XML
+    plists).
+  * Line endings in strings are LF (XML plists turn CRLF and CR into LF too).
+  * -0.0 is 0.0, and all NaNs are the same NaN.
+  * Tuples are lists, bytearrays are bytes and UIDs are `{"CF$UID": n}`
+    dictionaries (as they read back from plutil's XML).
+
+  Keys are sorted by both writers anyway, so with this the bytes written only
+  depend on the data. Unchanged values are returned as is, so the result may
+  share structure with the input.
+
+  Args:
+    value: The plist value.
+  Returns:
+    The canonical form of the value.
+  """
+  if isinstance(value, str):
+    if '\r' in value:
+      return value.replace('\r\n', '\n').replace('\r', '\n')
+    return value
+  if isinstance(value, (bool, int)):
+    return value
+  if isinstance(value, float):
+    if value != value:
+      return _CANONICAL_NAN
+    if value == 0.0 and math.copysign(1.0, value) < 0:
+      return 0.0
+    return value
+  if isinstance(value, datetime.datetime):
+    if value.tzinfo is not None:
+      value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value.replace(microsecond=0) if value.microsecond else value
+  if isinstance(value, bytearray):
+    return bytes(value)
+  if isinstance(value, plistlib.UID):
+    return {'CF$UID': value.data}
+  if isinstance(value, dict):
+    result = None
+    for k, v in value.items():
+      new_v = canonical_plist_value(v)
+      if new_v is not v and result is None:
+        result = dict(value)
+      if result is not None:
+        result[k] = new_v
+    return value if result is None else result
+  if isinstance(value, (list, tuple)):
+    result = [canonical_plist_value(v) for v in value]
+    if isinstance(value, list) and all(
+        new_v is v for new_v, v in zip(result, value)):
+      return value
+    return result
+  return value
+
+
+# Environment variables configuring the DiskPlistCache used when reading files.
+_DISK_CACHE_DIR_ENV = 'PLISTTOOL_CACHE_DIR'
+_DISK_CACHE_MAX_MB_ENV = 'PLISTTOOL_CACHE_MAX_MB'
+
+
+def _disk_plist_cache():
+  """Returns the DiskPlistCache configured by the environment, or None.
+
+  Raises:
+    PlistToolError: If PLISTTOOL_CACHE_MAX_MB isn't a positive integer.
+  """
+  directory = os.environ.get(_DISK_CACHE_DIR_ENV)
+  if not directory:
+    return None
+  # pylint: disable=g-import-not-at-top
+  from build_bazel_rules_apple.tools.plisttool import disk_cache
+  max_mb = os.environ.get(_DISK_CACHE_MAX_MB_ENV)
+  if max_mb:
+    try:
+      max_bytes = int(max_mb) << 20
+    except ValueError:
+      max_bytes = 0
+    if max_bytes <= 0:
+      raise PlistToolError(
+          INVALID_CACHE_MAX_MB_MSG % (max_mb, _DISK_CACHE_MAX_MB_ENV))
+    return disk_cache.DiskPlistCache(directory, max_bytes=max_bytes)
+  return disk_cache.DiskPlistCache(directory)
+
+
+# Environment variables enabling and configuring RunStats.
+_STATS_FILE_ENV = 'PLISTTOOL_STATS_FILE'
+_STATS_FORMAT_ENV = 'PLISTTOOL_STATS_FORMAT'
+_STATS_FORMATS = ('json', 'chrome')
+
+# run_stats.current_run_stats once a run enabled stats; until then there are
+# no stats to record, and run_stats (with its imports) isn't loaded.
+_current_run_stats = None
+
+
+class _NoStatsPhase(object):
+  """The context manager _stats_phase returns when stats are disabled."""
+
+  def __enter__(self):
+    return None
+
+  def __exit__(self, *unused_exc_info):
+    return False
+
+
+_NO_STATS_PHASE = _NoStatsPhase()
+
+
+def _stats_phase(name):
+  """Returns a context manager timing a phase of the current run, if any."""
+  stats = _current_run_stats.get() if _current_run_stats else None
+  if stats is None:
+    return _NO_STATS_PHASE
+  return stats.phase(name)
+
+
+def _count_io(bytes_read=0, bytes_written=0, subprocesses=0):
+  """Adds to the I/O counters of the current run, if stats are enabled."""
+  stats = _current_run_stats.get() if _current_run_stats else None
+  if stats is not None:
+    stats.add(bytes_read, bytes_written, subprocesses)
+
+
 class PlistIO(object):
   """Helpers for read/writing plists.
 
@@ -712,7 +1365,7 @@ class PlistIO(object):
   """
 
   @classmethod
-  def get_dict(cls, p, target):
+  def get_dict(cls, p, target, cache=None):
     """Returns a plist dictionary based on the given object.
 
     This function handles the various input formats for plists in the control
@@ -723,6 +1376,7 @@ class PlistIO(object):
     Args:
       p: The object to interpret as a plist.
       target: The name of the target for which the plist is being built.
+      cache: An optional PlistCache to share the result of reading a path with.
     Returns:
       A dictionary containing the values from the plist.
     """
@@ -730,6 +1384,8 @@ class PlistIO(object):
       return p
 
     if isinstance(p, str):
+      if cache is not None:
+        return cache.get(('plist', p), lambda: cls.get_dict(p, target))
       with open(p, 'rb') as plist_file:
         return cls._read_plist(plist_file, p, target)
 
@@ -739,9 +1395,11 @@ class PlistIO(object):
   def _read_plist(cls, plist_file, name, target):
     """Reads a plist file and returns its contents as a dictionary.
 
-    This method wraps the readPlist method in plistlib by checking the format
-    of the plist before reading and using plutil to convert it into XML format
-    first, to support plain text and binary formats as well.
+    XML, binary (bplist00) and OpenStep/strings plists are decoded in-process.
+    Anything else (JSON, other binary versions, content the OpenStep parser
+    rejects) is converted to XML with plutil first, which also produces the
+    error for malformed files. When PLISTTOOL_CACHE_DIR is set, the decoding
+    goes through a DiskPlistCache.
 
     Args:
       plist_file: The file-like object containing the plist data.
@@ -753,62 +1411,234 @@ class PlistIO(object):
     Raises:
       PlistToolError: if plutil return code is non-zero.
     """
-    plist_contents = plist_file.read()
-
-    # Binary plists are easy to identify because they start with 'bplist'. For
-    # plain text plists, it may be possible to have leading whitespace, but
-    # well-formed XML should *not* have any whitespace before the XML
-    # declaration, so we can check that the plist is not XML and let plutil
-    # handle them the same way.
-    if not plist_contents.startswith(b'<?xml'):
+    with _stats_phase('read'):
+      plist_contents = plist_file.read()
+      _count_io(bytes_read=len(plist_contents))
+      return cls._decode_contents(plist_contents, name, target)
+
+  @classmethod
+  def _decode_contents(cls, plist_contents, name, target):
+    """Decodes the bytes of a plist file, through the DiskPlistCache if set."""
+    disk_cache = _disk_plist_cache()
+    if disk_cache is None:
+      return cls.decode_bytes(plist_contents, name, target)
+    return disk_cache.get(
+        plist_contents,
+        lambda: cls.decode_bytes(plist_contents, name, target))
+
+  @classmethod
+  def get_values(cls, p, keys, target, cache=None):
+    """Returns the values of some of the top-level keys of a plist.
+
+    Like get_dict, except that for XML and binary plists only as much of the
+    file as is needed to find the keys gets decoded.
+
+    Args:
+      p: The object to interpret as a plist, as for get_dict.
+      keys: The keys to look up.
+      target: The name of the target for which the plist is being built.
+      cache: An optional PlistCache to share the result of reading a path with.
+    Returns:
+      A dictionary with the values of the keys that are in the plist.
+    """
+    keys = frozenset(keys)
+    if isinstance(p, dict):
+      plist = p
+    else:
+      if isinstance(p, str):
+        if cache is not None:
+          return cache.get(('plist values', p, keys),
+                           lambda: cls.get_values(p, keys, target))
+        name = p
+        with open(p, 'rb') as plist_file:
+          plist_contents = plist_file.read()
+      else:
+        name = '<input>'
+        plist_contents = p.read()
+      # pylint: disable=g-import-not-at-top
+      from build_bazel_rules_apple.tools.plisttool import top_level_values
+      with _stats_phase('read'):
+        _count_io(bytes_read=len(plist_contents))
+        plist = top_level_values.find(plist_contents, keys)
+        if plist is None:
+          plist = cls._decode_contents(plist_contents, name, target)
+    return {k: plist[k] for k in keys if k in plist}
+
+  @classmethod
+  def decode_bytes(cls, plist_contents, name, target):
+    """Decodes the raw bytes of a plist in any supported format.
+
+    Args:
+      plist_contents: The bytes of the plist.
+      name: Name to report the content as if it fails xml conversion.
+      target: The name of the target for which the plist is being built.
+    Returns:
+      The decoded plist.
+
+    Raises:
+      PlistToolError: if plutil is needed and its return code is non-zero.
+    """
+    # Well-formed XML should *not* have any whitespace before the XML
+    # declaration, so anything else goes through the other decoders.
+    if plist_contents.startswith(b'<?xml'):
+      return plist_from_bytes(plist_contents)
+
+    if plist_contents.startswith(b'bplist00'):
+      try:
+        return _normalize_binary_plist_value(
+            plistlib.loads(plist_contents, fmt=plistlib.FMT_BINARY))
+      except plistlib.InvalidFileException:
+        pass
+    elif plist_contents:
+      # pylint: disable=g-import-not-at-top
+      from build_bazel_rules_apple.tools.plisttool import openstep
+      try:
+        return openstep.PlistParser.parse_bytes(plist_contents)
+      except openstep.ParseError:
+        pass
+
+    return plist_from_bytes(
+        cls._plutil_convert_to_xml(plist_contents, name, target))
+
+  @staticmethod
+  def _plutil_convert_to_xml(plist_contents, name, target):
+    """Runs plutil to convert plist content in any format to XML."""
+    import subprocess  # pylint: disable=g-import-not-at-top
+    _count_io(subprocesses=1)
+    with _stats_phase('plutil'):
       plutil_process = subprocess.Popen(
           ['plutil', '-convert', 'xml1', '-o', '-', '--', '-'],
           stdout=subprocess.PIPE,
           stdin=subprocess.PIPE
       )
       plist_contents, _ = plutil_process.communicate(plist_contents)
-      if plutil_process.returncode:
-        raise PlistToolError(PLUTIL_CONVERSION_TO_XML_FAILED_MSG % (
-            target, plutil_process.returncode, name))
-
-    return plist_from_bytes(plist_contents)
+    if plutil_process.returncode:
+      raise PlistToolError(PLUTIL_CONVERSION_TO_XML_FAILED_MSG % (
+          target, plutil_process.returncode, name))
+    return plist_contents
 
   @classmethod
-  def write(cls, plist, path_or_file, binary=False):
+  def write(cls, plist, path_or_file, binary=False, canonical=False):
     """Writes the given plist to the output file.
 
-    This method also converts it to binary format if "binary" is True in the
-    control struct.
+    This method writes binary format instead of XML if "binary" is True in
+    the control struct.
 
     Args:
       plist: The plist to write to the output path in the control struct.
       path_or_file: The name of file to write or or a file like object to
           write into.
-      binary: If True and path_or_file was a file name, reformat the file
+      binary: If True and path_or_file was a file name, write the file
           in binary form.
+      canonical: If True, write the canonical form of the plist (see
+          canonical_plist_value), so the bytes only depend on the data.
     """
+    if canonical:
+      plist = canonical_plist_value(plist)
     if isinstance(path_or_file, str):
       with open(path_or_file, 'wb') as fp:
-        plistlib.dump(plist, fp)
+        if binary:
+          fp.write(plist_to_binary_bytes(plist))
+        else:
+          write_xml_plist(plist, fp)
+        _count_io(bytes_written=fp.tell())
     else:
-      plistlib.dump(plist, path_or_file)
+      write_xml_plist(plist, path_or_file)
+
+
+def _read_only_plist_error(*unused_args, **unused_kwargs):
+  raise TypeError('The plist is read-only during validation.')
+
+
+class _ReadOnlyDict(dict):
+  """A dict that can't be modified, handing out read-only views of its values.
+
+  Values are wrapped when they are looked up, so wrapping a plist only costs a
+  copy of its top-level references, however large the rest of the tree is.
+  """
+
+  __slots__ = ()
+
+  __setitem__ = __delitem__ = __ior__ = _read_only_plist_error
+  clear = pop = popitem = setdefault = update = _read_only_plist_error
+
+  def __getitem__(self, key):
+    return _read_only_plist(dict.__getitem__(self, key))
+
+  def get(self, key, default=None):
+    if key in self:
+      return self[key]
+    return default
+
+  def values(self):
+    return [_read_only_plist(v) for v in dict.values(self)]
+
+  def items(self):
+    return [(k, _read_only_plist(v)) for k, v in dict.items(self)]
+
+  def copy(self):
+    return _ReadOnlyDict(self)
+
+
+class _ReadOnlyList(list):
+  """A list that can't be modified, handing out read-only views of its items."""
+
+  __slots__ = ()
+
+  __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only_plist_error
+  append = clear = extend = insert = pop = remove = _read_only_plist_error
+  reverse = sort = _read_only_plist_error
 
-    if binary and isinstance(path_or_file, str):
-      subprocess.check_call(['plutil', '-convert', 'binary1', path_or_file])
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return _ReadOnlyList(list.__getitem__(self, index))
+    return _read_only_plist(list.__getitem__(self, index))
+
+  def __iter__(self):
+    for v in list.__iter__(self):
+      yield _read_only_plist(v)
+
+  def __reversed__(self):
+    for v in list.__reversed__(self):
+      yield _read_only_plist(v)
+
+  def copy(self):
+    return _ReadOnlyList(self)
+
+
+def _read_only_plist(value):
+  """Returns a read-only view of a plist value.
+
+  The view compares equal to the value and still is a dict or list, but
+  raises TypeError for anything that would modify it (or the values inside
+  it). Other plist values are immutable, so they are returned as is.
+
+  Args:
+    value: The plist value.
+  Returns:
+    The read-only view of the value.
+  """
+  if isinstance(value, dict) and not isinstance(value, _ReadOnlyDict):
+    return _ReadOnlyDict(value)
+  if isinstance(value, list) and not isinstance(value, _ReadOnlyList):
+    return _ReadOnlyList(value)
+  return value
 
 
 class PlistToolTask(object):
   """Base for adding subtasks to the plist tool."""
 
-  def __init__(self, target, options):
+  def __init__(self, target, options, plist_cache=None):
     """Initialize the task.
 
     Args:
       target: The name of the target being processed.
       options: The dictionary from the control to configure this option.
+      plist_cache: An optional PlistCache to use when reading files.
     """
     self.target = target
     self.options = options
+    self.plist_cache = plist_cache
 
   @classmethod
   def control_structure_options_name(cls):
@@ -856,8 +1686,18 @@ class PlistToolTask(object):
 
     Args:
       plist: The dictionary representing final plist, no changes may be
-        made to the plist. If there are any issues a PlistToolError should
-        be raised with the problems.
+        made to the plist (it is a read-only view, so attempts raise
+        TypeError). If there are any issues a PlistToolError should be
+        raised with the problems.
+    """
+    pass  # Default to nothing for subclasses
+
+  def write_outputs(self, plist):
+    """Writes any other outputs of the task, after validation.
+
+    Args:
+      plist: The dictionary representing final plist (read-only, as for
+        validate_plist).
     """
     pass  # Default to nothing for subclasses
 
@@ -877,7 +1717,7 @@ class InfoPlistTask(PlistToolTask):
     # Pull in the version info propagated by AppleBundleVersionInfo.
     version_file = self.options.get('version_file')
     if version_file:
-      version_info = _load_json(version_file)
+      version_info = _load_json(version_file, cache=self.plist_cache)
       bundle_version = version_info.get('build_version')
       short_version_string = version_info.get('short_version_string')
 
@@ -891,35 +1731,41 @@ class InfoPlistTask(PlistToolTask):
       for k in ('CFBundleVersion', 'CFBundleShortVersionString'):
         # This also errors if they are there but the empty string or zero.
         if not plist.get(k, None):
-          raise PlistToolError(MISSING_VERSION_KEY_MSG % (self.target, k))
+          raise PlistToolError(
+              MISSING_VERSION_KEY_MSG % (self.target, k))
 
     # If the version keys are set, they must be valid (even if they were
     # not required).
     for k, validator in (
         ('CFBundleVersion', is_valid_version_string),
-        ('CFBundleShortVersionString', is_valid_short_version_string)):
+        ('CFBundleShortVersionString',
+         is_valid_short_version_string)):
       v = plist.get(k)
       if v and not validator(v):
-        raise PlistToolError(INVALID_VERSION_KEY_VALUE_MSG % (
-            self.target, k, v))
+        raise PlistToolError(
+            INVALID_VERSION_KEY_VALUE_MSG % (self.target, k, v))
 
     child_plists = self.options.get('child_plists')
     child_plist_required_values = self.options.get(
         'child_plist_required_values')
     if child_plists:
       self._validate_children(
-          plist, child_plists, child_plist_required_values, self.target)
+          plist, child_plists, child_plist_required_values, self.target,
+          plist_cache=self.plist_cache)
 
+  def write_outputs(self, plist):
     pkginfo_file = self.options.get('pkginfo')
     if pkginfo_file:
       if isinstance(pkginfo_file, str):
         with open(pkginfo_file, 'wb') as p:
           self._write_pkginfo(p, plist)
+          _count_io(bytes_written=p.tell())
       else:
         self._write_pkginfo(pkginfo_file, plist)
 
   @staticmethod
-  def _validate_children(plist, child_plists, child_required_values, target):
+  def _validate_children(plist, child_plists, child_required_values, target,
+                         plist_cache=None):
     """Validates a target's plist is consistent with its children.
 
     This function checks each of the given child plists (which are typically
@@ -933,6 +1779,7 @@ class InfoPlistTask(PlistToolTask):
       child_required_values: Mapping of any key/value pairs to validate in
           the children.
       target: The name of the target being processed.
+      plist_cache: An optional PlistCache to use when reading the children.
     Raises:
       PlistToolError: if there was an inconsistency between a child target's
           plist and the current target's plist, with a message describing what
@@ -945,13 +1792,55 @@ class InfoPlistTask(PlistToolTask):
     version = plist.get('CFBundleVersion')
     short_version = plist.get('CFBundleShortVersionString')
 
-    for label, p in child_plists.items():
-      child_plist = PlistIO.get_dict(p, target)
-
+    def load_child(label, p):
+      """Loads just the parts of a child's plist that are checked."""
+      keys = set(_CHILD_PLIST_KEYS)
+      for pair in child_required_values.get(label, []):
+        if not isinstance(pair, list) or len(pair) != 2:
+          continue  # Reported while validating.
+        try:
+          first_key = next(iter(pair[0]))
+        except StopIteration:
+          # An empty key path is the whole plist.
+          return PlistIO.get_dict(p, target, cache=plist_cache)
+        except TypeError:
+          continue  # Not a key path, so it never finds a value.
+        if isinstance(first_key, str):
+          keys.add(first_key)
+      return PlistIO.get_values(p, keys, target, cache=plist_cache)
+
+    # pylint: disable=g-import-not-at-top
+    from concurrent import futures
+    import contextvars
+
+    # Load the children concurrently, but check them in order, so the error
+    # reported is the same as when loading them one at a time. (Each load runs
+    # in a copy of the context, so it counts towards this run's stats.)
+    with futures.ThreadPoolExecutor(
+        max_workers=_MAX_PLIST_LOADERS) as executor:
+      loading = [
+          (label, executor.submit(
+              contextvars.copy_context().run, load_child, label, p))
+          for label, p in child_plists.items()]
+      children = [(label, future.result()) for label, future in loading]
+
+    # Check the versions of all the children at once, so each distinct value
+    # is only parsed once (and not again by later controls of a batch or
+    # requests of a worker).
+    version_checks = check_version_strings(
+        [child_plist.get('CFBundleVersion') for _, child_plist in children])
+    short_version_checks = check_version_strings(
+        [child_plist.get('CFBundleShortVersionString')
+         for _, child_plist in children],
+        short=True)
+
+    for (label, child_plist), version_check, short_version_check in zip(
+        children, version_checks, short_version_checks):
       child_id = child_plist['CFBundleIdentifier']
       if not child_id.startswith(prefix):
-        raise PlistToolError(CHILD_BUNDLE_ID_MISMATCH_MSG % (
-            target, label, prefix, child_id))
+        raise PlistToolError(
+            CHILD_BUNDLE_ID_MISMATCH_MSG % (
+                target, label, prefix, child_id))
 
       # - TN2420 calls out CFBundleVersion and CFBundleShortVersionString
       #   has having to match for watchOS targets.
@@ -962,40 +1851,43 @@ class InfoPlistTask(PlistToolTask):
       #   platforms just to be safe even though it isn't otherwise
       #   documented.
       #   https://stackoverflow.com/questions/30441750/use-same-cfbundleversion-and-cfbundleshortversionstring-in-all-targets
-
-      child_version = child_plist.get('CFBundleVersion')
-      if version != child_version:
-        raise PlistToolError(CHILD_BUNDLE_VERSION_MISMATCH_MSG % (
-            target, 'CFBundleVersion', label, version, child_version))
-
-      child_version = child_plist.get('CFBundleShortVersionString')
-      if short_version != child_version:
-        raise PlistToolError(CHILD_BUNDLE_VERSION_MISMATCH_MSG % (
-            target, 'CFBundleShortVersionString', label, short_version,
-            child_version))
+      for key, parent_version, check in (
+          ('CFBundleVersion', version, version_check),
+          ('CFBundleShortVersionString', short_version, short_version_check)):
+        child_version = check.string
+        if child_version is not None and not check.valid:
+          raise PlistToolError(CHILD_BUNDLE_INVALID_VERSION_MSG % (
+              target, key, label, child_version))
+        if parent_version != child_version:
+          raise PlistToolError(CHILD_BUNDLE_VERSION_MISMATCH_MSG % (
+              target, key, label, parent_version, child_version))
 
       required_info = child_required_values.get(label, [])
       for pair in required_info:
         if not isinstance(pair, list) or len(pair) != 2:
-          raise PlistToolError(REQUIRED_CHILD_NOT_PAIR % (target, label, pair))
+          raise PlistToolError(
+              REQUIRED_CHILD_NOT_PAIR % (target, label, pair))
 
         [key_path, expected] = pair
         value = get_with_key_path(child_plist, key_path)
         if value is None:
           key_path_str = ':'.join([str(x) for x in key_path])
-          raise PlistToolError(REQUIRED_CHILD_KEYPATH_NOT_FOUND % (
-              target, label, key_path_str, expected))
+          raise PlistToolError(
+              REQUIRED_CHILD_KEYPATH_NOT_FOUND % (
+                  target, label, key_path_str, expected))
 
         if value != expected:
           key_path_str = ':'.join([str(x) for x in key_path])
-          raise PlistToolError(REQUIRED_CHILD_KEYPATH_NOT_MATCHING % (
-              target, label, key_path_str, expected, value))
+          raise PlistToolError(
+              REQUIRED_CHILD_KEYPATH_NOT_MATCHING % (
+                  target, label, key_path_str, expected, value))
 
     # Make sure there wasn't anything listed in required that wasn't listed
     # as a child.
     for label in child_required_values.keys():
       if label not in child_plists:
-        raise PlistToolError(REQUIRED_CHILD_MISSING_MSG % (target, label))
+        raise PlistToolError(
+            REQUIRED_CHILD_MISSING_MSG % (target, label))
 
   @classmethod
   def _write_pkginfo(cls, pkginfo, plist):
@@ -1043,15 +1935,66 @@ class InfoPlistTask(PlistToolTask):
       return b'????'
 
 
+class _AllowedIdIndex(object):
+  """Matches identifiers against a profile's list of allowed identifiers.
+
+  Gives the same answers as checking EntitlementsTask._does_id_match against
+  every allowed value in turn, but exact values are kept in a set and (when
+  wildcards are supported) the prefixes of values ending in "*" in a trie, so
+  each lookup only costs about the length of the identifier instead of the
+  size of the list.
+  """
+
+  # Marks the trie nodes where a wildcard's prefix ends.
+  _WILDCARD_END = None
+
+  def __init__(self, allowed_list, supports_wildcards=False):
+    """Initializes the index.
+
+    Args:
+      allowed_list: The allowed identifiers which can end in a wildcard.
+      supports_wildcards: True/False for if wildcards should be supported in
+          the `allowed_list` values.
+    """
+    self._exact = set()
+    self._wildcards = {}
+    for allowed in allowed_list:
+      if supports_wildcards and allowed.endswith('*'):
+        node = self._wildcards
+        for c in allowed[:-1]:
+          node = node.setdefault(c, {})
+        node[self._WILDCARD_END] = True
+      else:
+        self._exact.add(allowed)
+
+  def matches(self, entitlement_id):
+    """Returns True/False if the identifier is covered by an allowed value."""
+    if entitlement_id in self._exact:
+      return True
+    node = self._wildcards
+    if not node:
+      return False
+    if self._WILDCARD_END in node:
+      return True
+    for c in entitlement_id:
+      node = node.get(c)
+      if node is None:
+        return False
+      if self._WILDCARD_END in node:
+        return True
+    return False
+
+
 class EntitlementsTask(PlistToolTask):
   """Entitlements specific task when processing."""
 
-  def __init__(self, target, options):
-    super(EntitlementsTask, self).__init__(target, options)
+  def __init__(self, target, options, plist_cache=None):
+    super(EntitlementsTask, self).__init__(target, options, plist_cache)
     self._extra_raw_subs = {}
     self._extra_var_subs = {}
     self._unknown_var_msg_addtions = {}
     self._profile_metadata = {}
+    self._profile_indexes = {}
     self._validation_mode = self.options.get('validation_mode', 'error')
 
     assert self._validation_mode in ('error', 'warn', 'skip')
@@ -1060,7 +2003,8 @@ class EntitlementsTask(PlistToolTask):
     # validations.
     profile_metadata_file = self.options.get('profile_metadata_file')
     if profile_metadata_file:
-      self._profile_metadata = PlistIO.get_dict(profile_metadata_file, target)
+      self._profile_metadata = PlistIO.get_dict(
+          profile_metadata_file, target, cache=plist_cache)
       ver = self._profile_metadata.get('Version')
       if ver != 1:
         # Just log the message incase something else goes wrong.
@@ -1170,8 +2114,9 @@ class EntitlementsTask(PlistToolTask):
 
     if not self._does_id_match(bundle_id, provisioned_id,
                                allowed_supports_wildcards=True):
-      raise PlistToolError(ENTITLEMENTS_BUNDLE_ID_MISMATCH % (
-          self.target, bundle_id, provisioned_id))
+      raise PlistToolError(
+          ENTITLEMENTS_BUNDLE_ID_MISMATCH % (
+              self.target, bundle_id, provisioned_id))
 
   def _sanity_check_profile(self):
     """Some basic checks of the profile info to ensure signing will work.
@@ -1185,8 +2130,9 @@ class EntitlementsTask(PlistToolTask):
     # integer), but just checking "ExpirationDate" seems better.
     expire = self._profile_metadata.get('ExpirationDate')
     if expire and expire < datetime.datetime.now():
-      raise PlistToolError(ENTITLEMENTS_PROFILE_HAS_EXPIRED % (
-          self.target, expire.isoformat()))
+      raise PlistToolError(
+          ENTITLEMENTS_PROFILE_HAS_EXPIRED % (
+              self.target, expire.isoformat()))
 
     # There is a "Platform" key (contains an array), but looking at at some
     # profiles used by working watchOS targets, they still say "iOS", so it
@@ -1245,8 +2191,9 @@ class EntitlementsTask(PlistToolTask):
       error_msg = ENTITLEMENTS_BETA_REPORTS_ACTIVE_MISMATCH % (
           self.target, beta_reports_active, profile_key)
       if profile_key is None:
-        error_msg = ENTITLEMENTS_BETA_REPORTS_ACTIVE_MISSING_PROFILE % (
-            self.target, beta_reports_active)
+        error_msg = (
+            ENTITLEMENTS_BETA_REPORTS_ACTIVE_MISSING_PROFILE % (
+                self.target, beta_reports_active))
       self._report(error_msg)
 
     # keychain-access-groups
@@ -1361,28 +2308,35 @@ class EntitlementsTask(PlistToolTask):
 
     return False
 
-  def _does_id_match_list(self,
-                          entitlement_id,
-                          allowed_list,
-                          allowed_supports_wildcards=False):
-    """Check is an id matches the given allowed id list (include wildcards).
+  def _profile_index(self, key_name, profile_grps, supports_wildcards):
+    """Returns an _AllowedIdIndex of the profile's values for a key.
+
+    The index is only built once per profile and key; when the task has a
+    PlistCache (batch and worker modes), it is shared by every control using
+    the same profile metadata file.
 
     Args:
-      entitlement_id: The identifier to check.
-      allowed_list: The allowed identifiers which can end in a wildcard.
-      allowed_supports_wildcards: True/False for if wildcards should
-          be supported in the `allowed_list` values.
+      key_name: The entitlement key the values are for.
+      profile_grps: The profile's values for the key.
+      supports_wildcards: True/False for if wildcards should be supported in
+          the profile's values.
     Returns:
-      True/False if the identifier is covered.
+      The _AllowedIdIndex.
     """
-    for allowed in allowed_list:
-      if self._does_id_match(
-          entitlement_id,
-          allowed,
-          allowed_supports_wildcards=allowed_supports_wildcards):
-        return True
-
-    return False
+    key = (key_name, supports_wildcards)
+    index = self._profile_indexes.get(key)
+    if index is None:
+      def build():
+        return _AllowedIdIndex(
+            profile_grps, supports_wildcards=supports_wildcards)
+      if self.plist_cache is not None:
+        index = self.plist_cache.get(
+            ('entitlements profile index',
+             self.options.get('profile_metadata_file')) + key, build)
+      else:
+        index = build()
+      self._profile_indexes[key] = index
+    return index
 
   def _check_entitlements_array(self,
                                 entitlements,
@@ -1415,17 +2369,18 @@ class EntitlementsTask(PlistToolTask):
 
     profile_grps = profile_entitlements.get(key_name)
     if not profile_grps:
-      self._report(
-          ENTITLEMENTS_HAS_GROUP_PROFILE_DOES_NOT % (target, key_name))
+      self._report(ENTITLEMENTS_HAS_GROUP_PROFILE_DOES_NOT % (
+          target, key_name))
       return
 
+    profile_index = self._profile_index(
+        key_name, profile_grps, supports_wildcards)
     for src_grp in src_grps:
       if '*' in src_grp and not allow_wildcards_in_entitlements:
-        self._report(
-            ENTITLEMENTS_VALUE_HAS_WILDCARD % (target, key_name, src_grp))
+        self._report(ENTITLEMENTS_VALUE_HAS_WILDCARD % (
+            target, key_name, src_grp))
 
-      if not self._does_id_match_list(
-          src_grp, profile_grps, allowed_supports_wildcards=supports_wildcards):
+      if not profile_index.matches(src_grp):
         self._report(
             ENTITLEMENTS_HAS_GROUP_ENTRY_PROFILE_DOES_NOT % (
                 target, key_name, src_grp, '", "'.join(profile_grps)))
@@ -1447,23 +2402,61 @@ class EntitlementsTask(PlistToolTask):
 class PlistTool(object):
   """Implements the core functionality of the plist tool."""
 
-  def __init__(self, control):
+  def __init__(self, control, plist_cache=None):
     """Initializes PlistTool with the given control options.
 
     Args:
       control: The dictionary of options used to control the tool. Please see
           the moduledoc for a description of the format of this dictionary.
+      plist_cache: An optional PlistCache shared with other PlistTools, used
+          for all the files read by this one.
     """
     self._control = control
+    self._plist_cache = plist_cache
 
   def run(self):
     """Performs the operations requested by the control struct.
 
+    When PLISTTOOL_STATS_FILE is set, the RunStats of the run are appended to
+    that file (see the moduledoc).
+
     Raises:
       PlistToolError: For any bad input (unknown control structure entries,
           missing required information, etc.) or for processing/validation
           errors.
     """
+    stats_file = os.environ.get(_STATS_FILE_ENV)
+    if not stats_file:
+      self._run()
+      return
+
+    stats_format = os.environ.get(_STATS_FORMAT_ENV, 'json')
+    if stats_format not in _STATS_FORMATS:
+      raise PlistToolError(UNKNOWN_STATS_FORMAT_MSG % (
+          stats_format, _STATS_FORMAT_ENV, ', '.join(_STATS_FORMATS)))
+    # pylint: disable=g-import-not-at-top
+    from build_bazel_rules_apple.tools.plisttool import run_stats
+    global _current_run_stats
+    _current_run_stats = run_stats.current_run_stats
+    stats = run_stats.RunStats(self._control.get('target'))
+    token = _current_run_stats.set(stats)
+    error = None
+    try:
+      self._run()
+    except PlistToolError as e:
+      error = str(e)
+      raise
+    finally:
+      _current_run_stats.reset(token)
+      stats.finish(error)
+      try:
+        stats.append_to_file(stats_file, stats_format)
+      except OSError as e:
+        # Stats are only informational; they must not fail the run, or hide
+        # the error it raised.
+        print('WARNING: Could not write stats to %s: %s' % (stats_file, e))
+
+  def _run(self):
     target = self._control.get('target')
     if not target:
       raise PlistToolError('No target name in control.')
@@ -1485,60 +2478,146 @@ class PlistTool(object):
     # Check for unknown keys in the control structure.
     validate_keys(list(self._control.keys()), _CONTROL_KEYS)
 
-    tasks = []
-    var_subs = self._control.get('variable_substitutions', {})
-    raw_subs = self._control.get('raw_substitutions', {})
-    unknown_var_msg_additions = {}
-
-    task_types = (
-        EntitlementsTask,
-        InfoPlistTask,
-    )
-    for task_type in task_types:
-      options_name = task_type.control_structure_options_name()
-      options = self._control.get(options_name)
-      if options is not None:
-        validate_keys(list(options.keys()), task_type.options_keys(),
-                      options_name=options_name)
-        task = task_type(target, options)
-        var_subs.update(task.extra_variable_substitutions())
-        raw_subs.update(task.extra_raw_substitutions())
-        unknown_var_msg_additions.update(
-            task.unknown_variable_message_additions())
-        tasks.append(task)
-
-    subs_engine = SubstitutionEngine(target, var_subs, raw_subs)
+    with _stats_phase('setup'):
+      tasks = []
+      var_subs = dict(self._control.get('variable_substitutions', {}))
+      raw_subs = dict(self._control.get('raw_substitutions', {}))
+      unknown_var_msg_additions = {}
+
+      task_types = (
+          EntitlementsTask,
+          InfoPlistTask,
+      )
+      for task_type in task_types:
+        options_name = task_type.control_structure_options_name()
+        options = self._control.get(options_name)
+        if options is not None:
+          validate_keys(list(options.keys()), task_type.options_keys(),
+                        options_name=options_name)
+          task = task_type(target, options, plist_cache=self._plist_cache)
+          var_subs.update(task.extra_variable_substitutions())
+          raw_subs.update(task.extra_raw_substitutions())
+          unknown_var_msg_additions.update(
+              task.unknown_variable_message_additions())
+          tasks.append(task)
+
+      subs_engine = SubstitutionEngine(target, var_subs, raw_subs)
+
+    plists = list(self._control.get('plists', []))
+    forced_plists = list(self._control.get('forced_plists', []))
     out_plist = {}
-    for p in self._control.get('plists', []):
-      plist = PlistIO.get_dict(p, target)
-      self._merge_dictionaries(plist, out_plist, target, subs_engine)
+    for i, plist in enumerate(
+        self._load_plists(plists + forced_plists, target)):
+      with _stats_phase('merge'):
+        self._merge_dictionaries(plist, out_plist, target, subs_engine,
+                                 override_collisions=i >= len(plists))
 
-    forced_plists = self._control.get('forced_plists', [])
-    for p in forced_plists:
-      plist = PlistIO.get_dict(p, target)
-      self._merge_dictionaries(plist, out_plist, target, subs_engine,
-                               override_collisions=True)
+    with _stats_phase('update'):
+      for t in tasks:
+        t.update_plist(out_plist, subs_engine)
 
-    for t in tasks:
-      t.update_plist(out_plist, subs_engine)
+    with _stats_phase('validate'):
+      SubstitutionEngine.validate_no_variable_references(
+          target, '', out_plist, msg_additions=unknown_var_msg_additions)
 
-    SubstitutionEngine.validate_no_variable_references(
-        target, '', out_plist, msg_additions=unknown_var_msg_additions)
+      # The merged plist shares subtrees with the (possibly cached) input
+      # plists, so make sure validation can't change any of them.
+      read_only_plist = _read_only_plist(out_plist)
+      for t in tasks:
+        t.validate_plist(read_only_plist)
 
-    if tasks:
-      saved_copy = copy.deepcopy(out_plist)
+    with _stats_phase('write'):
       for t in tasks:
-        t.validate_plist(out_plist)
-      # Sanity check it wasn't mutated during a validate.
-      assert saved_copy == out_plist
+        t.write_outputs(read_only_plist)
+      PlistIO.write(out_plist, output, binary=self._control.get('binary'),
+                    canonical=self._control.get('canonical'))
+
+  def _load_plists(self, plists, target):
+    """Yields the dictionaries of the given plists, in order.
+
+    When there are several files, they are read concurrently (and the plutil
+    conversions run in parallel), but the dictionaries are still yielded in
+    order. XML and binary plists are only decoded when their turn comes: the
+    in-process decoders hold the GIL anyway, and decoding ahead would keep
+    several decoded plists in memory next to the merged one. A file that
+    fails to load only raises its error when its turn comes, so the error
+    reported is the same as when loading the files one at a time (e.g. a
+    conflict while merging an earlier plist wins).
+
+    Args:
+      plists: The plists, as in the control.
+      target: The name of the target for which the plist is being built.
+    Yields:
+      The dictionary of each plist.
+    """
+    paths = sum(1 for p in plists if isinstance(p, str))
+    if paths <= 1:
+      for p in plists:
+        yield PlistIO.get_dict(p, target, cache=self._plist_cache)
+      return
+
+    # pylint: disable=g-import-not-at-top
+    from concurrent import futures
+    import contextvars
+
+    def read(p):
+      """Returns the bytes of an XML or binary plist, else its dictionary."""
+      with _stats_phase('read'):
+        with open(p, 'rb') as plist_file:
+          plist_contents = plist_file.read()
+        _count_io(bytes_read=len(plist_contents))
+        if plist_contents.startswith((b'<?xml', b'bplist00')):
+          return plist_contents
+        return PlistIO._decode_contents(plist_contents, p, target)
+
+    def get_dict(p, future):
+      """Returns the dictionary of a plist, from the result of read()."""
+      if future is None:
+        return PlistIO.get_dict(p, target)
+      value = future.result()
+      if isinstance(value, bytes):
+        with _stats_phase('read'):
+          value = PlistIO._decode_contents(value, p, target)
+      return value
 
-    PlistIO.write(out_plist, output, binary=self._control.get('binary'))
+    workers = min(paths, _MAX_PLIST_LOADERS)
+    # Only read a few plists ahead of the merging, so they don't all have to
+    # be in memory at once.
+    window = 2 * workers
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+
+      def load(p):
+        if not isinstance(p, str):
+          return None
+        # In a copy of the context, so the read counts towards the stats.
+        return executor.submit(contextvars.copy_context().run, read, p)
+
+      loading = collections.deque(load(p) for p in plists[:window])
+      try:
+        for i, p in enumerate(plists):
+          if i + window < len(plists):
+            loading.append(load(plists[i + window]))
+          future = loading.popleft()
+          if self._plist_cache is None or future is None:
+            yield get_dict(p, future)
+          else:
+            yield self._plist_cache.get(
+                ('plist', p),
+                lambda p=p, future=future: get_dict(p, future))
+      finally:
+        # Don't bother loading the rest when merging failed.
+        for future in loading:
+          if future is not None:
+            future.cancel()
 
   @staticmethod
   def _merge_dictionaries(src, dest, target, subs_engine,
                           override_collisions=False):
     """Merge the top-level keys from src into dest.
 
+    Values without anything to substitute are not copied, so dest shares them
+    with src.
+
     This method is publicly visible for testing.
 
     Args:
@@ -1559,30 +2638,125 @@ class PlistTool(object):
       if key in dest:
         dest_value = dest[key]
 
-        if not override_collisions and src_value != dest_value:
+        if (not override_collisions and src_value is not dest_value and
+            src_value != dest_value):
           raise PlistToolError(CONFLICTING_KEYS_MSG % (
               target, key, src_value, dest_value))
 
       dest[key] = src_value
 
 
-def _main(control_path):
-  """Loads JSON parameters file and runs PlistTool."""
-  with open(control_path) as control_file:
-    control = json.load(control_file)
+def _run_batch_control(control, plist_cache):
+  """Runs PlistTool for one control of a batch.
 
-  tool = PlistTool(control)
+  Args:
+    control: The control dictionary, or the path to a control file.
+    plist_cache: The PlistCache shared by the batch.
+  Returns:
+    The error message if the control failed, otherwise None.
+  """
+  if isinstance(control, str):
+    control = _load_json(control)
   try:
-    tool.run()
+    PlistTool(control, plist_cache=plist_cache).run()
   except PlistToolError as e:
-    # Log tools errors cleanly for build output.
-    sys.stderr.write('ERROR: %s\n' % e)
-    sys.exit(1)
+    return str(e)
+  return None
+
+
+def _run_batch(manifest, plist_cache=None):
+  """Runs PlistTool for every control in a batch manifest.
 
+  Args:
+    manifest: The batch manifest dictionary, see the moduledoc.
+    plist_cache: An optional PlistCache to use instead of a new one.
+  Returns:
+    A list with, for each control in order, its error message or None.
+  Raises:
+    PlistToolError: If the manifest itself is invalid.
+  """
+  unknown_keys = set(manifest.keys()) - _BATCH_MANIFEST_KEYS
+  if unknown_keys:
+    raise PlistToolError(UNKNOWN_BATCH_MANIFEST_KEYS_MSG % (
+        ', '.join(sorted(unknown_keys))))
+  pool = manifest.get('pool', 'threads')
+  if pool not in ('threads', 'processes'):
+    raise PlistToolError(INVALID_BATCH_POOL_MSG % pool)
+
+  # pylint: disable=g-import-not-at-top
+  from build_bazel_rules_apple.tools.plisttool import batch
+  return batch.run_batch(
+      manifest['controls'], _run_batch_control, jobs=manifest.get('jobs', 1),
+      pool=pool, plist_cache=plist_cache)
+
+
+def run_control_file(control_path, plist_cache=None):
+  """Loads a JSON control file (or batch manifest) and runs PlistTool with it.
 
-if __name__ == '__main__':
-  if len(sys.argv) < 2:
+  Args:
+    control_path: The path to the control file.
+    plist_cache: An optional PlistCache to share with other runs.
+  Returns:
+    The exit code for the run; errors are logged to stderr.
+  """
+  control = _load_json(control_path)
+
+  try:
+    if 'controls' in control:
+      errors = [e for e in _run_batch(control, plist_cache) if e is not None]
+    else:
+      errors = []
+      PlistTool(control, plist_cache=plist_cache).run()
+  except PlistToolError as e:
+    errors = [str(e)]
+
+  # Log tools errors cleanly for build output.
+  for error in errors:
+    sys.stderr.write('ERROR: %s\n' % error)
+  return 1 if errors else 0
+
+
+def expand_flagfiles(args):
+  """Expands "@path" arguments into the lines of the file at path.
+
+  When the rules request a worker, the control path is passed via a params
+  file; Bazel expands it for worker requests, but not when it falls back to
+  running the tool as a regular action.
+
+  Args:
+    args: The command line arguments.
+  Returns:
+    The arguments with any flagfiles expanded.
+  """
+  expanded = []
+  for arg in args:
+    if arg.startswith('@') and not arg.startswith('@@'):
+      with open(arg[1:]) as f:
+        expanded.extend(line for line in f.read().splitlines() if line)
+    else:
+      expanded.append(arg)
+  return expanded
+
+
+def _main(control_path):
+  """Loads JSON parameters file and runs PlistTool."""
+  exit_code = run_control_file(control_path)
+  if exit_code:
+    sys.exit(exit_code)
+
+
+def main(argv):
+  """Runs the tool with the given command line arguments.
+
+  Args:
+    argv: The command line arguments, without the program name.
+  Returns:
+    The exit code.
+  """
+  main_args = expand_flagfiles(argv)
+  if not main_args:
     sys.stderr.write('ERROR: Path to control file not specified.\n')
-    exit(1)
+    return 1
 
-  _main(sys.argv[1])
+  _main(main_args[0])
+  return 0
@@ -0,0 +1,871 @@
+# Copyright 2023 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for plisttool.
+
+children: Times InfoPlistTask's validation of 30 binary child Info.plists,
+    compared with decoding each of them in full, one after another.
+decode: Times decoding of synthetic binary, OpenStep and strings file plists
+    with the in-process decoders. When plutil is available (i.e. on macOS), the
+    old plutil based conversion is timed as well for comparison.
+control_load: Times loading a multi-megabyte control file (a root Info.plist
+    with thousands of inline plists and 100 child plists) with plisttool's
+    _load_json, compared with json.load on a text file, and measures the peak
+    memory each allocates.
+disk_cache: Times reading XML and binary plists shaped like provisioning
+    profile metadata with a warm DiskPlistCache, compared with decoding them.
+entitlements: Times validating entitlements against an enterprise-sized
+    provisioning profile (hundreds of keychain groups, app groups and
+    associated domains), compared with matching each value against the whole
+    list of the profile's values.
+substitution: Times SubstitutionEngine creation and application over
+    realistic Info.plist and entitlements trees, compared with the previous
+    implementation (pairwise key checks, one big alternation regex and copying
+    every container).
+startup: Times importing plisttool in a fresh interpreter (as measured by
+    python -X importtime) and a whole process converting one binary plist to
+    XML, compiling the modules from source as a build action does, and lists
+    the modules that importing it and running the conversion imports. The
+    import time is compared with the stored baseline along with the workloads
+    (see below).
+workloads: Times PlistTool.run end to end on synthetic large-app workloads
+    (merging many XML or binary plists, deep entitlements validated against a
+    profile, heavy variable and raw substitution, and validation against 60
+    child plists). For each, it reports the throughput (input bytes read per
+    second), the peak memory allocated and the time of each phase (from
+    RunStats), and compares time and memory with the stored baseline in
+    plisttool_benchmark_baseline.json, exiting with a non-zero status if
+    anything got more than --tolerance worse. Rerun with --save_baseline (and
+    --baseline pointing into the source tree when run with bazel) after an
+    intended change, or when comparing on a different machine.
+xml_write: Times writing a large XML plist (a localization table plus some
+    data) to a file with plisttool's streaming writer and with plistlib.dump,
+    and measures the peak memory each allocates while writing.
+
+Usage: plisttool_benchmark [--iterations N] [--baseline FILE [--save_baseline]]
+    [--tolerance FRACTION] [benchmark ...]
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import plistlib
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+from build_bazel_rules_apple.tools.plisttool import plisttool
+
+_TARGET = '//plisttool:benchmark'
+
+
+def _resource_plist(index):
+  """Returns a dictionary shaped like a typical resource bundle Info.plist."""
+  return {
+      'CFBundleDevelopmentRegion': 'en',
+      'CFBundleIdentifier': 'com.example.resources%d' % index,
+      'CFBundleInfoDictionaryVersion': '6.0',
+      'CFBundleName': 'Resources%d' % index,
+      'CFBundlePackageType': 'BNDL',
+      'CFBundleShortVersionString': '1.0',
+      'CFBundleVersion': '1',
+      'NSHumanReadableCopyright': 'Copyright (c) Example %d' % index,
+      'UISupportedInterfaceOrientations': [
+          'UIInterfaceOrientationPortrait',
+          'UIInterfaceOrientationLandscapeLeft',
+          'UIInterfaceOrientationLandscapeRight',
+      ],
+      'Nested': {'Key%d' % i: 'Value %d' % i for i in range(20)},
+  }
+
+
+def _openstep_value(value):
+  if isinstance(value, dict):
+    return '{ %s }' % ' '.join(
+        '"%s" = %s;' % (k, _openstep_value(v)) for k, v in value.items())
+  if isinstance(value, list):
+    return '( %s )' % ', '.join(_openstep_value(v) for v in value)
+  return '"%s"' % value
+
+
+def _strings_file(entries):
+  return ''.join(
+      '/* Comment %d */\n"Key %d" = "Localized \\"value\\" %d";\n' % (i, i, i)
+      for i in range(entries)).encode('utf-16')
+
+
+def _workloads():
+  """Returns a list of (name, bytes) for the inputs to decode."""
+  plist = _resource_plist(0)
+  return [
+      ('binary', plistlib.dumps(plist, fmt=plistlib.FMT_BINARY)),
+      ('openstep', _openstep_value(plist).encode('utf-8')),
+      ('strings (500 entries)', _strings_file(500)),
+  ]
+
+
+def _decode_in_process(content):
+  return plisttool.PlistIO.decode_bytes(content, '<benchmark>', _TARGET)
+
+
+def _decode_with_plutil(content):
+  # pylint: disable=protected-access
+  return plisttool.plist_from_bytes(
+      plisttool.PlistIO._plutil_convert_to_xml(content, '<benchmark>', _TARGET))
+
+
+def _time_per_call(func, content, iterations):
+  return min(timeit.repeat(
+      lambda: func(content), number=iterations, repeat=3)) / iterations
+
+
+def _benchmark_decode(iterations):
+  have_plutil = shutil.which('plutil') is not None
+  print('%-24s %14s %14s' % ('input', 'in-process', 'plutil'))
+  for name, content in _workloads():
+    in_process = _time_per_call(_decode_in_process, content, iterations)
+    plutil = '-'
+    if have_plutil:
+      expected = _decode_with_plutil(content)
+      assert _decode_in_process(content) == expected, name
+      # plutil is slow enough that fewer iterations are plenty.
+      plutil = '%11.1f us' % (_time_per_call(
+          _decode_with_plutil, content, max(1, iterations // 20)) * 1e6)
+    print('%-24s %11.1f us %14s' % (name, in_process * 1e6, plutil))
+
+
+class _PreviousSubstitutionEngine(object):
+  """The SubstitutionEngine implementation before the trie based matcher."""
+
+  def __init__(self, variable_substitutions, raw_substitutions):
+    self._substitutions = {}
+    for key, value in variable_substitutions.items():
+      value_rfc = plisttool._convert_to_rfc1034(value)  # pylint: disable=protected-access
+      for fmt in ('${%s}', '$(%s)'):
+        self._substitutions[fmt % key] = value
+        self._substitutions[fmt % (key + ':rfc1034identifier')] = value_rfc
+    for key, value in raw_substitutions.items():
+      for existing_key in sorted(self._substitutions):
+        assert not ((key in existing_key) or (existing_key in key))
+      self._substitutions[key] = value
+    raw_keys = sorted(raw_substitutions.keys())
+    for _, v in sorted(self._substitutions.items()):
+      for raw_key in raw_keys:
+        assert raw_key not in v
+    self._substitutions_re = re.compile(
+        '(%s)' % '|'.join(re.escape(x) for x in self._substitutions.keys()))
+
+  def apply_substitutions(self, value):
+    if isinstance(value, str):
+      return self._substitutions_re.sub(
+          lambda m: self._substitutions[m.group(0)], value)
+    if isinstance(value, dict):
+      return {k: self.apply_substitutions(v) for k, v in value.items()}
+    if isinstance(value, list):
+      return [self.apply_substitutions(v) for v in value]
+    return value
+
+
+def _info_plist_tree():
+  """Returns a large Info.plist with a sprinkling of variable references."""
+  plist = _resource_plist(0)
+  plist.update({
+      'CFBundleExecutable': '${EXECUTABLE_NAME}',
+      'CFBundleIdentifier': '$(PRODUCT_BUNDLE_IDENTIFIER)',
+      'CFBundleName': '${PRODUCT_NAME}',
+      'CFBundleURLTypes': [{
+          'CFBundleURLName': 'com.example.scheme%d' % i,
+          'CFBundleURLSchemes': ['scheme%d' % i, 'fb%d' % (1000 + i)],
+      } for i in range(50)],
+      'NSExtension': {
+          'NSExtensionAttributes': {
+              'NSExtensionActivationRule': {
+                  'NSExtensionActivationSupportsImageWithMaxCount': 10,
+              },
+          },
+          'NSExtensionPrincipalClass': '$(PRODUCT_MODULE_NAME).Handler',
+      },
+      'LSApplicationQueriesSchemes': ['app%d' % i for i in range(200)],
+  })
+  for i in range(100):
+    plist['NSUsageDescription%d' % i] = (
+        '${PRODUCT_NAME} needs this for feature %d.' % i)
+  return plist
+
+
+def _entitlements_tree():
+  """Returns a large entitlements plist as passed through plisttool."""
+  return {
+      'application-identifier': 'ABCDE12345.*',
+      'com.apple.developer.team-identifier': 'ABCDE12345',
+      'keychain-access-groups': [
+          '$(AppIdentifierPrefix)com.example.group%d' % i for i in range(300)],
+      'com.apple.security.application-groups': [
+          'group.com.example.shared%d' % i for i in range(300)],
+      'com.apple.developer.associated-domains': [
+          'applinks:www%d.example.com' % i for i in range(300)],
+  }
+
+
+def _benchmark_substitution(iterations):
+  var_subs = {
+      'BUNDLE_NAME': 'Example.app',
+      'DEVELOPMENT_LANGUAGE': 'en',
+      'EXECUTABLE_NAME': 'Example',
+      'PRODUCT_BUNDLE_IDENTIFIER': 'com.example.app',
+      'PRODUCT_BUNDLE_PACKAGE_TYPE': 'APPL',
+      'PRODUCT_MODULE_NAME': 'Example',
+      'PRODUCT_NAME': 'Example',
+      'TARGET_NAME': 'Example',
+      'AppIdentifierPrefix': 'ABCDE12345.',
+  }
+  var_subs.update({'GENERATED_SETTING_%d' % i: 'v%d' % i for i in range(100)})
+  raw_subs = {'ABCDE12345.*': 'ABCDE12345.com.example.app'}
+
+  # Each action builds its own engine, so don't let the re module's cache of
+  # compiled patterns hide the cost of compiling them.
+  def create_new():
+    re.purge()
+    return plisttool.SubstitutionEngine(_TARGET, var_subs, raw_subs)
+
+  def create_previous():
+    re.purge()
+    return _PreviousSubstitutionEngine(var_subs, raw_subs)
+
+  print('%-24s %14s %14s' % ('workload', 'current', 'previous'))
+  current = min(timeit.repeat(create_new, number=iterations, repeat=3))
+  previous = min(timeit.repeat(create_previous, number=iterations, repeat=3))
+  print('%-24s %11.1f us %11.1f us' % (
+      'create engine', current / iterations * 1e6,
+      previous / iterations * 1e6))
+
+  new_engine = create_new()
+  previous_engine = create_previous()
+  for name, tree in (('Info.plist', _info_plist_tree()),
+                     ('entitlements', _entitlements_tree())):
+    assert (new_engine.apply_substitutions(tree) ==
+            previous_engine.apply_substitutions(tree)), name
+    current = _time_per_call(new_engine.apply_substitutions, tree, iterations)
+    previous = _time_per_call(
+        previous_engine.apply_substitutions, tree, iterations)
+    print('%-24s %11.1f us %11.1f us' % (
+        'apply ' + name, current * 1e6, previous * 1e6))
+
+
+def _large_control(inline_plists):
+  """Returns a control for a root Info.plist with many inline plists."""
+  return {
+      'plists': [_resource_plist(i) for i in range(inline_plists)],
+      'variable_substitutions': {'PRODUCT_NAME': 'Benchmark'},
+      'info_plist_options': {
+          'child_plists': {
+              '//app:extension%d' % i: '/path/to/extension%d/Info.plist' % i
+              for i in range(100)
+          },
+      },
+      'output': '/path/to/Info.plist',
+      'target': _TARGET,
+  }
+
+
+def _load_json_text_file(path):
+  with open(path) as f:
+    return json.load(f)
+
+
+def _benchmark_control_load(iterations):
+  temp_dir = tempfile.mkdtemp()
+  try:
+    path = os.path.join(temp_dir, 'control.json')
+    with open(path, 'w') as f:
+      json.dump(_large_control(3000), f)
+    size = os.path.getsize(path)
+    number = max(1, iterations // 40)
+
+    print('%-24s %14s %14s %14s' % (
+        '%.1f MB control' % (size / 1e6), 'time', 'throughput', 'peak memory'))
+    for name, load in (
+        ('plisttool', plisttool._load_json),  # pylint: disable=protected-access
+        ('json.load (text)', _load_json_text_file)):
+      elapsed = min(timeit.repeat(
+          lambda: load(path),  # pylint: disable=cell-var-from-loop
+          number=number, repeat=5)) / number
+      tracemalloc.start()
+      try:
+        load(path)
+        peak = tracemalloc.get_traced_memory()[1]
+      finally:
+        tracemalloc.stop()
+      print('%-24s %11.1f ms %9.1f MB/s %11.1f MB' % (
+          name, elapsed * 1e3, size / elapsed / 1e6, peak / 1e6))
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+def _profile_metadata():
+  """Returns a dictionary shaped like provisioning profile metadata."""
+  return {
+      'AppIDName': 'Example',
+      'ApplicationIdentifierPrefix': ['ABCDE12345'],
+      'CreationDate': datetime.datetime(2023, 1, 2, 3, 4, 5),
+      'DeveloperCertificates': [bytes(range(256)) * 6 for _ in range(20)],
+      'Entitlements': _entitlements_tree(),
+      'ExpirationDate': datetime.datetime(2024, 1, 2, 3, 4, 5),
+      'ProvisionedDevices': ['%040x' % i for i in range(100)],
+      'TeamIdentifier': ['ABCDE12345'],
+      'Version': 1,
+  }
+
+
+def _benchmark_disk_cache(iterations):
+  cache_dir = tempfile.mkdtemp()
+  try:
+    print('%-24s %14s %14s' % ('input', 'cached', 'decoded'))
+    for fmt_name, fmt in (('XML', plistlib.FMT_XML),
+                          ('binary', plistlib.FMT_BINARY)):
+      content = plistlib.dumps(_profile_metadata(), fmt=fmt)
+
+      def read(content):
+        return plisttool.PlistIO.get_dict(io.BytesIO(content), _TARGET)
+
+      decoded = _time_per_call(read, content, iterations)
+      os.environ['PLISTTOOL_CACHE_DIR'] = cache_dir
+      try:
+        read(content)  # Warm the cache.
+        cached = _time_per_call(read, content, iterations)
+      finally:
+        del os.environ['PLISTTOOL_CACHE_DIR']
+      print('%-24s %11.1f us %11.1f us' % (
+          'profile (%s)' % fmt_name, cached * 1e6, decoded * 1e6))
+  finally:
+    shutil.rmtree(cache_dir)
+
+
+def _benchmark_children(iterations):
+  temp_dir = tempfile.mkdtemp()
+  try:
+    children = {}
+    for i in range(30):
+      child = _info_plist_tree()
+      child.update({
+          'CFBundleIdentifier': 'com.example.app.extension%d' % i,
+          'CFBundleShortVersionString': '1.0',
+          'CFBundleVersion': '1',
+      })
+      path = os.path.join(temp_dir, 'child%d.plist' % i)
+      with open(path, 'wb') as f:
+        plistlib.dump(child, f, fmt=plistlib.FMT_BINARY)
+      children['//app:extension%d' % i] = path
+    parent = {
+        'CFBundleIdentifier': 'com.example.app',
+        'CFBundleShortVersionString': '1.0',
+        'CFBundleVersion': '1',
+    }
+
+    def validate(unused):
+      # pylint: disable=protected-access
+      plisttool.InfoPlistTask._validate_children(
+          parent, children, None, _TARGET)
+
+    def decode_all(unused):
+      for path in children.values():
+        plisttool.PlistIO.get_dict(path, _TARGET)
+
+    iterations = max(1, iterations // 10)
+    print('%-24s %14s %14s' % ('workload', 'current', 'full decode'))
+    print('%-24s %11.1f us %11.1f us' % (
+        '30 children',
+        _time_per_call(validate, None, iterations) * 1e6,
+        _time_per_call(decode_all, None, iterations) * 1e6))
+  finally:
+    shutil.rmtree(temp_dir)
+
+
+class _LinearIdMatcher(object):
+  """The previous matching, checking every allowed value in turn."""
+
+  def __init__(self, task, allowed_list, supports_wildcards):
+    self._task = task
+    self._allowed_list = allowed_list
+    self._supports_wildcards = supports_wildcards
+
+  def matches(self, entitlement_id):
+    # pylint: disable=protected-access
+    return any(
+        self._task._does_id_match(
+            entitlement_id, allowed,
+            allowed_supports_wildcards=self._supports_wildcards)
+        for allowed in self._allowed_list)
+
+
+class _LinearEntitlementsTask(plisttool.EntitlementsTask):
+
+  def _profile_index(self, key_name, profile_grps, supports_wildcards):
+    return _LinearIdMatcher(self, profile_grps, supports_wildcards)
+
+
+def _benchmark_entitlements(iterations):
+  groups = 400
+  profile = _profile_metadata()
+  profile['Entitlements'] = {
+      'application-identifier': 'ABCDE12345.com.example.*',
+      'keychain-access-groups': (
+          ['ABCDE12345.com.example.keychain%d' % i for i in range(groups)] +
+          ['ABCDE12345.com.example.shared%d.*' % i for i in range(groups)]),
+      'com.apple.security.application-groups': [
+          'group.com.example.app%d' % i for i in range(groups)],
+      'com.apple.developer.associated-domains': [
+          'applinks:*.example%d.com' % i for i in range(groups)],
+  }
+  profile['ExpirationDate'] = datetime.datetime(2100, 1, 1)
+  entitlements_plist = {
+      'application-identifier': 'ABCDE12345.com.example.app',
+      'keychain-access-groups': (
+          ['ABCDE12345.com.example.keychain%d' % i for i in range(groups)] +
+          ['ABCDE12345.com.example.shared%d.app' % i for i in range(groups)]),
+      'com.apple.security.application-groups': [
+          'group.com.example.app%d' % i for i in range(groups)],
+      'com.apple.developer.associated-domains': [
+          'applinks:*.example%d.com' % i for i in range(groups)],
+  }
+  options = {
+      'bundle_id': 'com.example.app',
+      'profile_metadata_file': profile,
+  }
+
+  def validate(task_class):
+    task_class(_TARGET, options).validate_plist(entitlements_plist)
+
+  iterations = max(1, iterations // 10)
+  print('%-24s %14s %14s' % ('workload', 'current', 'previous'))
+  print('%-24s %11.1f ms %11.1f ms' % (
+      '%d requested values' % (
+          sum(len(v) for v in entitlements_plist.values()
+              if isinstance(v, list))),
+      _time_per_call(validate, plisttool.EntitlementsTask, iterations) * 1e3,
+      _time_per_call(validate, _LinearEntitlementsTask, iterations) * 1e3))
+
+
+def _large_plist(entries):
+  """Returns a plist shaped like a big generated localization table."""
+  return {
+      'Strings': {
+          'Key.%06d' % i: u'Localized value #%d with <markup> & ünïcode' % i
+          for i in range(entries)
+      },
+      'Blobs': [bytes(range(256)) * 4096 for _ in range(8)],
+  }
+
+
+_XML_WRITERS = {
+    'plisttool': plisttool.write_xml_plist,
+    'plistlib': plistlib.dump,
+}
+
+
+def _xml_write_peak_memory(writer, plist):
+  """Returns the peak memory allocated while writing plist to a file."""
+  with tempfile.TemporaryFile() as fp:
+    tracemalloc.start()
+    try:
+      _XML_WRITERS[writer](plist, fp)
+      return tracemalloc.get_traced_memory()[1]
+    finally:
+      tracemalloc.stop()
+
+
+def _benchmark_xml_write(iterations):
+  plist = _large_plist(200000)
+  with tempfile.TemporaryFile() as fp:
+    plisttool.write_xml_plist(plist, fp)
+    size = fp.tell()
+    fp.seek(0)
+    assert fp.read() == plistlib.dumps(plist)
+
+  print('%-24s %14s %14s' % (
+      'writer (%.1f MB)' % (size / 1e6), 'time', 'peak memory'))
+  for writer in sorted(_XML_WRITERS):
+    def write(unused):
+      with tempfile.TemporaryFile() as fp:
+        _XML_WRITERS[writer](plist, fp)  # pylint: disable=cell-var-from-loop
+    elapsed = _time_per_call(write, None, max(1, iterations // 100))
+    peak = _xml_write_peak_memory(writer, plist)
+    print('%-24s %11.1f ms %11.1f MB' % (writer, elapsed * 1e3, peak / 1e6))
+
+
+def _write_plist(directory, name, plist, fmt=plistlib.FMT_XML):
+  path = os.path.join(directory, name)
+  with open(path, 'wb') as f:
+    plistlib.dump(plist, f, fmt=fmt)
+  return path
+
+
+def _many_plists_control(directory, fmt):
+  """Merges 200 resource plists, half of them through forced_plists."""
+  paths = []
+  for i in range(200):
+    plist = {'%s.%d' % (k, i): v for k, v in _resource_plist(i).items()}
+    paths.append(_write_plist(directory, 'resource%d.plist' % i, plist, fmt))
+  return {'plists': paths[:100], 'forced_plists': paths[100:]}
+
+
+def _deep_entitlements_control(directory):
+  """Merges and validates large, deeply nested entitlements."""
+  entitlements = _entitlements_tree()
+  nested = {'leaf': ['value%d' % i for i in range(20)]}
+  for depth in range(6):
+    nested = {'level%d' % depth: nested, 'sibling%d' % depth: [nested] * 3}
+  entitlements['com.example.custom'] = nested
+  profile = _profile_metadata()
+  profile['ExpirationDate'] = datetime.datetime(2100, 1, 1)
+  profile['Entitlements'] = {
+      'application-identifier': 'ABCDE12345.*',
+      'keychain-access-groups': ['ABCDE12345.*'],
+      'com.apple.security.application-groups': [
+          'group.com.example.shared%d' % i for i in range(300)],
+      'com.apple.developer.associated-domains': ['applinks:*'],
+  }
+  return {
+      'plists': [_write_plist(directory, 'entitlements.plist', entitlements)],
+      'entitlements_options': {
+          'bundle_id': 'com.example.app',
+          'profile_metadata_file': _write_plist(
+              directory, 'profile.plist', profile, plistlib.FMT_BINARY),
+      },
+  }
+
+
+def _heavy_substitution_control(directory):
+  """Merges Info.plists full of variable and raw substitutions."""
+  var_subs = {'SETTING_%d' % i: 'value%d' % i for i in range(200)}
+  var_subs['PRODUCT_NAME'] = 'Example'
+  raw_subs = {'@RAW_%d@' % i: 'raw%d' % i for i in range(30)}
+  plists = []
+  for i in range(10):
+    plist = _info_plist_tree()
+    plist.update({
+        'Generated%d.%d' % (i, j): (
+            '$(SETTING_%d) ${SETTING_%d:rfc1034identifier} @RAW_%d@' % (
+                j % 200, (j * 7) % 200, j % 30))
+        for j in range(1000)
+    })
+    plists.append(_write_plist(directory, 'info%d.plist' % i, plist))
+  return {
+      'forced_plists': plists,
+      'variable_substitutions': dict(var_subs, EXECUTABLE_NAME='Example',
+                                     PRODUCT_BUNDLE_IDENTIFIER='com.example',
+                                     PRODUCT_MODULE_NAME='Example'),
+      'raw_substitutions': raw_subs,
+  }
+
+
+def _children_control(directory):
+  """Merges a root Info.plist and validates it against 60 child plists."""
+  children = {}
+  required_values = {}
+  for i in range(60):
+    child = _info_plist_tree()
+    child.update({
+        'CFBundleIdentifier': 'com.example.app.extension%d' % i,
+        'CFBundleShortVersionString': '1.0',
+        'CFBundleVersion': '1',
+    })
+    label = '//app:extension%d' % i
+    children[label] = _write_plist(
+        directory, 'child%d.plist' % i, child, plistlib.FMT_BINARY)
+    required_values[label] = [[['CFBundleDevelopmentRegion'], 'en']]
+  root = _resource_plist(0)
+  root.update({
+      'CFBundleIdentifier': 'com.example.app',
+      'CFBundleShortVersionString': '1.0',
+      'CFBundleVersion': '1',
+  })
+  return {
+      'plists': [_write_plist(directory, 'root.plist', root)],
+      'binary': True,
+      'info_plist_options': {
+          'child_plists': children,
+          'child_plist_required_values': required_values,
+      },
+  }
+
+
+# The workloads timed by the "workloads" benchmark: functions writing their
+# inputs to a directory and returning the control (minus output and target).
+_WORKLOADS = {
+    'binary inputs': lambda d: _many_plists_control(d, plistlib.FMT_BINARY),
+    'deep entitlements': _deep_entitlements_control,
+    'heavy substitution': _heavy_substitution_control,
+    'many XML plists': lambda d: _many_plists_control(d, plistlib.FMT_XML),
+    '60 child plists': _children_control,
+}
+
+
+def _run_workload(control):
+  plisttool.PlistTool(dict(control)).run()
+
+
+def _workload_stats(control, stats_file):
+  """Returns the RunStats JSON of one run of the control."""
+  os.environ['PLISTTOOL_STATS_FILE'] = stats_file
+  try:
+    _run_workload(control)
+  finally:
+    del os.environ['PLISTTOOL_STATS_FILE']
+  with open(stats_file) as f:
+    stats = json.loads(f.readlines()[-1])
+  os.unlink(stats_file)
+  return stats
+
+
+def _workload_peak_memory(control):
+  tracemalloc.start()
+  try:
+    _run_workload(control)
+    return tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+
+def _benchmark_workloads(iterations):
+  results = {}
+  temp_dir = tempfile.mkdtemp()
+  try:
+    print('%-24s %14s %14s %14s' % (
+        'workload', 'time', 'throughput', 'peak memory'))
+    for name, make_control in sorted(_WORKLOADS.items()):
+      directory = os.path.join(temp_dir, str(len(results)))
+      os.mkdir(directory)
+      control = make_control(directory)
+      control.update(output=os.path.join(directory, 'out.plist'),
+                     target=_TARGET)
+
+      # More repeats than elsewhere, to keep noise out of the comparison with
+      # the baseline.
+      number = max(1, iterations // 40)
+      elapsed = min(timeit.repeat(
+          lambda: _run_workload(control),  # pylint: disable=cell-var-from-loop
+          number=number, repeat=7)) / number
+      stats = _workload_stats(control, os.path.join(directory, 'stats'))
+      peak = _workload_peak_memory(control)
+      results[name] = {'time': elapsed, 'peak_memory': peak}
+      print('%-24s %11.1f ms %9.1f MB/s %11.1f MB' % (
+          name, elapsed * 1e3, stats['bytes_read'] / elapsed / 1e6, peak / 1e6))
+      print('    phases: ' + ', '.join(
+          '%s %.1f ms' % (phase, values['wall'] * 1e3)
+          for phase, values in sorted(stats['phases'].items())))
+  finally:
+    shutil.rmtree(temp_dir)
+  return results
+
+
+# Runs the conversion in a fresh interpreter, printing how long it took.
+_STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+from build_bazel_rules_apple.tools.plisttool import plisttool
+plisttool.run_control_file(sys.argv[1])
+print(time.perf_counter() - start)
+"""
+
+_IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def _copy_sources(temp_dir):
+  """Copies plisttool's sources into a fresh package tree under temp_dir.
+
+  Like in a build action, there is no bytecode cache next to the copies, so
+  the runs using them compile plisttool's modules from source.
+
+  Returns:
+    The directory to put on the PYTHONPATH.
+  """
+  root = os.path.join(temp_dir, 'src')
+  package_dir = root
+  for name in plisttool.__name__.split('.')[:-1]:
+    package_dir = os.path.join(package_dir, name)
+    os.makedirs(package_dir)
+    open(os.path.join(package_dir, '__init__.py'), 'w').close()
+  source_dir = os.path.dirname(os.path.abspath(plisttool.__file__))
+  for name in os.listdir(source_dir):
+    if name.endswith('.py') and name != '__init__.py':
+      shutil.copy(os.path.join(source_dir, name), package_dir)
+  return root
+
+
+def _run_startup(control_path, source_root):
+  """Returns (import seconds, run seconds, imported modules) of one process."""
+  env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1',
+             PYTHONPATH=os.pathsep.join([source_root] + sys.path))
+  process = subprocess.run(
+      [sys.executable, '-X', 'importtime', '-c', _STARTUP_SCRIPT,
+       control_path],
+      env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+      universal_newlines=True)
+  import_time = None
+  modules = []
+  for line in process.stderr.splitlines():
+    m = _IMPORTTIME_RE.match(line)
+    if not m:
+      continue
+    modules.append(m.group(4))
+    if m.group(4).endswith('plisttool.plisttool'):
+      import_time = int(m.group(2)) / 1e6
+  return import_time, float(process.stdout), modules
+
+
+def _benchmark_startup(iterations):
+  temp_dir = tempfile.mkdtemp()
+  try:
+    plist_path = _write_plist(
+        temp_dir, 'in', _resource_plist(0), fmt=plistlib.FMT_BINARY)
+    control_path = os.path.join(temp_dir, 'control.json')
+    with open(control_path, 'w') as f:
+      json.dump({
+          'plists': [plist_path],
+          'output': os.path.join(temp_dir, 'out.plist'),
+          'target': _TARGET,
+      }, f)
+
+    # Modules imported by the interpreter itself, for leaving them out.
+    bare = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'pass'],
+        stderr=subprocess.PIPE, check=True, universal_newlines=True)
+    interpreter_modules = {
+        m.group(4) for m in map(_IMPORTTIME_RE.match,
+                                bare.stderr.splitlines()) if m}
+
+    source_root = _copy_sources(temp_dir)
+    runs = [_run_startup(control_path, source_root)
+            for _ in range(max(3, iterations // 20))]
+    import_time = min(r[0] for r in runs)
+    run_time = min(r[1] for r in runs)
+    modules = [m for m in runs[0][2] if m not in interpreter_modules]
+  finally:
+    shutil.rmtree(temp_dir)
+
+  print('%-24s %11.1f ms' % ('import', import_time * 1e3))
+  print('%-24s %11.1f ms' % ('import and convert', run_time * 1e3))
+  print('%d modules imported: %s' % (len(modules), ', '.join(sorted(modules))))
+  return {'startup': {'time': import_time}}
+
+
+_BENCHMARKS = {
+    'children': _benchmark_children,
+    'control_load': _benchmark_control_load,
+    'decode': _benchmark_decode,
+    'disk_cache': _benchmark_disk_cache,
+    'entitlements': _benchmark_entitlements,
+    'startup': _benchmark_startup,
+    'substitution': _benchmark_substitution,
+    'workloads': _benchmark_workloads,
+    'xml_write': _benchmark_xml_write,
+}
+
+
+# The benchmarks whose results are compared with the baseline.
+_BASELINE_BENCHMARKS = ('startup', 'workloads')
+
+# Where the baseline the workloads are compared against is kept.
+_BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'plisttool_benchmark_baseline.json')
+
+
+def _compare_with_baseline(results, baseline, tolerance):
+  """Prints how results compare with the baseline.
+
+  Args:
+    results: For each workload, a dictionary of its measurements.
+    baseline: The same for the baseline.
+    tolerance: How much worse than the baseline (as a fraction of it) a
+        measurement can be before it counts as a regression.
+  Returns:
+    The number of regressions.
+  """
+  regressions = 0
+  print('%-24s %14s %14s' % ('vs. baseline', 'time', 'peak memory'))
+  for name, measurements in sorted(results.items()):
+    if name not in baseline:
+      print('%-24s %14s %14s' % (name, 'new', 'new'))
+      continue
+    ratios = []
+    for metric in ('time', 'peak_memory'):
+      if metric not in measurements:
+        ratios.append('-')
+        continue
+      ratio = measurements[metric] / max(baseline[name][metric], 1e-9)
+      flag = ''
+      if ratio > 1 + tolerance:
+        flag = ' !'
+        regressions += 1
+      ratios.append('%.2fx%s' % (ratio, flag))
+    print('%-24s %14s %14s' % (name, ratios[0], ratios[1]))
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument(
+      '--iterations', type=int, default=200,
+      help='Number of runs per timing sample.')
+  parser.add_argument(
+      '--baseline', default=_BASELINE_PATH,
+      help='JSON file of workload results to compare with.')
+  parser.add_argument(
+      '--save_baseline', action='store_true',
+      help='Write the workload results to --baseline instead of comparing.')
+  parser.add_argument(
+      '--tolerance', type=float, default=0.3,
+      help='Slowdown (as a fraction) reported as a regression.')
+  parser.add_argument(
+      'benchmarks', nargs='*', choices=sorted(_BENCHMARKS) + [[]],
+      help='The benchmarks to run, defaults to all of them.')
+  args = parser.parse_args()
+
+  results = {}
+  for name in args.benchmarks or sorted(_BENCHMARKS):
+    print('== %s ==' % name)
+    section_results = _BENCHMARKS[name](args.iterations)
+    if name in _BASELINE_BENCHMARKS:
+      results.update(section_results)
+
+  if not results:
+    return 0
+  if args.save_baseline:
+    # Keep the baseline of the benchmarks that weren't run.
+    if os.path.exists(args.baseline):
+      with open(args.baseline) as f:
+        results = dict(json.load(f), **results)
+    with open(args.baseline, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+      f.write('\n')
+    return 0
+  if not os.path.exists(args.baseline):
+    return 0
+  with open(args.baseline) as f:
+    baseline = json.load(f)
+  print('== baseline ==')
+  regressions = _compare_with_baseline(results, baseline, args.tolerance)
+  return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,38 @@
+# Copyright 2023 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""The plisttool binary; see plisttool.py for what it does.
+
+This imports plisttool as a module rather than running it as __main__, so the
+modules that import it (like the persistent worker) share its classes and
+state, and its bytecode can be cached between runs.
+"""
+
+import sys
+
+from build_bazel_rules_apple.tools.plisttool import plisttool
+
+
+def main(argv):
+  """Runs plisttool, or its persistent worker, with the given arguments."""
+  if '--persistent_worker' in argv:
+    # pylint: disable=g-import-not-at-top
+    from build_bazel_rules_apple.tools.plisttool import worker
+    return worker.main()
+  return plisttool.main(argv)
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -19,11 +19,23 @@ import datetime
 import io
 import json
 import os
+import plistlib
+import pickle
 import re
+import shutil
+import subprocess
+import sys
 import tempfile
+import threading
 import unittest
+from unittest import mock
 
+from build_bazel_rules_apple.tools.plisttool import batch
+from build_bazel_rules_apple.tools.plisttool import disk_cache
 from build_bazel_rules_apple.tools.plisttool import plisttool
+from build_bazel_rules_apple.tools.plisttool import run_stats
+from build_bazel_rules_apple.tools.plisttool import top_level_values
+from build_bazel_rules_apple.tools.plisttool import worker
 
 # Used as the target name for all tests.
 _testing_target = '//plisttool:tests'
@@ -105,6 +117,314 @@ class PlistToolMainTest(unittest.TestCase):
     with open(outfile.name, 'rb') as fp:
       self.assertIn(b'<?xml', fp.read())
 
+  def test_conversion_imports_only_what_it_needs(self):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(lambda: shutil.rmtree(temp_dir))
+    plist_path = os.path.join(temp_dir, 'in.plist')
+    with open(plist_path, 'wb') as f:
+      plistlib.dump({'Foo': 'abc'}, f, fmt=plistlib.FMT_BINARY)
+    control_path = os.path.join(temp_dir, 'control.json')
+    with open(control_path, 'w') as f:
+      json.dump({'plists': [plist_path],
+                 'target': '//test:target',
+                 'output': os.path.join(temp_dir, 'out.plist')}, f)
+
+    # In a fresh interpreter, since the tests import everything.
+    script = (
+        'import sys\n'
+        'from build_bazel_rules_apple.tools.plisttool import plisttool\n'
+        'plisttool._main(sys.argv[1])\n'
+        'print(" ".join(sys.modules))\n')
+    output = subprocess.check_output(
+        [sys.executable, '-c', script, control_path],
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+        universal_newlines=True)
+    modules = set(output.split())
+    for module in ('concurrent.futures', 'contextlib', 'contextvars', 'fcntl',
+                   'hashlib', 'mmap', 'pickle', 'subprocess', 'tempfile',
+                   'threading', 'traceback'):
+      self.assertNotIn(module, modules)
+    for module in ('batch', 'binary_writer', 'disk_cache', 'openstep',
+                   'run_stats', 'top_level_values', 'worker'):
+      self.assertNotIn(
+          'build_bazel_rules_apple.tools.plisttool.' + module, modules)
+
+  def test_load_json(self):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(lambda: shutil.rmtree(temp_dir))
+    path = os.path.join(temp_dir, 'control.json')
+    control = {'plists': [{'Name': 'caf\u00e9 \U0001f600'}], 'target': '//a:b'}
+    for encoding in ('utf-8', 'utf-8-sig', 'utf-16', 'utf-32-be'):
+      with open(path, 'w', encoding=encoding) as f:
+        json.dump(control, f, ensure_ascii=False)
+      self.assertEqual(control, plisttool._load_json(path))
+
+    with open(path, 'w'):
+      pass
+    with self.assertRaises(json.JSONDecodeError):
+      plisttool._load_json(path)
+
+  def test_expand_flagfiles(self):
+    params_fp = tempfile.NamedTemporaryFile(mode='wt', delete=False)
+    self.addCleanup(lambda: os.unlink(params_fp.name))
+    with params_fp:
+      params_fp.write('path/to/control\n')
+    self.assertEqual(
+        plisttool.expand_flagfiles(['@' + params_fp.name, 'other']),
+        ['path/to/control', 'other'])
+
+
+class PlistToolWorkerTest(unittest.TestCase):
+
+  def _control_file(self, control):
+    json_fp = tempfile.NamedTemporaryFile(mode='wt', delete=False)
+    self.addCleanup(lambda: os.unlink(json_fp.name))
+    with json_fp:
+      json.dump(control, json_fp)
+    return json_fp.name
+
+  def _output_file(self):
+    outfile = tempfile.NamedTemporaryFile(delete=False)
+    self.addCleanup(lambda: os.unlink(outfile.name))
+    outfile.close()
+    return outfile.name
+
+  def _run_worker(self, requests):
+    in_stream = io.StringIO(
+        ''.join(json.dumps(r) + '\n' for r in requests))
+    out_stream = io.StringIO()
+    output = worker.ThreadLocalOutput(io.StringIO())
+    persistent_worker = worker.PersistentWorker(in_stream, out_stream, output)
+    with mock.patch.object(plisttool.sys, 'stdout', output), \
+        mock.patch.object(plisttool.sys, 'stderr', output):
+      persistent_worker.run()
+    responses = [json.loads(l) for l in out_stream.getvalue().splitlines()]
+    return {r['requestId']: r for r in responses}
+
+  def test_singleplex(self):
+    output = self._output_file()
+    control = self._control_file({
+        'plists': [{'Foo': 'abc'}],
+        'target': '//test:target',
+        'output': output,
+        'binary': True,
+    })
+    responses = self._run_worker([{'arguments': [control]}])
+    self.assertEqual(responses, {0: {
+        'exitCode': 0, 'output': '', 'requestId': 0}})
+    with open(output, 'rb') as fp:
+      self.assertEqual(plistlib.load(fp), {'Foo': 'abc'})
+
+  def test_multiplex_errors_do_not_stop_the_worker(self):
+    requests = []
+    outputs = {}
+    for request_id in range(1, 21):
+      if request_id % 5:
+        outputs[request_id] = self._output_file()
+        control = {
+            'plists': [{'Id': request_id}],
+            'target': '//test:target%d' % request_id,
+            'output': outputs[request_id],
+        }
+      else:
+        # Conflicting values raise a PlistToolError.
+        control = {
+            'plists': [{'Id': 1}, {'Id': 2}],
+            'target': '//test:target%d' % request_id,
+            'output': self._output_file(),
+        }
+      requests.append({
+          'arguments': [self._control_file(control)],
+          'requestId': request_id,
+      })
+    requests.append({'arguments': ['/does/not/exist'], 'requestId': 21})
+
+    responses = self._run_worker(requests)
+
+    self.assertEqual(sorted(responses), list(range(1, 22)))
+    for request_id, output in outputs.items():
+      self.assertEqual(responses[request_id]['exitCode'], 0)
+      self.assertEqual(responses[request_id]['output'], '')
+      with open(output, 'rb') as fp:
+        self.assertEqual(plistlib.load(fp), {'Id': request_id})
+    for request_id in (5, 10, 15, 20):
+      self.assertEqual(responses[request_id]['exitCode'], 1)
+      self.assertEqual(
+          responses[request_id]['output'],
+          'ERROR: %s\n' % (plisttool.CONFLICTING_KEYS_MSG % (
+              '//test:target%d' % request_id, 'Id', 2, 1)))
+    self.assertEqual(responses[21]['exitCode'], 1)
+    self.assertIn('FileNotFoundError', responses[21]['output'])
+
+  def test_requests_share_unchanged_files(self):
+    child = self._output_file()
+    version_file = self._output_file()
+
+    def write_inputs(version):
+      with open(child, 'wb') as fp:
+        plistlib.dump({
+            'CFBundleIdentifier': 'com.example.app.child',
+            'CFBundleShortVersionString': '1.0',
+            'CFBundleVersion': version,
+        }, fp, fmt=plistlib.FMT_BINARY)
+      with open(version_file, 'w') as fp:
+        json.dump({'build_version': version, 'short_version_string': '1.0'},
+                  fp)
+
+    def request():
+      output = self._output_file()
+      control = self._control_file({
+          'plists': [{'CFBundleIdentifier': 'com.example.app'}],
+          'info_plist_options': {
+              'child_plists': {'//child:target': child},
+              'version_file': version_file,
+          },
+          'output': output,
+          'target': '//test:target',
+      })
+      return json.dumps({'arguments': [control]}) + '\n', output
+
+    requests, outputs = zip(*[request() for _ in range(3)])
+    read_counts = []
+
+    def in_stream():
+      write_inputs('1.0.1')
+      yield requests[0]
+      yield requests[1]
+      read_counts.append(read_child.call_count)
+      # A changed file is read again by the next request.
+      write_inputs('1.0.10')
+      yield requests[2]
+      read_counts.append(read_child.call_count)
+
+    out_stream = io.StringIO()
+    output = worker.ThreadLocalOutput(io.StringIO())
+    persistent_worker = worker.PersistentWorker(
+        in_stream(), out_stream, output)
+    with mock.patch.object(plisttool.sys, 'stdout', output), \
+        mock.patch.object(plisttool.sys, 'stderr', output), \
+        mock.patch.object(
+            top_level_values, 'find',
+            wraps=top_level_values.find) as read_child:
+      persistent_worker.run()
+
+    self.assertEqual(read_counts, [1, 2])
+    responses = [json.loads(l) for l in out_stream.getvalue().splitlines()]
+    self.assertEqual([r['exitCode'] for r in responses], [0, 0, 0])
+    for path, version in zip(outputs, ('1.0.1', '1.0.1', '1.0.10')):
+      with open(path, 'rb') as fp:
+        self.assertEqual(plistlib.load(fp)['CFBundleVersion'], version)
+
+
+class PlistToolBatchTest(unittest.TestCase):
+
+  def _temp_file(self, content=b'', suffix=''):
+    fp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    self.addCleanup(lambda: os.unlink(fp.name))
+    with fp:
+      fp.write(content)
+    return fp.name
+
+  def _manifest(self, count, **kwargs):
+    child = self._temp_file(plistlib.dumps({
+        'CFBundleIdentifier': 'com.example.app.child',
+        'CFBundleShortVersionString': '1.0',
+        'CFBundleVersion': '1.0.1',
+    }, fmt=plistlib.FMT_BINARY))
+    version_file = self._temp_file(json.dumps({
+        'build_version': '1.0.1', 'short_version_string': '1.0',
+    }).encode('utf-8'))
+    outputs = []
+    controls = []
+    for i in range(count):
+      outputs.append(self._temp_file())
+      controls.append({
+          'plists': [{'CFBundleIdentifier': 'com.example.app', 'Index': i}],
+          'info_plist_options': {
+              'child_plists': {'//child:target': child},
+              'version_file': version_file,
+          },
+          'output': outputs[-1],
+          'target': '//test:target%d' % i,
+      })
+    manifest = dict(controls=controls, **kwargs)
+    return manifest, outputs
+
+  def _assert_outputs(self, outputs):
+    for i, output in enumerate(outputs):
+      with open(output, 'rb') as fp:
+        self.assertEqual(plistlib.load(fp), {
+            'CFBundleIdentifier': 'com.example.app',
+            'CFBundleShortVersionString': '1.0',
+            'CFBundleVersion': '1.0.1',
+            'Index': i,
+        })
+
+  def test_shared_files_are_parsed_once(self):
+    manifest, outputs = self._manifest(10)
+    with mock.patch.object(
+        top_level_values, 'find',
+        wraps=top_level_values.find) as read_child, \
+        mock.patch.object(plisttool.json, 'loads',
+                          side_effect=json.loads) as json_loads:
+      self.assertEqual(plisttool._run_batch(manifest), [None] * 10)
+    self.assertEqual(read_child.call_count, 1)
+    self.assertEqual(json_loads.call_count, 1)
+    self._assert_outputs(outputs)
+
+  def test_thread_pool(self):
+    manifest, outputs = self._manifest(20, jobs=4)
+    self.assertEqual(plisttool._run_batch(manifest), [None] * 20)
+    self._assert_outputs(outputs)
+
+  def test_process_pool(self):
+    manifest, outputs = self._manifest(4, jobs=2, pool='processes')
+    self.assertEqual(plisttool._run_batch(manifest), [None] * 4)
+    self._assert_outputs(outputs)
+
+  def test_failures_are_reported_per_control(self):
+    manifest, outputs = self._manifest(3, jobs=2)
+    manifest['controls'][1]['plists'].append({'Index': 'conflict'})
+    self.assertEqual(plisttool._run_batch(manifest), [
+        None,
+        plisttool.CONFLICTING_KEYS_MSG % (
+            '//test:target1', 'Index', 'conflict', 1),
+        None,
+    ])
+    self._assert_outputs([outputs[0]])
+    with open(outputs[2], 'rb') as fp:
+      self.assertEqual(plistlib.load(fp)['Index'], 2)
+
+  def test_control_paths_and_main(self):
+    manifest, outputs = self._manifest(2)
+    manifest['controls'][1] = self._temp_file(
+        json.dumps(manifest['controls'][1]).encode('utf-8'))
+    manifest_path = self._temp_file(json.dumps(manifest).encode('utf-8'))
+    self.assertFalse(plisttool._main(manifest_path))
+    self._assert_outputs(outputs)
+
+  def test_main_fails_when_a_control_fails(self):
+    manifest, _ = self._manifest(2)
+    manifest['controls'][0]['target'] = ''
+    manifest_path = self._temp_file(json.dumps(manifest).encode('utf-8'))
+    with mock.patch.object(plisttool.sys, 'stderr', io.StringIO()) as stderr:
+      with self.assertRaises(SystemExit):
+        plisttool._main(manifest_path)
+    self.assertEqual(stderr.getvalue(),
+                     'ERROR: No target name in control.\n')
+
+  def test_unknown_manifest_keys(self):
+    with self.assertRaisesRegex(
+        plisttool.PlistToolError,
+        re.escape(plisttool.UNKNOWN_BATCH_MANIFEST_KEYS_MSG % 'mumble')):
+      plisttool._run_batch({'controls': [], 'mumble': 1})
+
+  def test_unknown_pool(self):
+    with self.assertRaisesRegex(
+        plisttool.PlistToolError,
+        re.escape(plisttool.INVALID_BATCH_POOL_MSG % 'fibers')):
+      plisttool._run_batch({'controls': [], 'pool': 'fibers'})
+
 
 class PlistToolVariableReferenceTest(unittest.TestCase):
 
@@ -259,6 +579,50 @@ class PlistToolVersionStringTest(unittest.TestCase):
     self._assert_invalid('1.2.3stilltoolong45')
     self._assert_invalid('1.2.3alsotoolong128')
 
+  def test_check_version_strings(self):
+    strings = ['1.02.3', '1.2.3fc12', '1.0b0', '1.2.3', 4, None, '1.02.3']
+    results = plisttool.check_version_strings(strings)
+    self.assertEqual([
+        ('1.02.3', True, (1, 2, 3), None, None),
+        ('1.2.3fc12', True, (1, 2, 3), 'fc', 12),
+        ('1.0b0', False, None, None, None),
+        ('1.2.3', True, (1, 2, 3), None, None),
+        (4, False, None, None, None),
+        (None, False, None, None, None),
+        ('1.02.3', True, (1, 2, 3), None, None),
+    ], results)
+    # Repeated strings reuse the cached result.
+    self.assertIs(results[0], results[-1])
+    self.assertIs(results[1], plisttool.check_version_strings(['1.2.3fc12'])[0])
+
+    self.assertEqual(
+        [('1.2.3', True, (1, 2, 3), None, None),
+         ('1.2.3fc12', False, None, None, None)],
+        plisttool.check_version_strings(['1.2.3', '1.2.3fc12'], short=True))
+
+  def test_children_versions_are_checked_in_one_call(self):
+    children = {}
+    for i in range(3):
+      children['//fake:child%d' % i] = _xml_plist(
+          '<key>CFBundleIdentifier</key><string>foo.bar.%d</string>'
+          '<key>CFBundleShortVersionString</key><string>1.2</string>'
+          '<key>CFBundleVersion</key><string>1.2.3</string>' % i)
+    parent = {
+        'CFBundleIdentifier': 'foo.bar',
+        'CFBundleShortVersionString': '1.2',
+        'CFBundleVersion': '1.2.3',
+    }
+    with mock.patch.object(
+        plisttool, 'check_version_strings',
+        wraps=plisttool.check_version_strings) as check:
+      # pylint: disable=protected-access
+      plisttool.InfoPlistTask._validate_children(
+          parent, children, None, _testing_target)
+    self.assertEqual(check.call_args_list, [
+        mock.call(['1.2.3'] * 3),
+        mock.call(['1.2'] * 3, short=True),
+    ])
+
 
 class PlistToolShortVersionStringTest(unittest.TestCase):
 
@@ -377,6 +741,542 @@ class PlistToolGetWithKeyPath(unittest.TestCase):
     self.assertIsNone(plisttool.get_with_key_path(d, ['int', 99]))
 
 
+class SubstitutionEngineTest(unittest.TestCase):
+
+  def _engine(self, var_subs=None, raw_subs=None):
+    return plisttool.SubstitutionEngine(_testing_target, var_subs, raw_subs)
+
+  def test_unchanged_values_are_not_copied(self):
+    engine = self._engine({'FOO': 'foo'}, {'RAW': 'raw'})
+    value = {'a': ['x', {'b': 'y$'}], 'c': 'RA', 'd': 5}
+    self.assertIs(engine.apply_substitutions(value), value)
+
+  def test_unchanged_subtrees_are_shared(self):
+    engine = self._engine({'FOO': 'foo'})
+    unchanged_list = ['x', 'y']
+    unchanged_dict = {'z': ['$notavar']}
+    value = {'a': unchanged_list, 'b': unchanged_dict, 'c': ['${FOO}', 'x']}
+    result = engine.apply_substitutions(value)
+    self.assertEqual(
+        result, {'a': ['x', 'y'], 'b': {'z': ['$notavar']}, 'c': ['foo', 'x']})
+    self.assertIs(result['a'], unchanged_list)
+    self.assertIs(result['b'], unchanged_dict)
+    self.assertEqual(value['c'], ['${FOO}', 'x'])
+
+  def test_many_keys(self):
+    var_subs = {'VAR%d' % i: 'value%d' % i for i in range(500)}
+    raw_subs = {'RAW%d.*' % i: 'raw%d' % i for i in range(100, 200)}
+    engine = self._engine(var_subs, raw_subs)
+    self.assertEqual(
+        engine.apply_substitutions(
+            '${VAR1}$(VAR10)${VAR100:rfc1034identifier}RAW150.*'),
+        'value1value10value100raw150')
+
+  def test_overlap_reports_smallest_existing_key(self):
+    with self.assertRaisesRegex(
+        plisttool.PlistToolError,
+        re.escape(plisttool.OVERLAP_IN_SUBSTITUTION_KEYS % (
+            _testing_target, '$(B)', '$(B)x'))):
+      self._engine({'A': 'a', 'B': 'b'}, {'z': '1', '$(B)x': '2'})
+
+  def test_raw_key_in_value_reports_smallest_raw_key(self):
+    with self.assertRaisesRegex(
+        plisttool.PlistToolError,
+        re.escape(plisttool.RAW_SUBSTITUTION_KEY_IN_VALUE % (
+            _testing_target, 'bar', 'foobarqux', '$(A)'))):
+      self._engine({'A': 'foobarqux'}, {'qux': '1', 'bar': '2'})
+
+
+class PlistIOReadTest(unittest.TestCase):
+
+  def _read(self, content):
+    return plisttool.PlistIO.get_dict(io.BytesIO(content), _testing_target)
+
+  def test_binary(self):
+    content = plistlib.dumps(
+        {'a': 'A', 'b': [1, 2.5, True], 'c': {'d': b'\x00\x01'}},
+        fmt=plistlib.FMT_BINARY)
+    self.assertEqual(
+        self._read(content),
+        {'a': 'A', 'b': [1, 2.5, True], 'c': {'d': b'\x00\x01'}})
+
+  def test_binary_dates_and_uids_match_plutil(self):
+    content = plistlib.dumps(
+        {'date': datetime.datetime(2020, 2, 3, 4, 5, 6, 789),
+         'uid': plistlib.UID(7)},
+        fmt=plistlib.FMT_BINARY)
+    self.assertEqual(
+        self._read(content),
+        {'date': datetime.datetime(2020, 2, 3, 4, 5, 6),
+         'uid': {'CF$UID': 7}})
+
+  def test_openstep(self):
+    content = (b'{\n'
+               b'  // A comment.\n'
+               b'  a = b;\n'
+               b'  "quoted key" = ( one, "two", <0aff 10>, );\n'
+               b'  /* Another\n comment. */\n'
+               b'  nested = { x = \'single\'; empty = (); };\n'
+               b'}\n')
+    self.assertEqual(
+        self._read(content),
+        {'a': 'b',
+         'quoted key': ['one', 'two', b'\x0a\xff\x10'],
+         'nested': {'x': 'single', 'empty': []}})
+
+  def test_openstep_escapes(self):
+    content = br'{ a = "tab\tnl\n\"q\" \\ \U00e9 \101 \UD83D\UDE00"; }'
+    self.assertEqual(
+        self._read(content),
+        {'a': u'tab\tnl\n"q" \\ é A \U0001F600'})
+
+  def test_strings_file(self):
+    content = ('/* Greeting */\n'
+               '"Hello" = "Bonjour";\n'
+               '"Same";\n'
+               'unquoted = "Value";\n').encode('utf-16')
+    self.assertEqual(
+        self._read(content),
+        {'Hello': 'Bonjour', 'Same': 'Same', 'unquoted': 'Value'})
+
+  def test_strings_file_utf8_bom(self):
+    content = u'"Key" = "Välue";'.encode('utf-8-sig')
+    self.assertEqual(self._read(content), {'Key': u'Välue'})
+
+  def test_empty_strings_file(self):
+    self.assertEqual(self._read(b'\n'), {})
+    self.assertEqual(self._read(b'/* Nothing here. */\n'), {})
+
+  def test_get_values_decodes_only_what_is_needed(self):
+    plist = {'a': 'A', 'b': {'c': [1, 2.5, True]}, 'd': b'\x00', 'e': 'E'}
+    for fmt in (plistlib.FMT_XML, plistlib.FMT_BINARY):
+      content = plistlib.dumps(plist, fmt=fmt)
+      with mock.patch.object(plisttool.PlistIO, 'decode_bytes') as decode:
+        self.assertEqual(
+            plisttool.PlistIO.get_values(
+                io.BytesIO(content), ['b', 'd', 'missing'], _testing_target),
+            {'b': {'c': [1, 2.5, True]}, 'd': b'\x00'})
+      decode.assert_not_called()
+
+  def test_get_values_stops_parsing_xml_once_found(self):
+    content = _xml_plist(
+        '<key>a</key><string>A</string><key>b</key><true/>'
+    ).getvalue().replace(b'</dict>', b'<key>c</key><not valid', 1)
+    self.assertEqual(
+        plisttool.PlistIO.get_values(
+            io.BytesIO(content), ['a', 'b'], _testing_target),
+        {'a': 'A', 'b': True})
+
+  def test_get_values_of_other_formats(self):
+    self.assertEqual(
+        plisttool.PlistIO.get_values(
+            io.BytesIO(b'{ a = A; b = B; }'), ['b'], _testing_target),
+        {'b': 'B'})
+    self.assertEqual(
+        plisttool.PlistIO.get_values({'a': 'A', 'b': 'B'}, ['a'],
+                                     _testing_target),
+        {'a': 'A'})
+
+  def test_unsupported_formats_use_plutil(self):
+    converted = []
+
+    def fake_plutil(plist_contents, name, target):
+      converted.append(plist_contents)
+      return _xml_plist('<key>a</key><string>b</string>').getvalue()
+
+    for content in (b'{"a": "b"}', b'{ a = b }', b'"\\UD83D"',
+                    b'bplist00garbage', b'"a" = "\\351";', b''):
+      with mock.patch.object(plisttool.PlistIO, '_plutil_convert_to_xml',
+                             side_effect=fake_plutil):
+        self.assertEqual(self._read(content), {'a': 'b'})
+    self.assertEqual(
+        converted,
+        [b'{"a": "b"}', b'{ a = b }', b'"\\UD83D"', b'bplist00garbage',
+         b'"a" = "\\351";', b''])
+
+
+class PlistCacheTest(unittest.TestCase):
+
+  def test_max_entries_drops_least_recently_used(self):
+    cache = batch.PlistCache(max_entries=2)
+    loads = []
+
+    def get(name):
+      return cache.get(('plist', name), lambda: loads.append(name) or name)
+
+    for name in ('a', 'b', 'a', 'c', 'a', 'b'):
+      self.assertEqual(get(name), name)
+    # "b" was the least recently used when "c" came in, then "c" for "b".
+    self.assertEqual(loads, ['a', 'b', 'c', 'b'])
+
+  def test_failures_are_not_cached(self):
+    cache = batch.PlistCache(max_entries=2)
+    with self.assertRaises(ValueError):
+      cache.get(('plist', 'a'), mock.Mock(side_effect=ValueError))
+    self.assertEqual(cache.get(('plist', 'a'), lambda: 'a'), 'a')
+
+
+class DiskPlistCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self._cache_dir = tempfile.mkdtemp()
+    self.addCleanup(lambda: shutil.rmtree(self._cache_dir))
+
+  def _read_with_env(self, content, **env):
+    env.setdefault('PLISTTOOL_CACHE_DIR', self._cache_dir)
+    with mock.patch.dict(os.environ, env):
+      return plisttool.PlistIO.get_dict(io.BytesIO(content), _testing_target)
+
+  def test_decodes_once(self):
+    content = plistlib.dumps(
+        {'a': [1, 2.5, b'\x00'], 'd': datetime.datetime(2020, 1, 2, 3, 4, 5)},
+        fmt=plistlib.FMT_BINARY)
+    with mock.patch.object(plisttool.PlistIO, 'decode_bytes',
+                           wraps=plisttool.PlistIO.decode_bytes) as decode:
+      first = self._read_with_env(content)
+      second = self._read_with_env(content)
+    self.assertEqual(1, decode.call_count)
+    self.assertEqual(first, second)
+    self.assertEqual(
+        {'a': [1, 2.5, b'\x00'], 'd': datetime.datetime(2020, 1, 2, 3, 4, 5)},
+        second)
+    self.assertEqual(1, len(os.listdir(self._cache_dir)))
+
+  def test_errors_are_not_cached(self):
+    for _ in range(2):
+      with mock.patch.object(plisttool.PlistIO, '_plutil_convert_to_xml',
+                             side_effect=plisttool.PlistToolError('bad')):
+        with self.assertRaisesRegex(plisttool.PlistToolError, 'bad'):
+          self._read_with_env(b'{ a = b }')
+    self.assertEqual([], os.listdir(self._cache_dir))
+
+  def test_bad_entries_are_replaced(self):
+    content = _xml_plist('<key>a</key><string>b</string>').getvalue()
+    self._read_with_env(content)
+    [entry] = os.listdir(self._cache_dir)
+    path = os.path.join(self._cache_dir, entry)
+    # Neither a truncated pickle nor one of another type is used.
+    for bad_entry in (b'\x80\x05garbage', pickle.dumps(mock.sentinel.value)):
+      with open(path, 'wb') as f:
+        f.write(bad_entry)
+      self.assertEqual({'a': 'b'}, self._read_with_env(content))
+    with open(path, 'rb') as f:
+      self.assertEqual({'a': 'b'}, pickle.load(f))
+
+  def test_least_recently_used_entries_are_evicted(self):
+    big = 'x' * 400000
+    contents = [_xml_plist('<key>%d</key><string>%s</string>' % (i, big))
+                .getvalue() for i in range(3)]
+    self._read_with_env(contents[0], PLISTTOOL_CACHE_MAX_MB='1')
+    self._read_with_env(contents[1], PLISTTOOL_CACHE_MAX_MB='1')
+    # Age both entries, then use the first one again.
+    for entry in os.listdir(self._cache_dir):
+      os.utime(os.path.join(self._cache_dir, entry), (0, 0))
+    self._read_with_env(contents[0], PLISTTOOL_CACHE_MAX_MB='1')
+    self._read_with_env(contents[2], PLISTTOOL_CACHE_MAX_MB='1')
+
+    cached = []
+    for entry in os.listdir(self._cache_dir):
+      with open(os.path.join(self._cache_dir, entry), 'rb') as f:
+        cached.extend(pickle.load(f))
+    self.assertEqual(['0', '2'], sorted(cached))
+
+  def test_eviction_scans_are_sampled_by_entry_size(self):
+    # Halfway through the range of the random draw.
+    draw = (1 << 31).to_bytes(4, 'little')
+    for max_bytes, scans in ((64 << 20, 0), (64 << 10, 0), (256, 10)):
+      cache = disk_cache.DiskPlistCache(self._cache_dir, max_bytes=max_bytes)
+      with mock.patch.object(disk_cache.os, 'urandom', return_value=draw), \
+          mock.patch.object(cache, '_evict') as evict:
+        for i in range(10):
+          cache.get(b'%d-%d' % (max_bytes, i), lambda: {'key': 'value'})
+      self.assertEqual(scans, evict.call_count)
+
+  def test_invalid_max_size(self):
+    for max_mb in ('lots', '0', '-1'):
+      with self.assertRaisesRegex(
+          plisttool.PlistToolError,
+          re.escape(plisttool.INVALID_CACHE_MAX_MB_MSG % (
+              max_mb, 'PLISTTOOL_CACHE_MAX_MB'))):
+        self._read_with_env(_xml_plist('').getvalue(),
+                            PLISTTOOL_CACHE_MAX_MB=max_mb)
+
+
+class RunStatsTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(lambda: shutil.rmtree(temp_dir))
+    self._stats_file = os.path.join(temp_dir, 'stats')
+    self._output = os.path.join(temp_dir, 'out.plist')
+    self._child = os.path.join(temp_dir, 'child.plist')
+    with open(self._child, 'wb') as f:
+      plistlib.dump({
+          'CFBundleIdentifier': 'com.example.app.ext',
+          'CFBundleShortVersionString': '1.0',
+          'CFBundleVersion': '1',
+      }, f, fmt=plistlib.FMT_BINARY)
+
+  _PLIST = {
+      'CFBundleIdentifier': 'com.example.app',
+      'CFBundleShortVersionString': '1.0',
+      'CFBundleVersion': '1',
+  }
+
+  def _run(self, stats_format=None, **control):
+    control.setdefault('plists', [self._PLIST])
+    control.setdefault('info_plist_options', {
+        'child_plists': {'//app:ext': self._child},
+    })
+    control.update(output=self._output, target=_testing_target)
+    env = {'PLISTTOOL_STATS_FILE': self._stats_file}
+    if stats_format:
+      env['PLISTTOOL_STATS_FORMAT'] = stats_format
+    with mock.patch.dict(os.environ, env):
+      plisttool.PlistTool(control).run()
+
+  def test_json_lines(self):
+    self._run()
+    self._run(binary=True)
+    with open(self._stats_file) as f:
+      [first, second] = [json.loads(line) for line in f]
+    self.assertEqual(_testing_target, first['target'])
+    self.assertIsNone(first['error'])
+    self.assertEqual(
+        {'setup', 'read', 'merge', 'update', 'validate', 'write'},
+        set(first['phases']))
+    self.assertEqual(1, first['phases']['read']['count'])
+    self.assertEqual(os.path.getsize(self._child), first['bytes_read'])
+    self.assertEqual(os.path.getsize(self._output), second['bytes_written'])
+    self.assertEqual(0, first['subprocesses'])
+    for phase in first['phases'].values():
+      self.assertLessEqual(phase['wall'], first['wall'])
+
+  def test_errors_are_recorded(self):
+    with self.assertRaises(plisttool.PlistToolError):
+      self._run(plists=[{'CFBundleIdentifier': 'com.other.app'}])
+    with open(self._stats_file) as f:
+      [stats] = [json.loads(line) for line in f]
+    self.assertIn('com.other.app', stats['error'])
+
+  def test_stats_write_errors_do_not_fail_runs(self):
+    self._stats_file = os.path.join(self._stats_file, 'missing', 'stats')
+    with mock.patch('builtins.print'):
+      self._run()
+      with self.assertRaisesRegex(plisttool.PlistToolError, 'com.other.app'):
+        self._run(plists=[{'CFBundleIdentifier': 'com.other.app'}])
+
+  def test_chrome_trace(self):
+    with mock.patch.object(subprocess, 'Popen') as popen:
+      popen.return_value.returncode = 0
+      popen.return_value.communicate.return_value = (
+          _xml_plist('<key>a</key><string>b</string>').getvalue(), None)
+      self._run(stats_format='chrome',
+                plists=[self._PLIST, io.BytesIO(b'\x00')])
+    self._run(stats_format='chrome')
+    with open(self._stats_file) as f:
+      content = f.read()
+    self.assertTrue(content.startswith('[\n'))
+    # The trailing "]" is optional in the trace format, add it to parse it.
+    events = json.loads(content.rstrip(',\n') + ']')
+    runs = [e for e in events if e['name'] == _testing_target]
+    self.assertEqual(2, len(runs))
+    self.assertEqual(1, runs[0]['args']['subprocesses'])
+    self.assertIn('plutil', [e['name'] for e in events])
+    for event in events:
+      self.assertEqual('X', event['ph'])
+
+  def test_unknown_format(self):
+    with self.assertRaisesRegex(plisttool.PlistToolError, 'xml'):
+      self._run(stats_format='xml')
+
+  def test_disabled_by_default(self):
+    with mock.patch.object(run_stats, 'RunStats') as stats_class:
+      plisttool.PlistTool({
+          'output': self._output,
+          'plists': [{'a': 'b'}],
+          'target': _testing_target,
+      }).run()
+    stats_class.assert_not_called()
+
+
+class PlistIOWriteTest(unittest.TestCase):
+
+  _PLIST = {
+      'b': [1, -1, 1 << 40, 2.5, True, False, 'str', u'ünïcode', b'\x00\x01'],
+      'a': {'nested': 'value', 'date': datetime.datetime(2020, 1, 2, 3, 4, 5)},
+      'c': 'str',
+  }
+
+  def _write_binary(self, plist):
+    out_fp = tempfile.NamedTemporaryFile(delete=False)
+    self.addCleanup(lambda: os.unlink(out_fp.name))
+    out_fp.close()
+    plisttool.PlistIO.write(plist, out_fp.name, binary=True)
+    with open(out_fp.name, 'rb') as fp:
+      return fp.read()
+
+  def test_binary_round_trips(self):
+    content = self._write_binary(self._PLIST)
+    self.assertTrue(content.startswith(b'bplist00'))
+    self.assertEqual(plistlib.loads(content), self._PLIST)
+
+  def test_binary_matches_plistlib(self):
+    self.assertEqual(
+        self._write_binary(self._PLIST),
+        plistlib.dumps(self._PLIST, fmt=plistlib.FMT_BINARY))
+
+  def test_binary_large_object_tables(self):
+    plist = {'Key%d' % i: ['Value%d' % i] * 3 for i in range(40000)}
+    self.assertEqual(
+        self._write_binary(plist),
+        plistlib.dumps(plist, fmt=plistlib.FMT_BINARY))
+
+  def test_binary_is_independent_of_key_order_and_sharing(self):
+    shared = ['x', {'y': 'z'}]
+    plist1 = {'a': shared, 'b': shared, 'c': 1}
+    plist2 = {'c': 1, 'b': ['x', {'y': 'z'}], 'a': ['x', {'y': 'z'}]}
+    self.assertEqual(self._write_binary(plist1), self._write_binary(plist2))
+
+  def test_binary_keeps_signed_zero(self):
+    content = self._write_binary({'a': 0.0, 'b': -0.0})
+    self.assertEqual(str(plistlib.loads(content)['b']), '-0.0')
+
+  def test_xml(self):
+    output = io.BytesIO()
+    plisttool.PlistIO.write(self._PLIST, output, binary=True)
+    self.assertEqual(output.getvalue(), plistlib.dumps(self._PLIST))
+
+  def test_xml_escaping_matches_plistlib(self):
+    plist = {
+        u'<&>\r\n ünïcode': [
+            '', ' \t\n', '<a href="x">&amp;</a>', u'\U0001F600'],
+        'data': [b'', b'\x00' * 1000, bytes(range(256)) * 50],
+        'empty': [{}, [], {'': ''}],
+    }
+    self.assertEqual(plisttool.plist_to_xml_bytes(plist),
+                     plistlib.dumps(plist))
+    with self.assertRaises(ValueError):
+      plisttool.plist_to_xml_bytes({'a': 'control \x01 character'})
+
+  def test_xml_is_written_in_bounded_chunks(self):
+    plist = {
+        'Key%d' % i: ['Value%d' % i, b'\xff' * (i % 3000)] for i in range(2000)
+    }
+    writes = []
+
+    class _RecordingFile(object):
+
+      def write(self, chunk):
+        writes.append(bytes(chunk))
+
+    plisttool.write_xml_plist(plist, _RecordingFile())
+    self.assertGreater(len(writes), 1)
+    # A chunk only goes past the buffer size by the last line added to it.
+    for chunk in writes:
+      self.assertLess(len(chunk), plisttool._XML_WRITE_BUFFER_SIZE + 4096)
+    self.assertEqual(b''.join(writes), plistlib.dumps(plist))
+
+
+class CanonicalOutputTest(unittest.TestCase):
+  """Checks canonical output against the golden files in testdata/canonical.
+
+  The golden files pin the exact bytes written; if the canonical format ever
+  has to change, regenerate them and review the diff.
+  """
+
+  _CASES = {
+      'info_plist': {
+          'CFBundleIdentifier': 'com.example.app',
+          'CFBundleName': u'Exämple & <Co>',
+          'CFBundleURLTypes': [
+              {'CFBundleURLSchemes': ['example', 'example-dev']},
+              {'CFBundleURLSchemes': ['example']},
+          ],
+          'CFBundleVersion': '1.2.3',
+          'LSRequiresIPhoneOS': True,
+          'NSHumanReadableCopyright': 'Line one\r\nLine two',
+          'UIDeviceFamily': [1, 2],
+          'UIRequiredDeviceCapabilities': ('arm64',),
+      },
+      'scalars': {
+          'dates': [
+              datetime.datetime(2001, 1, 1),
+              datetime.datetime(2020, 2, 3, 4, 5, 6, 789012),
+              datetime.datetime(
+                  2020, 2, 3, 5, 5, 6,
+                  tzinfo=datetime.timezone(datetime.timedelta(hours=1))),
+              datetime.datetime(1969, 7, 20, 20, 17, 40),
+          ],
+          'data': [b'', bytearray(b'\x00\xff'), bytes(range(256))],
+          'integers': [0, -1, 255, 256, 65536, 1 << 32, (1 << 63) - 1,
+                       (1 << 64) - 1, -(1 << 63)],
+          'reals': [0.5, 0.1, -0.0, 0.0, 1e300, float('inf'), float('-inf'),
+                    -float('nan'), 1.0],
+          'strings': ['', 'ascii', u'ünïcode \U0001F600', '$ only'],
+          'uid': plistlib.UID(3),
+      },
+      'structure': {
+          'z': {'nested': {'deeper': {'deepest': [[], {}, [[b'\x01' * 100]]]}}},
+          'a': ['repeated', 'repeated', {'repeated': 'repeated'}],
+          'm': [{'b': 1, 'a': 2}, {'a': 2, 'b': 1}],
+      },
+  }
+
+  def _canonical_output(self, plist, binary):
+    out_fp = tempfile.NamedTemporaryFile(delete=False)
+    self.addCleanup(lambda: os.unlink(out_fp.name))
+    out_fp.close()
+    plisttool.PlistTool({
+        'binary': binary,
+        'canonical': True,
+        'output': out_fp.name,
+        'plists': [plist],
+        'target': _testing_target,
+    }).run()
+    with open(out_fp.name, 'rb') as fp:
+      return fp.read()
+
+  def _golden(self, name):
+    with open(os.path.join(
+        os.path.dirname(__file__), 'testdata', 'canonical', name), 'rb') as fp:
+      return fp.read()
+
+  def test_golden_files(self):
+    for name, plist in sorted(self._CASES.items()):
+      for binary, extension in ((False, '.xml'), (True, '.bplist')):
+        with self.subTest(name=name + extension):
+          self.assertEqual(self._canonical_output(plist, binary),
+                           self._golden(name + extension))
+
+  def test_independent_of_insertion_order(self):
+    plist = self._CASES['structure']
+    reordered = {k: plist[k] for k in reversed(list(plist))}
+    for binary in (False, True):
+      self.assertEqual(self._canonical_output(plist, binary),
+                       self._canonical_output(reordered, binary))
+
+  def test_xml_to_file_objects(self):
+    output = io.BytesIO()
+    plisttool.PlistIO.write(self._CASES['info_plist'], output, canonical=True)
+    self.assertEqual(output.getvalue(), self._golden('info_plist.xml'))
+
+  def test_canonical_values(self):
+    plist = self._CASES['scalars']
+    canonical = plisttool.canonical_plist_value(plist)
+    self.assertEqual(canonical['dates'][1],
+                     datetime.datetime(2020, 2, 3, 4, 5, 6))
+    self.assertEqual(canonical['dates'][2],
+                     datetime.datetime(2020, 2, 3, 4, 5, 6))
+    self.assertEqual(str(canonical['reals'][2]), '0.0')
+    self.assertEqual(canonical['uid'], {'CF$UID': 3})
+    # The input is left alone, and unchanged parts are shared.
+    self.assertEqual(str(plist['reals'][2]), '-0.0')
+    self.assertIs(canonical['strings'], plist['strings'])
+
+
 class PlistToolTest(unittest.TestCase):
 
   def _assert_plisttool_result(self, control, expected):
@@ -409,6 +1309,37 @@ class PlistToolTest(unittest.TestCase):
     tool.run()
     self.assertEqual(expected, pkginfo.getvalue())
 
+  def test_merge_shares_unchanged_subtrees(self):
+    unchanged = {'Nested': ['a', {'b': 'c'}]}
+    out_plist = {}
+    plisttool.PlistTool._merge_dictionaries(
+        {'Foo': unchanged, 'Bar': ['${BAZ}']}, out_plist, _testing_target,
+        plisttool.SubstitutionEngine(_testing_target, {'BAZ': 'baz'}))
+    self.assertEqual({'Foo': unchanged, 'Bar': ['baz']}, out_plist)
+    self.assertIs(unchanged, out_plist['Foo'])
+
+  def test_validation_gets_read_only_plist(self):
+    nested = {'Array': ['a', {'b': 'c'}]}
+    mutations = [
+        lambda p: p.__setitem__('Foo', 'bar'),
+        lambda p: p.pop('Nested'),
+        lambda p: p['Nested'].update({'x': 'y'}),
+        lambda p: p['Nested']['Array'].append('d'),
+        lambda p: p.get('Nested')['Array'][1].clear(),
+        lambda p: list(p.items())[0][1]['Array'].sort(),
+        lambda p: next(iter(p['Nested']['Array'][1:])).__setitem__('b', 'd'),
+    ]
+    for mutate in mutations:
+      with mock.patch.object(plisttool.InfoPlistTask, 'validate_plist',
+                             autospec=True,
+                             side_effect=lambda self, p, m=mutate: m(p)):
+        with self.assertRaises(TypeError):
+          _plisttool_result({
+              'plists': [{'Nested': nested}],
+              'info_plist_options': {},
+          })
+    self.assertEqual({'Array': ['a', {'b': 'c'}]}, nested)
+
   def test_merge_of_one_file(self):
     plist1 = _xml_plist('<key>Foo</key><string>abc</string>')
     self._assert_plisttool_result({'plists': [plist1]}, {'Foo': 'abc'})
@@ -469,6 +1400,66 @@ class PlistToolTest(unittest.TestCase):
     plist2 = {}
     self._assert_plisttool_result({'plists': [plist1, plist2]}, {})
 
+  def _plist_files(self, plists):
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(lambda: shutil.rmtree(temp_dir))
+    paths = []
+    for i, plist in enumerate(plists):
+      path = os.path.join(temp_dir, '%d.plist' % i)
+      with open(path, 'wb') as f:
+        if isinstance(plist, bytes):
+          f.write(plist)
+        else:
+          plistlib.dump(plist, f, fmt=plistlib.FMT_BINARY)
+      paths.append(path)
+    return paths
+
+  def test_merge_of_many_files_keeps_order(self):
+    plists = [{'Key%d' % i: i, 'Shared': 'same'} for i in range(20)]
+    forced_plists = [{'Key%d' % i: 'forced%d' % j, 'Last': j}
+                     for j, i in enumerate(range(0, 20, 2))]
+    expected = {'Key%d' % i: i for i in range(20)}
+    expected.update({'Key%d' % i: 'forced%d' % j
+                     for j, i in enumerate(range(0, 20, 2))})
+    expected.update({'Shared': 'same', 'Last': 9})
+    self._assert_plisttool_result({
+        'plists': self._plist_files(plists),
+        'forced_plists': self._plist_files(forced_plists),
+    }, expected)
+
+  def test_merge_of_many_files_reports_first_error(self):
+    paths = self._plist_files(
+        [{'Foo': 'abc'}, {'Foo': 'def'}, b'not a plist'] +
+        [{'Key%d' % i: i} for i in range(10)])
+    with mock.patch.object(
+        plisttool.PlistIO, '_plutil_convert_to_xml',
+        side_effect=plisttool.PlistToolError('plutil failed')) as plutil:
+      with self.assertRaisesRegex(
+          plisttool.PlistToolError,
+          re.escape(plisttool.CONFLICTING_KEYS_MSG % (
+              _testing_target, 'Foo', 'def', 'abc'))):
+        _plisttool_result({'plists': paths})
+      # Without the conflict, the bad file's error is the one reported.
+      with self.assertRaisesRegex(plisttool.PlistToolError, 'plutil failed'):
+        _plisttool_result({'plists': paths[2:]})
+    plutil.assert_called_with(b'not a plist', paths[2], _testing_target)
+
+  def test_merge_of_many_files_decodes_them_in_turn(self):
+    paths = self._plist_files([{'Key%d' % i: i} for i in range(10)])
+    decode = plisttool.PlistIO._decode_contents
+    threads = set()
+
+    def decode_and_record_thread(*args):
+      threads.add(threading.get_ident())
+      return decode(*args)
+
+    # Only reading the files happens ahead of the merge, on the thread pool.
+    with mock.patch.object(plisttool.PlistIO, '_decode_contents',
+                           side_effect=decode_and_record_thread):
+      self._assert_plisttool_result(
+          {'plists': paths}, {'Key%d' % i: i for i in range(10)})
+    self.assertEqual({threading.get_ident()}, threads)
+
   def test_more_complicated_merge(self):
     plist1 = _xml_plist(
         '<key>String1</key><string>abc</string>'
@@ -936,6 +1927,24 @@ class PlistToolTest(unittest.TestCase):
           },
       })
 
+  def test_child_plist_with_invalid_bundle_version_raises(self):
+    with self.assertRaisesRegex(
+        plisttool.PlistToolError,
+        re.escape(plisttool.CHILD_BUNDLE_INVALID_VERSION_MSG % (
+            _testing_target, 'CFBundleVersion', '//fake:label', '1.2.3b0'))):
+      parent = _xml_plist(
+          '<key>CFBundleIdentifier</key><string>foo.bar</string>')
+      child = _xml_plist(
+          '<key>CFBundleIdentifier</key><string>foo.bar.baz</string>'
+          '<key>CFBundleVersion</key><string>1.2.3b0</string>')
+      children = {'//fake:label': child}
+      _plisttool_result({
+          'plists': [parent],
+          'info_plist_options': {
+              'child_plists': children,
+          },
+      })
+
   def test_child_plist_with_incorrect_bundle_short_version_raises(self):
     with self.assertRaisesRegex(
         plisttool.PlistToolError,
@@ -1062,6 +2071,47 @@ class PlistToolTest(unittest.TestCase):
           },
       })
 
+  def test_child_plists_errors_are_reported_in_order(self):
+    parent = {'CFBundleIdentifier': 'foo.bar'}
+    children = {
+        '//fake:ok': {'CFBundleIdentifier': 'foo.bar.ok'},
+        '//fake:first': _xml_plist(
+            '<key>CFBundleIdentifier</key><string>foo.first</string>'),
+        '//fake:second': io.BytesIO(plistlib.dumps(
+            {'CFBundleIdentifier': 'foo.second'}, fmt=plistlib.FMT_BINARY)),
+    }
+    for _ in range(5):
+      for child in children.values():
+        if not isinstance(child, dict):
+          child.seek(0)
+      with self.assertRaisesRegex(
+          plisttool.PlistToolError,
+          re.escape(plisttool.CHILD_BUNDLE_ID_MISMATCH_MSG % (
+              _testing_target, '//fake:first', 'foo.bar.', 'foo.first'))):
+        _plisttool_result({
+            'plists': [parent],
+            'info_plist_options': {'child_plists': children},
+        })
+
+  def test_child_plist_required_values_of_binary_child(self):
+    child = io.BytesIO(plistlib.dumps({
+        'CFBundleIdentifier': 'foo.bar.baz',
+        'NSExtension': {'NSExtensionPointIdentifier': 'com.apple.widget'},
+        'Other': [1, 2, 3],
+    }, fmt=plistlib.FMT_BINARY))
+    _plisttool_result({
+        'plists': [{'CFBundleIdentifier': 'foo.bar'}],
+        'info_plist_options': {
+            'child_plists': {'//fake:label': child},
+            'child_plist_required_values': {
+                '//fake:label': [
+                    [['NSExtension', 'NSExtensionPointIdentifier'],
+                     'com.apple.widget'],
+                ],
+            },
+        },
+    })
+
   def test_unknown_control_keys_raise(self):
     with self.assertRaisesRegex(
         plisttool.PlistToolError,
@@ -1172,6 +2222,16 @@ class PlistToolTest(unittest.TestCase):
           'info_plist_options': {}  # presence triggers checking
       })
 
+  def test_non_string_version(self):
+    with self.assertRaisesRegex(
+        plisttool.PlistToolError,
+        re.escape(plisttool.INVALID_VERSION_KEY_VALUE_MSG % (
+            _testing_target, 'CFBundleVersion', 2))):
+      _plisttool_result({
+          'plists': [{'CFBundleVersion': 2}],
+          'info_plist_options': {}  # presence triggers checking
+      })
+
   def test_versions_not_checked_without_options(self):
     plist = {
         'CFBundleShortVersionString': '1foo',
@@ -1603,6 +2663,50 @@ class PlistToolTest(unittest.TestCase):
           },
       })
 
+  def test_entitlements_keychain_many_groups(self):
+    profile_groups = ['QWERTY.group%d' % i for i in range(500)] + [
+        'QWERTY.prefix%d.*' % i for i in range(500)]
+    plist1 = {'keychain-access-groups': [
+        'QWERTY.group499', 'QWERTY.prefix7.sub', 'QWERTY.prefix499.',
+    ]}
+    control = {
+        'plists': [plist1],
+        'entitlements_options': {
+            'bundle_id': 'my.bundle.id',
+            'profile_metadata_file': {
+                'Entitlements': {'keychain-access-groups': profile_groups},
+                'Version': 1,
+            },
+        },
+    }
+    self._assert_plisttool_result(control, plist1)
+
+    plist1['keychain-access-groups'].append('QWERTY.prefix500.sub')
+    with self.assertRaisesRegex(
+        plisttool.PlistToolError,
+        re.escape(plisttool.ENTITLEMENTS_HAS_GROUP_ENTRY_PROFILE_DOES_NOT % (
+            _testing_target, 'keychain-access-groups', 'QWERTY.prefix500.sub',
+            '", "'.join(profile_groups)))):
+      _plisttool_result(control)
+
+  def test_allowed_id_index_matches_does_id_match(self):
+    task = plisttool.EntitlementsTask(_testing_target, {})
+    allowed_list = ['*', 'a.b', 'a.c*', 'b.*', '', 'c.**']
+    for supports_wildcards in (False, True):
+      index = plisttool._AllowedIdIndex(
+          allowed_list, supports_wildcards=supports_wildcards)
+      for entitlement_id in ('', '*', 'a', 'a.b', 'a.c', 'a.cd', 'b.', 'b.x',
+                             'c.*', 'c.**', 'c.*x', 'd'):
+        expected = any(
+            task._does_id_match(entitlement_id, allowed,
+                                allowed_supports_wildcards=supports_wildcards)
+            for allowed in allowed_list)
+        self.assertEqual(index.matches(entitlement_id), expected,
+                         (supports_wildcards, entitlement_id))
+      self.assertFalse(plisttool._AllowedIdIndex(
+          allowed_list[1:], supports_wildcards=supports_wildcards).matches(
+              'x'))
+
   def test_entitlements_app_groups_match(self):
     # This is really looking for the lack of an error being raised.
     plist1 = {
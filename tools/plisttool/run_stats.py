@@ -0,0 +1,167 @@
+# Copyright 2023 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Timings and I/O counters of plisttool runs.
+
+plisttool only imports this module when PLISTTOOL_STATS_FILE is set.
+"""
+
+import contextlib
+import contextvars
+import fcntl
+import json
+import os
+import threading
+import time
+
+# The RunStats of the PlistTool.run in progress (if stats are enabled).
+current_run_stats = contextvars.ContextVar('plisttool_run_stats', default=None)
+
+
+class RunStats(object):
+  """Timings and I/O counters for one PlistTool.run.
+
+  Time is recorded for named phases; a phase may happen several times (e.g.
+  "read" for each input) and phases can nest ("plutil" happens inside "read",
+  which can happen inside "validate" for child plists). CPU time is that of
+  the thread running the phase.
+
+  The stats are appended to the file named by PLISTTOOL_STATS_FILE when set,
+  so the runs of a whole build can be aggregated; see the plisttool moduledoc.
+  """
+
+  def __init__(self, target):
+    self.target = target
+    self.bytes_read = 0
+    self.bytes_written = 0
+    self.subprocesses = 0
+    self.error = None
+    # (name, start time since the epoch, wall time, cpu time, thread id)
+    self.spans = []
+    self._lock = threading.Lock()
+    self._start = time.time()
+    self._start_counter = time.perf_counter()
+    self._start_cpu = time.thread_time()
+    self._wall = None
+    self._cpu = None
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    """Context manager recording the time spent in a phase."""
+    start_counter = time.perf_counter()
+    start_cpu = time.thread_time()
+    try:
+      yield
+    finally:
+      wall = time.perf_counter() - start_counter
+      cpu = time.thread_time() - start_cpu
+      start = self._start + (start_counter - self._start_counter)
+      with self._lock:
+        self.spans.append((name, start, wall, cpu, threading.get_ident()))
+
+  def add(self, bytes_read=0, bytes_written=0, subprocesses=0):
+    """Adds to the I/O counters."""
+    with self._lock:
+      self.bytes_read += bytes_read
+      self.bytes_written += bytes_written
+      self.subprocesses += subprocesses
+
+  def finish(self, error=None):
+    """Records the end of the run, and its error message if it failed."""
+    self._wall = time.perf_counter() - self._start_counter
+    self._cpu = time.thread_time() - self._start_cpu
+    self.error = error
+
+  def to_json(self):
+    """Returns the stats as a JSON-compatible dictionary, phases summed."""
+    phases = {}
+    for name, _, wall, cpu, _ in self.spans:
+      phase = phases.setdefault(name, {'count': 0, 'wall': 0.0, 'cpu': 0.0})
+      phase['count'] += 1
+      phase['wall'] += wall
+      phase['cpu'] += cpu
+    return {
+        'target': self.target,
+        'pid': os.getpid(),
+        'start': self._start,
+        'wall': self._wall,
+        'cpu': self._cpu,
+        'phases': phases,
+        'bytes_read': self.bytes_read,
+        'bytes_written': self.bytes_written,
+        'subprocesses': self.subprocesses,
+        'error': self.error,
+    }
+
+  def chrome_trace_events(self):
+    """Returns the stats as Chrome trace event format "complete" events."""
+    pid = os.getpid()
+    events = [{
+        'name': self.target,
+        'cat': 'plisttool',
+        'ph': 'X',
+        'ts': self._start * 1e6,
+        'dur': self._wall * 1e6,
+        'pid': pid,
+        'tid': threading.get_ident(),
+        'args': {
+            'cpu_ms': self._cpu * 1e3,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'subprocesses': self.subprocesses,
+            'error': self.error,
+        },
+    }]
+    for name, start, wall, cpu, tid in self.spans:
+      events.append({
+          'name': name,
+          'cat': 'plisttool',
+          'ph': 'X',
+          'ts': start * 1e6,
+          'dur': wall * 1e6,
+          'pid': pid,
+          'tid': tid,
+          'args': {'target': self.target, 'cpu_ms': cpu * 1e3},
+      })
+    return events
+
+  def append_to_file(self, path, stats_format='json'):
+    """Appends the stats to a file shared by concurrent processes.
+
+    With the "json" format, each run is one line holding to_json(). With
+    "chrome", the file is a JSON array of trace events (left unterminated, as
+    the Chrome trace event format allows) that chrome://tracing and Perfetto
+    can load directly.
+
+    Args:
+      path: The file to append to.
+      stats_format: "json" or "chrome".
+    """
+    if stats_format == 'chrome':
+      lines = ''.join(
+          json.dumps(e, sort_keys=True) + ',\n'
+          for e in self.chrome_trace_events())
+    else:
+      lines = json.dumps(self.to_json(), sort_keys=True) + '\n'
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+      # The lock keeps the records of parallel actions from interleaving, and
+      # lets exactly one of them start a chrome trace with "[".
+      fcntl.flock(fd, fcntl.LOCK_EX)
+      if stats_format == 'chrome' and os.fstat(fd).st_size == 0:
+        lines = '[\n' + lines
+      os.write(fd, lines.encode('utf-8'))
+    finally:
+      os.close(fd)
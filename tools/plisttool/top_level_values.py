@@ -0,0 +1,265 @@
+# Copyright 2023 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Finds top-level values of XML and binary plists without decoding them.
+
+plisttool only imports this module when reading some values of a plist file
+(e.g. the keys of child plists that are checked against their parent).
+"""
+
+import datetime
+import plistlib
+import struct
+import xml.parsers.expat
+
+from build_bazel_rules_apple.tools.plisttool import binary_writer
+
+
+class _UnsupportedPlistError(Exception):
+  """Raised when a plist's values can't be extracted without decoding it."""
+
+
+class _AllValuesFound(Exception):
+  """Raised to stop parsing once all requested values are found."""
+
+
+class _BinaryPlistReader(object):
+  """Decodes single objects of a binary (bplist00) plist on demand.
+
+  Objects are found through the offset table, so reading a few values of the
+  top-level dictionary doesn't decode (or even look at) the rest of the file.
+  Values come out like PlistIO.decode_bytes returns them (dates in whole
+  seconds, UIDs as `{"CF$UID": n}`). Anything unexpected raises
+  _UnsupportedPlistError; the caller then decodes the whole file instead.
+  """
+
+  def __init__(self, contents):
+    if not contents.startswith(b'bplist00') or len(contents) < 40:
+      raise _UnsupportedPlistError()
+    self._contents = contents
+    (offset_size, self._ref_size, num_objects, self._top_object,
+     offset_table_offset) = struct.unpack('>6xBBQQQ', contents[-32:])
+    if (offset_size not in binary_writer.UINT_FORMATS or
+        self._ref_size not in binary_writer.UINT_FORMATS):
+      raise _UnsupportedPlistError()
+    self._offsets = self._read_uints(
+        offset_table_offset, num_objects, offset_size)
+    self._reading = set()
+
+  def _read_uints(self, offset, count, size):
+    end = offset + count * size
+    if end > len(self._contents):
+      raise _UnsupportedPlistError()
+    return struct.unpack(
+        '>%d%s' % (count, binary_writer.UINT_FORMATS[size]),
+        self._contents[offset:end])
+
+  def _read_size(self, marker_low, offset):
+    """Returns the (length, offset of the payload) of a sized object."""
+    if marker_low != 0xF:
+      return marker_low, offset
+    int_marker = self._contents[offset]
+    if int_marker & 0xF0 != 0x10 or int_marker & 0xF > 3:
+      raise _UnsupportedPlistError()
+    size = 1 << (int_marker & 0xF)
+    return self._read_uints(offset + 1, 1, size)[0], offset + 1 + size
+
+  def _bytes(self, offset, length):
+    if offset + length > len(self._contents):
+      raise _UnsupportedPlistError()
+    return self._contents[offset:offset + length]
+
+  def _dict_refs(self, ref):
+    """Returns the (key refs, value refs) of a dictionary object."""
+    offset = self._offsets[ref]
+    marker = self._contents[offset]
+    if marker & 0xF0 != 0xD0:
+      raise _UnsupportedPlistError()
+    count, offset = self._read_size(marker & 0xF, offset + 1)
+    refs = self._read_uints(offset, count * 2, self._ref_size)
+    return refs[:count], refs[count:]
+
+  def read(self, ref):
+    """Returns the decoded object with the given reference."""
+    if ref >= len(self._offsets) or ref in self._reading:
+      # Broken, or a cycle, which can't come out of the XML conversion.
+      raise _UnsupportedPlistError()
+    offset = self._offsets[ref]
+    marker = self._contents[offset]
+    high, low = marker & 0xF0, marker & 0xF
+    offset += 1
+
+    if marker == 0x08:
+      return False
+    if marker == 0x09:
+      return True
+    if high == 0x10 and low <= 4:
+      return int.from_bytes(
+          self._bytes(offset, 1 << low), 'big', signed=low >= 3)
+    if marker == 0x22:
+      return struct.unpack('>f', self._bytes(offset, 4))[0]
+    if marker == 0x23:
+      return struct.unpack('>d', self._bytes(offset, 8))[0]
+    if marker == 0x33:
+      seconds = struct.unpack('>d', self._bytes(offset, 8))[0]
+      return (binary_writer.EPOCH + datetime.timedelta(seconds=seconds)
+             ).replace(microsecond=0)
+    if high == 0x80:
+      return {'CF$UID': int.from_bytes(self._bytes(offset, low + 1), 'big')}
+    if high not in (0x40, 0x50, 0x60, 0xA0, 0xD0):
+      raise _UnsupportedPlistError()
+
+    if high == 0xD0:
+      key_refs, value_refs = self._dict_refs(ref)
+      self._reading.add(ref)
+      result = {}
+      for key_ref, value_ref in zip(key_refs, value_refs):
+        key = self.read(key_ref)
+        if not isinstance(key, str):
+          raise _UnsupportedPlistError()
+        result[key] = self.read(value_ref)
+      self._reading.discard(ref)
+      return result
+
+    length, offset = self._read_size(low, offset)
+    if high == 0x40:
+      return self._bytes(offset, length)
+    if high == 0x50:
+      return self._bytes(offset, length).decode('ascii')
+    if high == 0x60:
+      return self._bytes(offset, length * 2).decode('utf-16be')
+    self._reading.add(ref)
+    result = [self.read(r)
+              for r in self._read_uints(offset, length, self._ref_size)]
+    self._reading.discard(ref)
+    return result
+
+  def top_level_values(self, keys):
+    """Returns {key: value} for the given keys of the top-level dictionary."""
+    key_refs, value_refs = self._dict_refs(self._top_object)
+    result = {}
+    for key_ref, value_ref in zip(key_refs, value_refs):
+      key = self.read(key_ref)
+      if key in keys and key not in result:
+        result[key] = self.read(value_ref)
+        if len(result) == len(keys):
+          break
+    return result
+
+
+class _XmlTopLevelValues(object):
+  """Finds values of the top-level dictionary of an XML plist with expat.
+
+  Parsing stops once all the keys are found. The XML of each value found is
+  decoded by plistlib on its own, so the values are exactly what decoding
+  the whole file would give. Anything unexpected raises
+  _UnsupportedPlistError; the caller then decodes the whole file instead.
+  """
+
+  def __init__(self, contents, keys):
+    self._contents = contents
+    self._keys = keys
+    self._depth = 0
+    self._key_chars = None
+    self._key = None
+    self._value_start = None
+    self.values = {}
+
+  def find(self):
+    """Parses the document and returns {key: value} for the keys found."""
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = self._start
+    parser.EndElementHandler = self._end
+    parser.CharacterDataHandler = self._data
+    parser.EntityDeclHandler = self._unsupported
+    parser.XmlDeclHandler = self._xml_decl
+    self._parser = parser
+    try:
+      parser.Parse(self._contents, True)
+    except _AllValuesFound:
+      pass
+    except xml.parsers.expat.ExpatError:
+      raise _UnsupportedPlistError()
+    return self.values
+
+  def _unsupported(self, *unused_args):
+    raise _UnsupportedPlistError()
+
+  def _xml_decl(self, unused_version, encoding, unused_standalone):
+    # The values are cut out of the raw bytes and decoded as UTF-8.
+    if encoding and encoding.lower() not in ('utf-8', 'utf8'):
+      raise _UnsupportedPlistError()
+
+  def _start(self, name, unused_attrs):
+    self._depth += 1
+    # <plist> then <dict> are the two outermost elements; the keys and values
+    # of the top-level dictionary are at depth 3.
+    if self._depth <= 2:
+      if name != ('plist', 'dict')[self._depth - 1]:
+        raise _UnsupportedPlistError()
+    elif self._depth == 3:
+      if name == 'key':
+        self._key_chars = []
+      elif self._key in self._keys and self._key not in self.values:
+        self._value_start = self._parser.CurrentByteIndex
+
+  def _data(self, data):
+    if self._key_chars is not None:
+      self._key_chars.append(data)
+
+  def _end(self, name):
+    if self._depth == 3:
+      if name == 'key':
+        self._key = ''.join(self._key_chars)
+        self._key_chars = None
+      else:
+        if self._value_start is not None:
+          end = self._parser.CurrentByteIndex
+          # That's the start of the end tag, or just past an empty element.
+          if self._contents.startswith(b'</', end):
+            end = self._contents.index(b'>', end) + 1
+          self.values[self._key] = plistlib.loads(
+              b'<?xml version="1.0" encoding="UTF-8"?><plist version="1.0">' +
+              self._contents[self._value_start:end] + b'</plist>')
+          self._value_start = None
+          if len(self.values) == len(self._keys):
+            raise _AllValuesFound()
+        self._key = None
+    self._depth -= 1
+
+
+def find(contents, keys):
+  """Returns {key: value} for the given top-level keys of a plist's bytes.
+
+  Only the parts of XML and binary plists needed to find the keys are
+  decoded. If a key appears more than once, the first one is used (whole file
+  decoding would use the last; plists written by tools never have that).
+
+  Args:
+    contents: The bytes of the plist.
+    keys: The set of keys to find.
+  Returns:
+    The values that were found, or None if the values can't be found this way
+    (other formats, or anything unusual) and the whole plist must be decoded.
+  """
+  try:
+    if contents.startswith(b'bplist00'):
+      return _BinaryPlistReader(contents).top_level_values(keys)
+    if contents.startswith(b'<?xml'):
+      return _XmlTopLevelValues(contents, keys).find()
+  except (_UnsupportedPlistError, IndexError, OverflowError, ValueError,
+          struct.error, plistlib.InvalidFileException):
+    pass
+  return None
@@ -0,0 +1,145 @@
+# Copyright 2023 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Serves plisttool requests with Bazel's JSON persistent worker protocol.
+
+plisttool_main only imports this module when run with --persistent_worker.
+"""
+
+from concurrent import futures
+import contextlib
+import io
+import json
+import sys
+import threading
+import traceback
+
+from build_bazel_rules_apple.tools.plisttool import batch
+from build_bazel_rules_apple.tools.plisttool import plisttool
+
+# The most decoded files the worker keeps for later requests. A worker serves
+# many builds, so this bounds its memory rather than sizing it for one build.
+_MAX_CACHED_FILES = 512
+
+
+class ThreadLocalOutput(object):
+  """A stream that sends writes to a per-thread buffer while one is active.
+
+  Installed as sys.stdout and sys.stderr in worker mode so anything a request
+  prints (errors, warnings) ends up in that request's response instead of
+  corrupting the protocol stream or mixing with other requests.
+  """
+
+  def __init__(self, default):
+    self._default = default
+    self._local = threading.local()
+
+  def write(self, text):
+    buffer = getattr(self._local, 'buffer', None)
+    return (buffer or self._default).write(text)
+
+  def flush(self):
+    if getattr(self._local, 'buffer', None) is None:
+      self._default.flush()
+
+  @contextlib.contextmanager
+  def capture(self):
+    """Context manager redirecting this thread's output into a new buffer."""
+    buffer = io.StringIO()
+    self._local.buffer = buffer
+    try:
+      yield buffer
+    finally:
+      self._local.buffer = None
+
+
+class PersistentWorker(object):
+  """Runs PlistTool for requests using Bazel's JSON persistent worker protocol.
+
+  Each line read from the input stream is a WorkRequest whose arguments are
+  the command line for a regular invocation (i.e. the path to a control file).
+  Requests with a non-zero requestId are multiplexed and processed
+  concurrently; a requestId of zero (singleplex) is handled synchronously.
+  Every request gets its own PlistTool and output buffer, and any failure is
+  reported in that request's WorkResponse without stopping the worker. All
+  requests share a PlistCache that checks files for changes, so inputs such
+  as provisioning profile metadata are only parsed again when they change (or
+  after the cache dropped them to make room for more recently used files).
+  """
+
+  def __init__(self, in_stream, out_stream, output, max_workers=None):
+    """Initializes the worker.
+
+    Args:
+      in_stream: Text stream of WorkRequests.
+      out_stream: Text stream to write WorkResponses to.
+      output: The ThreadLocalOutput that sys.stdout/sys.stderr point to.
+      max_workers: Maximum number of requests to process concurrently.
+    """
+    self._in_stream = in_stream
+    self._out_stream = out_stream
+    self._output = output
+    self._max_workers = max_workers
+    self._out_lock = threading.Lock()
+    self._plist_cache = batch.PlistCache(
+        check_files=True, max_entries=_MAX_CACHED_FILES)
+
+  def run(self):
+    """Processes requests until the input stream is closed."""
+    with futures.ThreadPoolExecutor(
+        max_workers=self._max_workers) as executor:
+      for line in self._in_stream:
+        if not line.strip():
+          continue
+        request = json.loads(line)
+        if request.get('cancel'):
+          # Cancellation isn't supported (and so not advertised).
+          continue
+        if request.get('requestId', 0):
+          executor.submit(self._process, request)
+        else:
+          self._process(request)
+
+  def _process(self, request):
+    """Handles one WorkRequest and writes its WorkResponse."""
+    with self._output.capture() as buffer:
+      try:
+        args = plisttool.expand_flagfiles(request.get('arguments', []))
+        if len(args) != 1:
+          sys.stderr.write(
+              'ERROR: Expected exactly one control file, got: %r\n' % args)
+          exit_code = 1
+        else:
+          exit_code = plisttool.run_control_file(args[0], self._plist_cache)
+      except Exception:  # pylint: disable=broad-except
+        traceback.print_exc(file=buffer)
+        exit_code = 1
+    response = {
+        'exitCode': exit_code,
+        'output': buffer.getvalue(),
+        'requestId': request.get('requestId', 0),
+    }
+    with self._out_lock:
+      self._out_stream.write(json.dumps(response) + '\n')
+      self._out_stream.flush()
+
+
+def main():
+  """Runs plisttool as a persistent worker over stdin/stdout."""
+  protocol_out = sys.stdout
+  output = ThreadLocalOutput(sys.stderr)
+  sys.stdout = sys.stderr = output
+  PersistentWorker(sys.stdin, protocol_out, output).run()
+  return 0